@@ -36,6 +36,7 @@ def create_app(config_filename="config.py"):
     from .models.aci.compare import (Compare, CompareResults)
     from .models.aci.definitions import Definitions
     from .models.aci.fabric import Fabric
+    from .models.aci.jobs import Jobs
     from .models.aci.managed_objects import ManagedObjects
     from .models.aci.snapshots import Snapshots
     from .models.app_status import AppStatus
@@ -59,6 +60,10 @@ def create_app(config_filename="config.py"):
 
     # register error handlers
     register_error_handler(app)
+
+    # optional identity map for Rest.load scoped to each request
+    if app.config.get("REST_IDENTITY_MAP", False):
+        register_identity_map(app)
     
     # if cors is enabled, add to entire app
     if app.config.get("ENABLE_CORS", False):
@@ -69,6 +74,35 @@ def create_app(config_filename="config.py"):
     return app
 
 
+_worker_models = False
+def register_worker_models():
+    """ import and register aci model objects without creating the full app.
+        Standalone workers only require config, db, and the aci models so api
+        routes, blueprints, and swagger definitions are not built.
+    """
+    global _worker_models
+    if _worker_models or _app is not None: return
+    from .models.aci.compare import (Compare, CompareResults)
+    from .models.aci.definitions import Definitions
+    from .models.aci.fabric import Fabric
+    from .models.aci.jobs import Jobs
+    from .models.aci.managed_objects import ManagedObjects
+    from .models.aci.snapshots import Snapshots
+    from .models.rest import register
+    register(None, uni=False)
+    _worker_models = True
+
+def register_identity_map(app):
+    """ activate a new Rest identity map at the start of each request """
+    from .models.rest import IdentityMap
+    def start_identity_map():
+        g.identity_map = IdentityMap().activate()
+    def stop_identity_map(exception=None):
+        imap = getattr(g, "identity_map", None)
+        if imap is not None: imap.deactivate()
+    app.before_request(start_identity_map)
+    app.teardown_request(stop_identity_map)
+
 def register_error_handler(app):    
     """ register error handler's for common error codes to app """
     def error_handler(error):
@@ -0,0 +1,494 @@
+"""
+    Snapshot archive functions.  New snapshots are stored in an indexed 
+    container so readers can access individual members without extracting the
+    full snapshot:
+        MAGIC                       8 byte magic ("SCSNAP01")
+        <member data>               each member compressed independently
+        <index>                     json index of all members
+        <footer>                    index offset, index length, and MAGIC
+
+    The index has the following format where md5 is calculated over the stored
+    (compressed) member data:
+        {
+            "version": 1,
+            "codec": <default codec>,
+            "members": {
+                <name>: {
+                    "offset": int, "length": int, "size": int, "md5": str,
+                    "codec": str, "node": str, "classname": str
+                }
+            }
+        }
+    The md5 of the index is used as the checksum of the snapshot.
+
+    Legacy snapshots are tar containers (optionally gzip compressed) with the
+    following members and are still supported for extraction:
+        ./bundle.<ext>              compressed tar of snapshot contents
+        ./md5checksum.json          {"md5checksum": <md5 of bundle>, "codec": <codec>}
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import tarfile
+import time
+import zlib
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CODEC = "gzip"
+CHUNK_SIZE = 65536
+MAGIC = "SCSNAP01"
+FOOTER = struct.Struct(">QQ8s")     # index offset, index length, MAGIC
+INDEX_VERSION = 1
+NODE_MEMBER_REGEX = re.compile("^node-(?P<node>[0-9]+)/(?P<classname>.+)\.json$")
+
+class Lz4Compressor(object):
+    """ wrapper for lz4.frame compressor to provide compressobj interface """
+    def __init__(self, level):
+        self.compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self.started = False
+
+    def compress(self, data):
+        if not self.started:
+            self.started = True
+            return self.compressor.begin() + self.compressor.compress(data)
+        return self.compressor.compress(data)
+
+    def flush(self):
+        if not self.started:
+            self.started = True
+            return self.compressor.begin() + self.compressor.flush()
+        return self.compressor.flush()
+
+# supported codecs indexed by name.  Each codec provides an extension for the
+# bundle, the default compression level, a function returning a compressobj for
+# a provided level and a function returning a decompressobj
+CODECS = {
+    "gzip": {
+        "ext": "tgz",
+        "level": 6,
+        "compressobj": lambda level: zlib.compressobj(level, zlib.DEFLATED,
+                                        16+zlib.MAX_WBITS),
+        "decompressobj": lambda: zlib.decompressobj(16+zlib.MAX_WBITS),
+    },
+}
+
+# optional codecs only available if corresponding package is installed
+try:
+    import zstandard
+    CODECS["zstd"] = {
+        "ext": "tzst",
+        "level": 3,
+        "compressobj": lambda level: zstandard.ZstdCompressor(
+                                        level=level).compressobj(),
+        "decompressobj": lambda: zstandard.ZstdDecompressor().decompressobj(),
+    }
+except ImportError as e: pass
+try:
+    import lz4.frame
+    CODECS["lz4"] = {
+        "ext": "tlz4",
+        "level": 0,
+        "compressobj": lambda level: Lz4Compressor(level),
+        "decompressobj": lambda: lz4.frame.LZ4FrameDecompressor(),
+    }
+except ImportError as e: pass
+
+def get_codec(codec):
+    """ return codec dict for provided codec name or None if not available """
+    if codec not in CODECS:
+        logger.warn("codec %s not available, supported codecs: %s", codec,
+            CODECS.keys())
+        return None
+    return CODECS[codec]
+
+class HashWriter(object):
+    """ file-like object that calculates md5 and size of data written to
+        underlying file object
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size+= len(data)
+        self.fileobj.write(data)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+class HashReader(object):
+    """ file-like object that calculates md5 of data read from underlying file
+        object
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+        return data
+
+    def drain(self):
+        """ read remaining data so md5 covers the full object """
+        while len(self.read(CHUNK_SIZE))>0: pass
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+class CompressWriter(object):
+    """ file-like object that compresses data with compressobj before writing
+        to underlying file object.  close must be called to flush remaining
+        compressed data, the underlying file object is not closed.
+    """
+    def __init__(self, fileobj, compressobj):
+        self.fileobj = fileobj
+        self.compressobj = compressobj
+
+    def write(self, data):
+        data = self.compressobj.compress(data)
+        if len(data)>0: self.fileobj.write(data)
+
+    def close(self):
+        data = self.compressobj.flush()
+        if len(data)>0: self.fileobj.write(data)
+
+class DecompressReader(object):
+    """ file-like object that decompresses data read from underlying file
+        object with decompressobj
+    """
+    def __init__(self, fileobj, decompressobj):
+        self.fileobj = fileobj
+        self.decompressobj = decompressobj
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size<0 or len(self.buf)-self.pos < size):
+            chunk = self.fileobj.read(CHUNK_SIZE)
+            data = ""
+            if len(chunk) == 0:
+                self.eof = True
+                if hasattr(self.decompressobj, "flush"):
+                    data = self.decompressobj.flush()
+            else:
+                data = self.decompressobj.decompress(chunk)
+            if len(data)>0:
+                self.buf = self.buf[self.pos:] + data
+                self.pos = 0
+        if size<0: end = len(self.buf)
+        else: end = min(len(self.buf), self.pos+size)
+        data = self.buf[self.pos:end]
+        self.pos = end
+        return data
+
+class SectionReader(object):
+    """ file-like object limited to length bytes from offset of file object """
+    def __init__(self, fileobj, offset, length):
+        self.fileobj = fileobj
+        self.fileobj.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size<0 or size>self.remaining: size = self.remaining
+        if size == 0: return ""
+        data = self.fileobj.read(size)
+        self.remaining-= len(data)
+        return data
+
+class SnapshotWriter(object):
+    """ create indexed snapshot at provided path.  Each member is compressed
+        and hashed in a single pass as it is added.  close must be called to
+        write the index and footer.
+    """
+    def __init__(self, path, codec=DEFAULT_CODEC, level=None):
+        self.codec = get_codec(codec)
+        if self.codec is None: raise Exception("unsupported codec %s" % codec)
+        self.codec_name = codec
+        self.level = level
+        if self.level is None or self.level<=0: self.level = self.codec["level"]
+        self.path = path
+        self.members = {}
+        self.md5 = None
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+
+    def add(self, name, path):
+        """ add file at path to snapshot as member with provided name """
+        offset = self.f.tell()
+        hw = HashWriter(self.f)
+        cw = CompressWriter(hw, self.codec["compressobj"](self.level))
+        size = 0
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if len(data) == 0: break
+                size+= len(data)
+                cw.write(data)
+        cw.close()
+        member = {
+            "offset": offset,
+            "length": hw.size,
+            "size": size,
+            "md5": hw.hexdigest(),
+            "codec": self.codec_name,
+        }
+        r = NODE_MEMBER_REGEX.search(name)
+        if r is not None:
+            member["node"] = r.group("node")
+            member["classname"] = r.group("classname")
+        self.members[name] = member
+
+    def close(self):
+        """ write index and footer, return md5 of index """
+        index = json.dumps({
+            "version": INDEX_VERSION,
+            "codec": self.codec_name,
+            "members": self.members,
+        }, sort_keys=True)
+        offset = self.f.tell()
+        self.f.write(index)
+        self.f.write(FOOTER.pack(offset, len(index), MAGIC))
+        self.f.close()
+        self.md5 = hashlib.md5(index).hexdigest()
+        return self.md5
+
+class SnapshotReader(object):
+    """ random access reader for indexed snapshot """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        try:
+            self.f.seek(-FOOTER.size, os.SEEK_END)
+            (offset, length, magic) = FOOTER.unpack(self.f.read(FOOTER.size))
+            if magic != MAGIC: raise Exception("invalid snapshot footer")
+            self.f.seek(offset)
+            index = self.f.read(length)
+            self.md5 = hashlib.md5(index).hexdigest()
+            index = json.loads(index)
+            self.codec = index.get("codec", DEFAULT_CODEC)
+            self.members = index["members"]
+        except Exception as e:
+            self.f.close()
+            raise e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def names(self):
+        """ return sorted list of member names """
+        return sorted(self.members.keys())
+
+    def _stream(self, name, out):
+        # decompress member into out file object and return True if md5 of
+        # stored data matches index
+        member = self.members[name]
+        c = get_codec(member.get("codec", self.codec))
+        if c is None: return False
+        reader = HashReader(SectionReader(self.f, member["offset"],
+                    member["length"]))
+        dec = DecompressReader(reader, c["decompressobj"]())
+        while True:
+            data = dec.read(CHUNK_SIZE)
+            if len(data) == 0: break
+            out.write(data)
+        reader.drain()
+        if reader.hexdigest() != member["md5"]:
+            logger.warn("snapshot %s member %s invalid md5(%s) expected(%s)",
+                self.path, name, reader.hexdigest(), member["md5"])
+            return False
+        return True
+
+    def extract(self, name, dst):
+        """ extract member into dst directory, return boolean success.  The
+            member is written to a temporary file and renamed once verified so
+            concurrent readers never see a partial member.
+        """
+        if not safe_name(name):
+            logger.warn("snapshot %s unsupported member: %s", self.path, name)
+            return False
+        path = os.path.join(dst, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            try: os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if not os.path.isdir(os.path.dirname(path)): raise e
+        tmp = "%s.tmp.%s" % (path, os.getpid())
+        try:
+            with open(tmp, "wb") as out:
+                if not self._stream(name, out): return False
+            os.rename(tmp, path)
+            return True
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+
+def is_indexed(path):
+    """ return True if snapshot at path is an indexed snapshot """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def get_checksum(path):
+    """ return dict with md5checksum, codec, and indexed flag for snapshot at
+        path without extracting the snapshot, or None on error
+    """
+    try:
+        if is_indexed(path):
+            with SnapshotReader(path) as reader:
+                return {
+                    "md5checksum": reader.md5,
+                    "codec": reader.codec,
+                    "indexed": True
+                }
+        with tarfile.open(path, "r:*") as container:
+            for m in container.getmembers():
+                if os.path.basename(m.name) == "md5checksum.json":
+                    info = json.load(container.extractfile(m))
+                    if "md5checksum" not in info: break
+                    if "codec" not in info: info["codec"] = DEFAULT_CODEC
+                    info["indexed"] = False
+                    return info
+        logger.warn("snapshot %s missing or invalid md5checksum.json", path)
+    except Exception as e:
+        logger.warn("failed to read snapshot %s checksum: %s", path, e)
+    return None
+
+def create_snapshot(src, path, codec=DEFAULT_CODEC, level=None):
+    """ create indexed snapshot at path with all files in src directory
+        compressed with provided codec.
+
+        return md5 of the snapshot index on success else None
+    """
+    logger.debug("creating snapshot %s from %s (codec: %s, level: %s)", path,
+        src, codec, level)
+    ts = time.time()
+    try:
+        writer = SnapshotWriter(path, codec=codec, level=level)
+        for (dirpath, dirnames, filenames) in os.walk(src):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                fname = os.path.join(dirpath, fname)
+                if os.path.realpath(fname) == os.path.realpath(path): continue
+                writer.add(os.path.relpath(fname, src), fname)
+        md5 = writer.close()
+        logger.debug("snapshot %s created in %f, md5: %s", path,
+            time.time()-ts, md5)
+        return md5
+    except Exception as e:
+        logger.warn("failed to create snapshot %s: %s", path, e)
+        return None
+
+def safe_name(name):
+    """ return True if member name is relative path within the extraction 
+        directory
+    """
+    name = os.path.normpath(name)
+    return not (os.path.isabs(name) or name == ".." or name.startswith("../"))
+
+def safe_member(member):
+    """ return True if tar member is regular file or directory within the
+        extraction directory
+    """
+    if not (member.isfile() or member.isdir()): return False
+    return safe_name(member.name)
+
+def extract_snapshot(path, dst, select=None):
+    """ extract the contents of the snapshot at path into dst directory
+        verifying md5 at the same time.  Caller is responsible for cleaning up
+        dst on failure.
+
+        select is an optional function that receives a member name (i.e., 
+        node-101/fvCEp.json) and returns True if the member should be 
+        extracted.  select is only applied to indexed snapshots, legacy 
+        snapshots are always fully extracted.
+
+        return dict with md5checksum, codec, and indexed flag on success else
+        None
+    """
+    logger.debug("extracting snapshot %s to %s", path, dst)
+    ts = time.time()
+    try:
+        if is_indexed(path):
+            with SnapshotReader(path) as reader:
+                count = 0
+                for name in reader.names():
+                    if select is not None and not select(name): continue
+                    if not reader.extract(name, dst): return None
+                    count+= 1
+                logger.debug("snapshot %s extracted %s/%s members in %f", path,
+                    count, len(reader.members), time.time()-ts)
+                return {
+                    "md5checksum": reader.md5,
+                    "codec": reader.codec,
+                    "indexed": True
+                }
+        # outer container is uncompressed tar or legacy gzip tar
+        with tarfile.open(path, "r:*") as container:
+            members = {}
+            for m in container.getmembers():
+                members[os.path.basename(m.name)] = m
+            if "md5checksum.json" not in members:
+                logger.warn("snapshot %s missing md5checksum.json", path)
+                return None
+            info = json.load(container.extractfile(members["md5checksum.json"]))
+            if "md5checksum" not in info:
+                logger.warn("snapshot %s invalid md5checksum.json", path)
+                return None
+            if "codec" not in info: info["codec"] = DEFAULT_CODEC
+            c = get_codec(info["codec"])
+            if c is None: return None
+            bundle = "bundle.%s" % c["ext"]
+            if bundle not in members:
+                logger.warn("snapshot %s missing %s", path, bundle)
+                return None
+            reader = HashReader(container.extractfile(members[bundle]))
+            tar = tarfile.open(fileobj=DecompressReader(reader,
+                    c["decompressobj"]()), mode="r|")
+            for m in tar:
+                if not safe_member(m):
+                    logger.warn("snapshot %s unsupported member: %s",path,m.name)
+                    return None
+                tar.extract(m, dst)
+            tar.close()
+            reader.drain()
+            if reader.hexdigest() != info["md5checksum"]:
+                logger.warn("snapshot %s invalid md5(%s) expected(%s)", path,
+                    reader.hexdigest(), info["md5checksum"])
+                return None
+        logger.debug("snapshot %s extracted in %f", path, time.time()-ts)
+        info["indexed"] = False
+        return info
+    except Exception as e:
+        logger.warn("failed to extract snapshot %s: %s", path, e)
+        return None
+
+def convert_snapshot(path, dst, tmp, codec=DEFAULT_CODEC, level=None):
+    """ convert legacy snapshot at path to indexed snapshot at dst using tmp
+        as working directory for extraction.
+
+        return md5 of new snapshot on success else None
+    """
+    logger.debug("converting snapshot %s to %s", path, dst)
+    if os.path.exists(tmp):
+        logger.warn("tmp directory already exists: %s", tmp)
+        return None
+    try:
+        os.makedirs(tmp)
+        if extract_snapshot(path, tmp) is None: return None
+        return create_snapshot(tmp, dst, codec=codec, level=level)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
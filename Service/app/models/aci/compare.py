@@ -3,22 +3,32 @@ Compare two snapshots and save the results to database. The comparision is
 started as a background task as soon as Compare object is created. CompareResult
 objects are created keyed with compare_id of corresponding Compare object. 
 Once comparision is complete, application can query for corresponding 
-CompareResults.
+CompareResults.  The created, deleted, modified, and equal entries of each
+CompareResult are stored in CompareResultsChunks and can be paged through with
+the entries route of the result.
 """
+from ..rest import IdentityMap
 from ..rest import Rest
+from ..rest import Role
 from ..rest import api_callback
 from ..rest import api_register
 from ..rest import api_route
 from ..utils import get_app_config
 from ..utils import get_db
+from ..utils import get_user_params
 from ..utils import format_timestamp
+from . import archive
+from . import jobs
 from . import utils as aci_utils
 from .definitions import Definitions
+from .extract_cache import ExtractCache
 from .managed_objects import ManagedObjects
 from .remap import Remap
 from .remap import expand_range
+from .remap import get_range_set
 from .snapshots import Snapshots
 
+from bson.objectid import ObjectId
 from flask import abort, jsonify
 from multiprocessing import Pool
 from multiprocessing import current_process
@@ -28,15 +38,93 @@ from werkzeug.exceptions import (NotFound, BadRequest)
 import copy
 import json
 import logging
+import multiprocessing
 import os
 import re
 import shutil
+import threading
 import time
 import traceback
 
 # module level logging
 logger = logging.getLogger(__name__)
 
+@api_register(path="/aci/compare/results/chunks")
+class CompareResultsChunks(Rest):
+    """ ACI Compare Result chunk of created, deleted, modified, or equal entries
+        for a single CompareResult.  Not directly exposed through the api.
+    """
+    logger = logging.getLogger(__name__)
+
+    META_ACCESS = {
+        "create": False,
+        "read": False,
+        "update": False,
+        "delete": False,
+    }
+
+    META = {
+        "compare_id": {
+            "key": True,
+            "key_index": 0,
+        },
+        "node_id": {
+            "type": int,
+            "key": True,
+            "key_index": 1,
+        },
+        "classname": {
+            "key": True,
+            "key_index": 2,
+        },
+        "type": {
+            "key": True,
+            "key_index": 3,
+            "values": ["created", "deleted", "modified", "equal"],
+        },
+        "index": {
+            "type": int,
+            "key": True,
+            "key_index": 4,
+            "description": "chunk sequence number within list",
+        },
+        "start": {
+            "type": int,
+            "description": "list index of first entry in chunk",
+        },
+        "stop": {
+            "type": int,
+            "description": "list index after last entry in chunk",
+        },
+        "entries": {
+            "type": list,
+            "subtype": dict,
+        },
+    }
+
+    @classmethod
+    def get_entries(cls, compare_id, node_id, classname, entry_type, start=0, stop=None):
+        """ return list of entries for a single CompareResult list, reading only the chunks
+            covering the entries from start up to (not including) stop
+        """
+        filters = {
+            "compare_id": compare_id,
+            "node_id": node_id,
+            "classname": classname,
+            "type": entry_type,
+        }
+        if start > 0: filters["stop"] = {"$gt": start}
+        if stop is not None: filters["start"] = {"$lt": stop}
+        offset = None
+        entries = []
+        chunks = cls.read(_filters=filters, _params={"sort":"index"}, _disable_page=True)
+        for c in chunks["objects"]:
+            if offset is None: offset = c["start"]
+            entries+= c["entries"]
+        if offset is None: return []
+        if stop is None: return entries[start-offset:]
+        return entries[start-offset:stop-offset]
+
 @api_register(path="/aci/compare/results")
 class CompareResults(Rest):
     """ ACI Compare Result REST class """
@@ -50,6 +138,11 @@ class CompareResults(Rest):
         "delete": False,
     }
 
+    # lists of objects stored in CompareResultsChunks for chunked results
+    ENTRY_TYPES = ["created", "deleted", "modified", "equal"]
+    # attributes shared with CompareResultsChunks
+    CHUNK_KEYS = ["compare_id", "node_id", "classname"]
+
     META = {
         "compare_id": {},
         "node_id": {
@@ -57,6 +150,12 @@ class CompareResults(Rest):
         },
         "classname": {},
         "name": {},
+        "chunked": {
+            "type": bool,
+            "default": False,
+            "description": """entries for created, deleted, modified, and equal
+                are stored in separate chunks""",
+        },
         "total": {
             "type": dict,
             "meta": {
@@ -77,16 +176,19 @@ class CompareResults(Rest):
         "created": {
             "type":list,
             "subtype":dict,
+            "bulk_read":False,
             "description": "list of new objects between snapshots",
         },
         "deleted": {
             "type":list,
             "subtype":dict,
+            "bulk_read":False,
             "description": "list of deleted objects between snapshots",
         },
         "modified": {
             "type":list,
             "subtype":dict,
+            "bulk_read":False,
             "description": """list of modified objects between snapshots. Note
                 only changed tracked attributes that have changed are recorded.
             """
@@ -94,10 +196,140 @@ class CompareResults(Rest):
         "equal": {
             "type":list,
             "subtype":dict,
+            "bulk_read":False,
             "description": "list of objects with no changes between snapshots",
         },
     }
 
+    def split_entries(self, chunk_size):
+        """ move created, deleted, modified, and equal entries into CompareResultsChunks of at
+            most chunk_size entries leaving only the summary within this result.
+            return list of CompareResultsChunks objects
+        """
+        chunks = []
+        for t in CompareResults.ENTRY_TYPES:
+            entries = getattr(self, t)
+            for index, start in enumerate(xrange(0, len(entries), chunk_size)):
+                chunks.append(CompareResultsChunks(
+                    compare_id = self.compare_id,
+                    node_id = self.node_id,
+                    classname = self.classname,
+                    type = t,
+                    index = index,
+                    start = start,
+                    stop = min(start+chunk_size, len(entries)),
+                    entries = entries[start:start+chunk_size],
+                ))
+            setattr(self, t, [])
+        self.chunked = True
+        return chunks
+
+    @classmethod
+    @api_callback("after_read")
+    def after_results_read(cls, data):
+        """ rebuild created, deleted, modified, and equal lists from chunks for chunked results
+            where the list is included in the read
+        """
+        objects = []
+        for o in data.get("objects", []):
+            for t in cls.ENTRY_TYPES:
+                if t in o and len(o[t]) == 0:
+                    objects.append(o)
+                    break
+        if len(objects) == 0: return data
+
+        # keys and chunked flag may have been excluded from the read
+        info = {}
+        missing = []
+        for o in objects:
+            if "_id" not in o: continue
+            if "chunked" in o and "compare_id" in o and "node_id" in o and "classname" in o:
+                info[o["_id"]] = o
+            else:
+                missing.append(ObjectId(o["_id"]))
+        if len(missing) > 0:
+            ret = cls.read(_filters={"_id": {"$in": missing}}, _disable_page=True,
+                        _params={"include": "compare_id,node_id,classname,chunked"})
+            for o in ret["objects"]: info[o["_id"]] = o
+
+        for o in objects:
+            i = info.get(o.get("_id", None), None)
+            if i is None or not i.get("chunked", False): continue
+            for t in cls.ENTRY_TYPES:
+                if t in o and len(o[t]) == 0:
+                    o[t] = CompareResultsChunks.get_entries(i["compare_id"], i["node_id"],
+                                i["classname"], t)
+        return data
+
+    @classmethod
+    @api_callback("before_delete")
+    def before_results_delete(cls, filters):
+        """ delete corresponding CompareResultsChunks when deleting CompareResults.  Chunks share
+            the compare_id, node_id, and classname attributes so a filter on only those
+            attributes (i.e., all results of a compare) is applied directly to the chunks
+        """
+        if all(k in cls.CHUNK_KEYS for k in filters):
+            CompareResultsChunks.delete(_filters=dict(filters))
+            return filters
+        # other filters require the keys of each chunked result
+        objs = cls.read(_filters={"$and": [filters, {"chunked": True}]}, _disable_page=True,
+                    _params={"include":"compare_id,node_id,classname"})
+        chunked = []
+        for o in objs.get("objects", []):
+            chunked.append({
+                "compare_id": o["compare_id"],
+                "node_id": o["node_id"],
+                "classname": o["classname"],
+            })
+        # delete in batches to limit size of each delete request
+        for i in xrange(0, len(chunked), 1000):
+            CompareResultsChunks.delete(_filters={"$or": chunked[i:i+1000]})
+        return filters
+
+    @classmethod
+    @api_route(path="entries", methods=["GET"], keyed_url=True, role=Role.USER, swag_args=[],
+                swag_ret=["count", "objects"])
+    def read_entries(cls, _id):
+        """ read a page of created, deleted, modified, or equal entries of a compare result without
+            reading the full list.  Provide url parameter 'type' along with optional 'page' and
+            'page-size'
+        """
+        params = get_user_params()
+        entry_type = params.get("type", "")
+        if entry_type not in cls.ENTRY_TYPES:
+            abort(400, "invalid type '%s', expected one of: %s" % (entry_type,
+                ", ".join(cls.ENTRY_TYPES)))
+        page = params.get("page", 0)
+        pagesize = params.get("page-size", cls.DEFAULT_PAGE_SIZE)
+        try: page = int(page)
+        except Exception as e: abort(400, "invalid page value: %s" % page)
+        try: pagesize = int(pagesize)
+        except Exception as e: abort(400, "invalid pagesize: %s" % pagesize)
+        if page < 0:
+            abort(400, "page cannot be less than zero: %s" % page)
+        if pagesize <= 0:
+            abort(400, "page-size cannot be <= zero: %s" % pagesize)
+        if pagesize > cls.MAX_PAGE_SIZE:
+            abort(400,"page-size %s exceeds max: %s" % (pagesize,cls.MAX_PAGE_SIZE))
+
+        ret = cls.read(_id=_id, _params={"include":"compare_id,node_id,classname,chunked,total"})
+        o = ret["objects"][0]
+        start = page*pagesize
+        stop = start + pagesize
+        if o.get("chunked", False):
+            entries = CompareResultsChunks.get_entries(o["compare_id"], o["node_id"],
+                        o["classname"], entry_type, start=start, stop=stop)
+        else:
+            # results without chunks contain the full list
+            ret = cls.read(_id=_id, _params={"include":entry_type})
+            entries = ret["objects"][0].get(entry_type, [])[start:stop]
+        return jsonify({
+            "count": o.get("total", {}).get(entry_type, 0),
+            "page": page,
+            "page-size": pagesize,
+            "objects": entries,
+        })
+
 @api_register(path="/aci/compare")
 class Compare(Rest):
     """ ACI Compare REST class """
@@ -183,6 +415,16 @@ class Compare(Rest):
             "default": False,
             "description": "include timestamp attributes in comparision"
         },
+        "equal_mode": {
+            "type": str,
+            "default": "full",
+            "values": ["full", "keys", "count"],
+            "description": """ objects that are equal between snapshots are 
+            always counted. Set to 'full' (default) to store compared attributes
+            of each equal object, 'keys' to store only the key of each equal 
+            object, or 'count' to store only the count
+            """
+        },
         "start_time": {
             "type": float,
             "description": "unix timestamp when compare was started",
@@ -209,6 +451,18 @@ class Compare(Rest):
             "default":"",
             "write":False,
         },
+        "lease_owner":{
+            "type":str,
+            "default":"",
+            "write":False,
+            "description":"worker holding the lease on a running compare",
+        },
+        "heartbeat":{
+            "type":float,
+            "default":0.0,
+            "write":False,
+            "description":"unix timestamp of last heartbeat from running compare",
+        },
         "total":{
             "type": dict,
             "write": False,
@@ -223,6 +477,7 @@ class Compare(Rest):
         "total_per_class":{
             "type":list,
             "write":False,
+            "bulk_read":False,
             "description":"total created/modified/delete counts per class",
             "subtype":dict,
             "meta":{
@@ -237,6 +492,7 @@ class Compare(Rest):
         "total_per_node":{
             "type":list,
             "write":False,
+            "bulk_read":False,
             "description":"total created/modified/delete counts per node",
             "subtype":dict,
             "meta":{
@@ -301,12 +557,25 @@ class Compare(Rest):
 
         if self.status == "running" or self.status == "abort":
             abort(400, "compare %s currently running, send abort before restart"%(self._id))
-        # set start time to 'now' before executing background worker
-        self.start_time = time.time()
-        self.save()
+        # set status to init and start time to 'now' with a single 
+        # compare-and-set so concurrent restart requests cannot start the same
+        # compare twice.  A compare still in init is only restarted once the
+        # previous start has expired
+        ts = time.time()
+        timeout = get_app_config().get("JOB_LEASE_TIMEOUT", 120.0)
+        r = get_db()[self._classname].find_one_and_update({
+            "_id": ObjectId(self._id),
+            "$or": [
+                {"status": {"$nin": ["init", "running", "abort"]}},
+                {"status": "init", "start_time": {"$not": {"$gte": ts-timeout}}},
+            ]
+        }, {"$set": {"status": "init", "start_time": ts}})
+        if r is None:
+            abort(400, "compare %s already started" % self._id)
         # delete old compare results before starting/restarting background process
         CompareResults.delete(compare_id=self._id)
-        if not aci_utils.execute_worker("--compare %s" % self._id):
+        s1 = Snapshots.load(_id=self.snapshot1)
+        if not jobs.submit("compare", self._id, fabric=s1.fabric):
             abort(500, "failed to start background snapshot process")
         return jsonify({"success":True})
 
@@ -334,22 +603,36 @@ class Compare(Rest):
             return jsonify({"success":True})
 
 def execute_compare(compare_id):
-    """ perform comparison between two snapshots """
+    """ perform comparison between two snapshots.  The compare is set to running
+        with a lease on the compare object so the same compare is never 
+        executed by two workers.
+    """
     logger.debug("execute compare for: %s" % compare_id)
 
-    ts = time.time()    
+    # init progress, error, status to block second process from running.  Only
+    # a compare in init can be claimed (start_compare resets the status to init
+    # on restart) so a requeued or duplicate job never re-runs a finished compare
+    lease = jobs.Lease(Compare, compare_id)
+    if not lease.acquire(["init"], update={
+            "progress": 0.0,
+            "start_time": time.time(),
+            "total_time": 0,
+            "error": "",
+        }):
+        logger.warn("compare %s not found or already running" % compare_id)
+        return
+    try:
+        run_compare(compare_id, lease)
+    finally:
+        lease.release()
+
+def run_compare(compare_id, lease):
+    """ perform comparison for compare object with lease held """
     c = Compare.load(_id=compare_id)
     if not c.exists():
         logger.warn("compare object %s not found" % compare_id)
         return
-
-    # init progress, error, status to block second process from running
-    c.progess = 0.0
-    c.start_time = ts
-    c.total_time = 0
-    c.error = ""
-    c.status = "running"
-    c.save()
+    ts = c.start_time
 
     # delete any previous CompareResults
     CompareResults.delete(_filters={"compare_id":c._id})
@@ -358,6 +641,13 @@ def execute_compare(compare_id):
     config = get_app_config()
     tmp = config.get("TMP_DIR", "/tmp/")
     tmp = "%s/compare.%s.%s" % (tmp, c._id, int(ts)) 
+
+    # extracted snapshots are shared through extraction cache if enabled
+    cache = None
+    handles = []
+    if config.get("EXTRACT_CACHE_MAX_SIZE", 0) > 0:
+        cache = ExtractCache(config.get("EXTRACT_CACHE_DIR"), 
+                    config.get("EXTRACT_CACHE_MAX_SIZE"))
     
     # update state with error message and error status
     def fail(msg="", cleanup=True):
@@ -365,12 +655,15 @@ def execute_compare(compare_id):
         c.status = "error"
         c.total_time = abs(time.time() - ts)
         logger.debug("compare %s failed: %s" % (c._id, c.error))
-        if not c.save(): logger.warn("failed to save compare %s state"%c._id)
+        # compare state is owned by another worker if the lease was lost
+        if lease.lost: logger.debug("lease lost, skipping compare state update")
+        elif not c.save(): logger.warn("failed to save compare %s state"%c._id)
         if cleanup: tmp_cleanup()
         return
 
-    # clean up working directory
+    # clean up working directory and release extraction cache references
     def tmp_cleanup():
+        while len(handles)>0: cache.release(handles.pop())
         if os.path.isdir(tmp):
             logger.debug("cleanup directory %s" % tmp)
             try: shutil.rmtree(tmp)
@@ -390,12 +683,28 @@ def execute_compare(compare_id):
         logger.debug("progress %s/%s = %s" % (i, total, p))
         return
 
-    # user can force compare execution to stop by deleting the object
-    # abort_compare is checked at a regular interval.  If compare was deleted
-    # then perform cleanup and return True, else return False
+    # user can force compare execution to stop by deleting the object or 
+    # setting status to abort.  A single poller thread checks the compare 
+    # object and lease and sets the abort event which is shared with all pool
+    # workers
+    abort_event = multiprocessing.Event()
+    poller_stop = threading.Event()
+    init_compare_worker(abort_event)
+    def poll_abort():
+        interval = config.get("COMPARE_ABORT_POLL_INTERVAL", 1.0)
+        while not poller_stop.wait(interval):
+            try:
+                _s = Compare.load(_id=c._id)
+                if not _s.exists() or _s.status == "abort" or lease.lost:
+                    abort_event.set()
+                    return
+            except Exception as e:
+                logger.warn("failed to check compare %s status: %s", c._id, e)
+
+    # abort_compare is checked at a regular interval.  If compare was aborted
+    # then perform cleanup and raise exception
     def abort_compare():
-        _s = Compare.load(_id=c._id)
-        if not _s.exists() or _s.status == "abort":
+        if abort_event.is_set() or lease.lost:
             logger.debug("compare object %s has been aborted"%c._id)
             tmp_cleanup()
             raise Exception("compare operation %s aborted" % c._id)
@@ -421,6 +730,7 @@ def execute_compare(compare_id):
     else:
         classnames = d.get_managed_objects()
 
+    pool = None
     try:
         # create tmp directory for extracting files
         if os.path.exists(tmp):
@@ -428,39 +738,42 @@ def execute_compare(compare_id):
         logger.debug("make directory: %s" % tmp)
         os.makedirs(tmp)
 
-        # extract snaphots to tmp directories
+        # extract snaphots to extraction cache or tmp directories.  For indexed
+        # snapshots only the top level files are extracted here and node files
+        # are extracted once the required nodes and classes are known.  Legacy
+        # snapshots are always fully extracted
+        def extract(index, s, select):
+            if cache is not None: return cache.extract(handles[index], select)
+            info = archive.extract_snapshot(s.filename, folders[index], select)
+            return info is not None
+        folders = []    # extracted directory for s1 and s2
+        indexed = []    # index of indexed snapshots
         for index, s in enumerate([s1, s2]):
-            td = "%s/%s/%s" % (tmp, index, s._id)
-            logger.debug("make directory: %s" % td)
-            os.makedirs(td)
             if not os.path.exists(s.filename):
                 return fail("snapshot file %s not found" % s.filename)
-            shutil.copy(s.filename, td)
-            fname = s.filename.split("/")[-1]
-            # extract snapshot contents
-            cmd = "cd %s ; tar --force-local -zxf %s" % (td, fname)
-            if aci_utils.run_command(cmd) is None:
-                return fail("failed to extract snapshot %s" % s.id)
-            for f in ["bundle.tgz", "md5checksum.json"]:
-                if not os.path.exists("%s/%s" % (td, f)):
-                    return fail("snapshot %s missing required file %s"%(s.id,f))
-            # check bundle against md5
-            embedded = get_json_data("%s/md5checksum.json" % td)["md5checksum"]
-            md5 = aci_utils.get_file_md5("%s/bundle.tgz" % td)
-            if md5 is None or md5!=embedded:
-                return fail("snapshot %s invalid md5(%s) expected(%s)" % (
-                    s.id, md5, embedded))
-            # extract bundle
-            cmd = "cd %s ; tar -zxf %s" % (td, "bundle.tgz")
-            if aci_utils.run_command(cmd) is None:
-                return fail("failed to extract bundle %s" % s.id)
+            if cache is not None:
+                handle = cache.acquire(s.filename)
+                if handle is None:
+                    return fail("failed to read snapshot %s" % s._id)
+                handles.append(handle)
+                folders.append(handle["path"])
+                if handle["indexed"]: indexed.append(index)
+            else:
+                td = "%s/%s/%s" % (tmp, index, s._id)
+                logger.debug("make directory: %s" % td)
+                os.makedirs(td)
+                folders.append(td)
+                if archive.is_indexed(s.filename): indexed.append(index)
+            # extract snapshot contents and check against md5
+            if not extract(index, s, lambda name: "/" not in name):
+                return fail("failed to extract snapshot %s" % s._id)
            
         # get the union of the list of classes from both s1 and s2 definitions,
         # use the managed_object definition from s2 (should always be the same) 
         # use the definition in s2 for list of objects, attributes, and flags
         # if the classname is not present in definition from s1 then skip it
-        js1 = get_json_data("%s/0/%s/definition.json" % (tmp, s1._id))
-        js2 = get_json_data("%s/1/%s/definition.json" % (tmp, s2._id))
+        js1 = get_json_data("%s/definition.json" % folders[0])
+        js2 = get_json_data("%s/definition.json" % folders[1])
         if len(js1)==0: return fail("invalid definition in snapshot %s"%s1._id)
         if len(js2)==0: return fail("invalid definition in snapshot %s"%s2._id)
         s1_classes = [cn for cn in js1["managed_objects"].keys()]
@@ -474,9 +787,6 @@ def execute_compare(compare_id):
         # build list of all nodes (join of s1 and s2 nodes)
         nodes =[ int(x) for x in sorted(list(set().union(s1.nodes, s2.nodes)))]
 
-        # create pool to perform work
-        pool = Pool(processes=config.get("MAX_POOL_SIZE", 4))
-
         filtered_nodes = []
         for n in nodes:
             if len(c.nodes)==0 or n in c.nodes: filtered_nodes.append(n)
@@ -495,6 +805,25 @@ def execute_compare(compare_id):
             # ensure should be the name of the analyzer
             if len(classnames)==0 or analyzer in classnames: analyzer_work.append(analyzer)
 
+        # extract only required node files from indexed snapshots which is
+        # each class in 'class_work', each class handled by 'analyzer_work',
+        # and each class required for remap along with precomputed remap
+        if len(indexed)>0:
+            required = set(class_work + analyzer_work + Remap.REQUIRED_MANAGED_OBJECTS)
+            required.add(Remap.REMAP_ARTIFACT)
+            for classname in managed_objects:
+                if managed_objects[classname]["analyzer"] in analyzer_work:
+                    required.add(classname)
+            required_nodes = set(["%s" % n for n in filtered_nodes])
+            def select(name):
+                r = archive.NODE_MEMBER_REGEX.search(name)
+                return r is not None and r.group("node") in required_nodes \
+                    and r.group("classname") in required
+            for index in indexed:
+                s = [s1, s2][index]
+                if not extract(index, s, select):
+                    return fail("failed to extract snapshot %s" % s._id)
+
         # think of progress as the sum of all tasks that need to be completed.
         # one task for each class in 'class_work' per node plus
         # one task for each analyzer in 'analyzer_work' per node plus
@@ -505,69 +834,134 @@ def execute_compare(compare_id):
         current_progress = 0
         progress(current_progress, total_progress)
 
-        # perform comparision for each node
+        # build remap for each node and full list of work across all nodes
+        # along with estimated cost of each task (size of snapshot files).
+        # The compare settings, managed objects, and remaps are provided to
+        # each worker once so tasks only carry node, name, and file paths
+        def get_size(path):
+            try: return os.path.getsize(path)
+            except OSError as e: return 0
+        work = []
+        remaps = {}
         for i,n in enumerate(filtered_nodes):
             if n!="0" and c.remap:
                 # build remap for s1 and s2 
-                r1 = Remap(n, "%s/0/%s/node-%s" % (tmp, s1._id, n))
+                r1 = Remap(n, "%s/node-%s" % (folders[0], n))
                 current_progress+=1
-                r2 = Remap(n, "%s/1/%s/node-%s" % (tmp, s2._id, n))
+                r2 = Remap(n, "%s/node-%s" % (folders[1], n))
                 current_progress+=1
             else: 
                 # create disabled remap objects
                 r1 = Remap(n)
                 r2 = Remap(n) 
                 current_progress+=2
+            remaps[n] = (r1, r2)
             progress(current_progress, total_progress) 
     
-            work = []
             # build out classwork
             for classname in class_work:
-                o = managed_objects[classname]
                 cn = "node-%s/%s.json" % (n, classname)
-                f1 = "%s/0/%s/%s" % (tmp, s1._id, cn)
-                f2 = "%s/1/%s/%s" % (tmp, s2._id, cn)
-                work.append(("class", c, o, f1, f2, r1, r2))
-
-            # build out analyzer work
-            f1 = "%s/0/%s/node-%s/" % (tmp, s1._id, n)
-            f2 = "%s/1/%s/node-%s/" % (tmp, s2._id, n)
+                f1 = "%s/%s" % (folders[0], cn)
+                f2 = "%s/%s" % (folders[1], cn)
+                cost = get_size(f1) + get_size(f2)
+                work.append((cost, ("class", n, classname, f1, f2)))
+
+            # build out analyzer work with cost of all classes for analyzer
+            f1 = "%s/node-%s/" % (folders[0], n)
+            f2 = "%s/node-%s/" % (folders[1], n)
             for analyzer in analyzer_work:
-                work.append(("custom", analyzer, c, f1, f2, r1, r2 ))
-                
-            # start the work using multiprocessing or serialize
-            if c.serialize:
-                for w in work: 
-                    generic_compare(w)
-                    current_progress+=1
-                    progress(current_progress, total_progress) 
+                cost = 0
+                for classname in managed_objects:
+                    if managed_objects[classname]["analyzer"] == analyzer:
+                        cost+= get_size("%s%s.json" % (f1, classname))
+                        cost+= get_size("%s%s.json" % (f2, classname))
+                work.append((cost, ("custom", n, analyzer, f1, f2)))
+
+        # schedule largest tasks first so long running tasks do not delay the
+        # end of the compare
+        work.sort(key=lambda w: w[0], reverse=True)
+        work = [w[1] for w in work]
+
+        # group tasks into chunks, results are written in bulk at the end of 
+        # each chunk.  Chunks are small enough to keep all workers busy and
+        # tasks are dealt round-robin so each chunk receives a similar share
+        # of the largest tasks (contiguous slices would put all of the largest
+        # tasks into the first chunk and serialize them on a single worker)
+        pool_size = 1 if c.serialize else config.get("MAX_POOL_SIZE", 4)
+        chunk_size = max(1, min(config.get("COMPARE_RESULT_BATCH_SIZE", 500),
+                                len(work)/(pool_size*4)))
+        n_chunks = (len(work) + chunk_size - 1) / chunk_size
+        chunks = [work[i::n_chunks] for i in xrange(0, n_chunks)]
+        logger.debug("compare %s scheduled %s tasks in %s chunks", c._id, len(work),
+                    len(chunks))
+
+        # start the work using multiprocessing or serialize and update 
+        # progress as each chunk completes. The abort poller is started after
+        # the pool workers are created
+        state = (abort_event, c, managed_objects, remaps)
+        if c.serialize: 
+            init_compare_worker(*state)
+            completed = (compare_chunk(w) for w in chunks)
+        else:
+            # pool workers are forked with the lease heartbeat suspended
+            with lease.suspend():
+                pool = Pool(processes=pool_size, initializer=init_compare_worker, 
+                            initargs=state)
+            completed = pool.imap_unordered(compare_chunk, chunks)
+        poller = threading.Thread(target=poll_abort)
+        poller.daemon = True
+        poller.start()
+        last_progress = time.time()
+        for i, (count, success) in enumerate(completed):
+            if not success: return fail("failed to save compare results")
+            current_progress+= count
+            # check for abort on each completion but limit progress updates
+            if time.time() - last_progress >= 1.0 or i+1 == len(chunks):
+                progress(current_progress, total_progress)
+                last_progress = time.time()
             else:
-                pool.map(generic_compare, work)
-                current_progress+= len(work)
-                progress(current_progress, total_progress) 
+                abort_compare()
+
+        if pool is not None:
+            pool.close()
+            pool.join()
                 
         # cleanup tmp extracted files
         tmp_cleanup() 
 
-        # create totals by summing over current compareResults
+        # create totals by summing over current compareResults. The sum per
+        # classname and node is performed by the db so only total.* counters
+        # are returned instead of full result objects
         counters = ["created", "modified", "deleted", "equal"]
         base = {"created":0, "modified":0, "deleted":0, "equal":0}
         total = copy.deepcopy(base)
         per_class = {}  # indexed per classname
         per_node = {}   # indexed per node_id
-        results = CompareResults.read(compare_id=c._id)
-        for o in results["objects"]:
-            if o["classname"] not in per_class:
-                per_class[o["classname"]] = copy.deepcopy(base)
-                per_class[o["classname"]]["classname"] = o["classname"]
-                per_class[o["classname"]]["name"] = o["name"]
-            if o["node_id"] not in per_node:
-                per_node[o["node_id"]] = copy.deepcopy(base)
-                per_node[o["node_id"]]["node_id"] = o["node_id"]
+        group = {
+            "_id": {"classname": "$classname", "node_id": "$node_id"},
+            "name": {"$first": "$name"},
+        }
+        for counter in counters:
+            group[counter] = {"$sum": "$total.%s" % counter}
+        results = CompareResults.aggregate([
+            {"$match": {"compare_id": c._id}},
+            {"$group": group},
+        ])
+        if results is None: return fail("failed to calculate compare totals")
+        for o in results:
+            classname = o["_id"]["classname"]
+            node_id = o["_id"]["node_id"]
+            if classname not in per_class:
+                per_class[classname] = copy.deepcopy(base)
+                per_class[classname]["classname"] = classname
+                per_class[classname]["name"] = o["name"]
+            if node_id not in per_node:
+                per_node[node_id] = copy.deepcopy(base)
+                per_node[node_id]["node_id"] = node_id
             for counter in counters:
-                per_class[o["classname"]][counter]+= o["total"][counter]
-                per_node[o["node_id"]][counter]+= o["total"][counter]
-                total[counter]+= o["total"][counter]
+                per_class[classname][counter]+= o[counter]
+                per_node[node_id][counter]+= o[counter]
+                total[counter]+= o[counter]
         # save totals
         c.total = total
         c.total_per_class = [per_class[k] for k in sorted(per_class.keys())]
@@ -583,39 +977,158 @@ def execute_compare(compare_id):
     except Exception as e:
         logger.debug(traceback.format_exc())
         fail("unexpected error occurred: %s" % e)
+    finally:
+        # stop any workers left running on error or abort
+        poller_stop.set()
+        if pool is not None: pool.terminate()
+        init_compare_worker(None)
+
+# abort signal shared between execute_compare and compare pool workers
+_abort_event = None
+# compare settings, managed objects indexed by classname, and tuple of remaps
+# (snapshot1, snapshot2) indexed by node for compare tasks in current process
+_compare_state = {}
+def init_compare_worker(abort_event, compare=None, managed_objects=None, remaps=None):
+    """ set abort signal and compare state for current process, used as pool
+        initializer.  Pool workers create their db connection here once 
+        instead of per task
+    """
+    global _abort_event
+    _abort_event = abort_event
+    _compare_state["compare"] = compare
+    _compare_state["managed_objects"] = managed_objects
+    _compare_state["remaps"] = remaps
+    if compare is not None and current_process().name != "MainProcess":
+        logger.debug("creating new db connection object for child process")
+        get_db(uniq=True, overwrite_global=True)
+    # objects loaded by compare tasks (i.e., endpoint analyzer managed object)
+    # are reused for the lifetime of the compare through an identity map
+    if _compare_state.get("identity_map", None) is not None:
+        _compare_state["identity_map"].deactivate()
+    _compare_state["identity_map"] = None
+    if compare is not None:
+        _compare_state["identity_map"] = IdentityMap().activate()
+
+def compare_aborted():
+    """ return True if abort signal is set for the running compare """
+    return _abort_event is not None and _abort_event.is_set()
+
+class ResultSink(object):
+    """ buffer CompareResults and write them to the db with unordered bulk 
+        saves.  A batch is written once the number of results, the number of
+        objects within the results, or the age of the batch exceeds the 
+        provided limits.  Buffered results are not visible in the db until
+        flush is called.
+    """
+    def __init__(self, max_size=500, max_objects=100000, max_time=10, chunk_size=1000):
+        self.pid = os.getpid()
+        self.failed = False     # set when any flush fails until reset by caller
+        self.max_size = max_size
+        self.max_objects = max_objects
+        self.max_time = max_time
+        self.chunk_size = chunk_size
+        self.results = []
+        self.objects = 0
+        self.start = 0
+
+    def add(self, result):
+        """ add CompareResults object to buffer and flush if any limit is 
+            exceeded.  return boolean success
+        """
+        if len(self.results) == 0: self.start = time.time()
+        self.results.append(result)
+        for a in ["created", "deleted", "modified", "equal"]:
+            self.objects+= len(getattr(result, a))
+        if len(self.results) >= self.max_size or \
+            self.objects >= self.max_objects or \
+            time.time() - self.start >= self.max_time:
+            return self.flush()
+        return True
+
+    def flush(self):
+        """ write all buffered results to db. return boolean success """
+        if len(self.results) == 0: return True
+        (results, objects) = (self.results, self.objects)
+        (self.results, self.objects) = ([], 0)
+        ts = time.time()
+        # chunks are written before results so chunked results are complete
+        # once visible
+        chunks = []
+        for r in results: chunks+= r.split_entries(self.chunk_size)
+        if len(chunks)>0 and not CompareResultsChunks.bulk_save(chunks, ordered=False):
+            logger.warn("failed to save %s compare result chunks", len(chunks))
+            self.failed = True
+            return False
+        if not CompareResults.bulk_save(results, ordered=False):
+            logger.warn("failed to save %s compare results", len(results))
+            self.failed = True
+            return False
+        logger.debug("saved %s compare results (%s objects, %s chunks) in %f", 
+            len(results), objects, len(chunks), time.time() - ts)
+        return True
+
+# per-process result sink
+_result_sink = None
+def get_result_sink():
+    """ return ResultSink for the current process.  Buffered results must be
+        flushed by the caller, refer to compare_chunk
+    """
+    global _result_sink
+    if _result_sink is None or _result_sink.pid != os.getpid():
+        config = get_app_config()
+        _result_sink = ResultSink(
+            max_size = config.get("COMPARE_RESULT_BATCH_SIZE", 500),
+            max_objects = config.get("COMPARE_RESULT_BATCH_OBJECTS", 100000),
+            max_time = config.get("COMPARE_RESULT_BATCH_TIME", 10),
+            chunk_size = config.get("COMPARE_RESULT_CHUNK_SIZE", 1000)
+        )
+    return _result_sink
+
+def compare_chunk(work):
+    """ execute generic_compare for each task within work and flush results.
+        return tuple (number of tasks, boolean success) where success is False
+        if any results failed to be written
+    """
+    sink = get_result_sink()
+    for w in work: generic_compare(w)
+    success = sink.flush() and not sink.failed
+    sink.failed = False
+    return (len(work), success)
 
 def generic_compare(args):
     """ execute either per_node_class_comare or per_node_custom_compare
-        based on value at arg[0].
+        based on value at arg[0].  Args is tuple of:
+            (compare_type, node_id, classname or analyzer, file1, file2)
+        compare settings, managed objects, and remaps are set for the current
+        process by init_compare_worker.
         Note, list of args are provided as workaround to Pool.map restriction
     """
-    if current_process().name != "MainProcess":
-        logger.debug("creating new db connection object for child process")
-        get_db(uniq=True, overwrite_global=True)
-
-    args = list(args)
-    compare_type = args.pop(0)
+    if len(args)!=5:
+        logger.warn("invalid arg list for compare: %s" % (args,))
+        return
+    (compare_type, node_id, name, f1, f2) = args
+    compare = _compare_state.get("compare", None)
+    remaps = _compare_state.get("remaps", None)
+    if compare is None or remaps is None or node_id not in remaps:
+        logger.warn("compare state not initialized for node %s" % node_id)
+        return
+    (r1, r2) = remaps[node_id]
     if compare_type == "custom":
-        if len(args)!=6:
-            logger.warn("invalid arg list for custom_compare: %s" % args)
-            return
+        if name == "acls":
+            acl_compare(compare, f1, f2, r1, r2)
+        elif name == "endpoints": 
+            endpoint_compare(compare, f1, f2, r1, r2)
+        elif name == "exclude":
+            # no comparison performed for 'exclude' analyzer
+            pass
         else:
-            custom_type = args.pop(0)
-            if custom_type == "acls":
-                acl_compare(*args)
-            elif custom_type == "endpoints": 
-                endpoint_compare(*args)
-            elif custom_type == "exclude":
-                # no comparison performed for 'exclude' analyzer
-                pass
-            else:
-                logger.warn("unknown custom compare type %s" % custom_type)
+            logger.warn("unknown custom compare type %s" % name)
     elif compare_type == "class":
-        if len(args)!=6:
-            logger.warn("invalid arg list for class_compare: %s" % args)
+        mo = _compare_state["managed_objects"].get(name, None)
+        if mo is None:
+            logger.warn("managed object %s not found for class_compare" % name)
             return
-        else: 
-            per_node_class_compare(*args)
+        per_node_class_compare(compare, mo, f1, f2, r1, r2)
     else:
         logger.warn("unknown compare type %s" % compare_type)
 
@@ -629,6 +1142,50 @@ def get_subset(obj, attributes, key=""):
     if key in obj: ret[key] = obj[key]
     return ret
 
+def range_set_compare(value1, value2, remapper1, remapper2):
+    """ compare two list-expand values as sets of numeric intervals and
+        remapped non-numeric values without expanding the ranges.
+        return True or False for match or None if the values cannot be
+        compared this way (in which case ranges must be expanded)
+    """
+    if remapper1.digits or remapper2.digits: return None
+    r1 = get_range_set(value1)
+    r2 = get_range_set(value2)
+    if r1 is None or r2 is None: return None
+    v1 = set([remapper1(v) for v in r1[1]])
+    v2 = set([remapper2(v) for v in r2[1]])
+    # a remapped value that is a number could overlap an expanded range
+    for v in v1 | v2:
+        if v.isdigit(): return None
+    return r1[0] == r2[0] and v1 == v2
+
+def list_compare(value1, value2, remapper1, remapper2, expand=False):
+    """ compare two comma separated list values after remapping each element.
+        If expand is set then ranges within the list are expanded (see 
+        expand_range).  Order and duplicate values are ignored.
+        return tuple (match, map_value1, map_value2) where map values are the
+        comma separated remapped values (only set on mismatch)
+    """
+    if expand and range_set_compare(value1, value2, remapper1, remapper2):
+        return (True, None, None)
+
+    if expand:
+        v1 = expand_range(value1)
+        v2 = expand_range(value2)
+    else:
+        # build list of unique values
+        v1 = list(set(value1.split(",")))
+        v2 = list(set(value2.split(",")))
+    # remove empty value
+    if "" in v1: v1.remove("")
+    if "" in v2: v2.remove("")
+
+    # remap each value individually
+    v1 = [remapper1(v) for v in v1]
+    v2 = [remapper2(v) for v in v2]
+    if set(v1) == set(v2): return (True, None, None)
+    return (False, ",".join(v1), ",".join(v2))
+
 def per_node_class_compare(compare,mo,file1,file2,remap1,remap2):
     """ receive compare object and managed_object (single classname) directives along with file 
         pointers to corresponding objects. If the file does not exist or cannot be read, treat in 
@@ -638,9 +1195,8 @@ def per_node_class_compare(compare,mo,file1,file2,remap1,remap2):
     # node-id is present in remap object (should be the same node...)
     logger.debug("compare %s classname %s, node: %s", compare._id, mo["classname"], remap1.node_id)
 
-    # check for abort (which might not be seen during multiprocessing progress)
-    _s = Compare.load(_id=compare._id)
-    if not _s.exists() or _s.status == "abort": 
+    # check for abort signal shared by execute_compare
+    if compare_aborted():
         logger.debug("%s aborted", compare._id)
         return
 
@@ -660,14 +1216,15 @@ def per_node_class_compare(compare,mo,file1,file2,remap1,remap2):
     s2_objects = Remap.get_object_attributes(file2, mo["classname"])
 
     # rebuild snapshot object as a dict indexed by remapped mo key
-    def get_indexed_objects(objects, remapper):
+    def get_indexed_objects(objects, remap):
         s = {}
         # for no-key objects, return a single fixed-indexed dict with 
         # first object found
         if "no-key" in mo["labels"] and len(objects)>0: return {"-":objects[0]}
+        remapper = remap.get_remapper(mo["remap"])
         for o in objects:
             if mo["key"] in o:
-                key = remapper.remap_attribute(o[mo["key"]], mo["remap"])
+                key = remapper(o[mo["key"]])
                 if key not in s: s[key] = o 
                 else:
                     logger.warn("(%s) duplicate key in snapshot: %s", mo["classname"], key)
@@ -718,6 +1275,14 @@ def per_node_class_compare(compare,mo,file1,file2,remap1,remap2):
 
     logger.debug("%s interesting attributes: %s", mo["classname"],attributes.keys())
 
+    # compiled remappers for each interesting attribute
+    remappers = {}
+    for a in attributes:
+        remappers[a] = (
+            remap1.get_remapper(attributes[a]["remap"]),
+            remap2.get_remapper(attributes[a]["remap"])
+        )
+
     # check for modified and deleted
     for k in s1:
         if mo["key"] in s1[k]: s1[k]["_key"] = s1[k][mo["key"]]
@@ -782,45 +1347,15 @@ def per_node_class_compare(compare,mo,file1,file2,remap1,remap2):
            
             # process attribute values as ordered list
             if attr_list:
-
-                # expand ranges if enabled
-                if attr_list_expand:
-                    v1 = expand_range(s1[k].get(a,""))
-                    v2 = expand_range(s2[k].get(a,""))
-                else:
-                    # build list of unique values
-                    v1 = list(set(s1[k].get(a,"").split(",")))
-                    v2 = list(set(s2[k].get(a,"").split(",")))
-                # remove empty value
-                if "" in v1: v1.remove("")
-                if "" in v2: v2.remove("")
-
-                # remap each value individually
-                (v1_remap, v2_remap) = ([], [])
-                for v in v1:
-                    v1_remap.append(remap1.remap_attribute(v, attr["remap"]))
-                for v in v2:
-                    v2_remap.append(remap2.remap_attribute(v, attr["remap"]))
-
-                # check for presence of each value in both v1 and v2
-                for v in v1_remap:
-                    if v not in v2_remap:
-                        match = False
-                        break
-                if match:
-                    for v in v2_remap:
-                        if v not in v1_remap: 
-                            match = False
-                            break
-                # set v1/v2 to remap values
-                v1 = ",".join(v1_remap)
-                v2 = ",".join(v2_remap)
+                (match, v1, v2) = list_compare(s1[k].get(a,""), 
+                    s2[k].get(a,""), remappers[a][0], remappers[a][1], 
+                    expand=attr_list_expand)
 
             # process attribute as a single value
             else: 
                 # perform remaps for each value
-                v1 = remap1.remap_attribute(s1[k].get(a,""), attr["remap"])
-                v2 = remap2.remap_attribute(s2[k].get(a,""), attr["remap"])
+                v1 = remappers[a][0](s1[k].get(a,""))
+                v2 = remappers[a][1](s2[k].get(a,""))
 
                 # should rarely happen that new attribute is added to object
                 if a not in s1[k]:
@@ -849,7 +1384,10 @@ def per_node_class_compare(compare,mo,file1,file2,remap1,remap2):
         # if diffs are present then object was modified
         if len(diff["modified"])==0:
             result.total["equal"]+=1
-            result.equal.append(get_subset(s1[k], attributes,key=mo["key"]))
+            if compare.equal_mode == "full":
+                result.equal.append(get_subset(s1[k], attributes,key=mo["key"]))
+            elif compare.equal_mode == "keys":
+                result.equal.append(get_subset(s1[k], {}, key=mo["key"]))
         else:
             result.total["modified"]+=1
             result.modified.append(diff)
@@ -863,7 +1401,7 @@ def per_node_class_compare(compare,mo,file1,file2,remap1,remap2):
             result.created.append(get_subset(s2[k], attributes,key=mo["key"]))
 
     logger.debug("comparison complete(%s) %s: %s", result.compare_id,result.classname, result.total)
-    result.save()
+    return get_result_sink().add(result)
 
 def endpoint_compare(compare, folder1, folder2, remap1, remap2):
     """ perform endpoint comparision between snapshots. Note only local
@@ -874,9 +1412,8 @@ def endpoint_compare(compare, folder1, folder2, remap1, remap2):
 
     logger.debug("compare %s endpoints, node: %s", compare._id, remap1.node_id)
 
-    # check for abort (which might not be seen during multiprocessing progress)
-    _s = Compare.load(_id=compare._id)
-    if not _s.exists() or _s.status == "abort": 
+    # check for abort signal shared by execute_compare
+    if compare_aborted():
         logger.debug("%s aborted", compare._id)
         return
     
@@ -890,10 +1427,8 @@ def endpoint_compare(compare, folder1, folder2, remap1, remap2):
         return
 
     # expect for 'endpoints.json' file within each folder
-    f1 = "%s/endpoints.json" % folder1
-    f2 = "%s/endpoints.json" % folder2
-    s1_objects = Remap.get_per_classname_object_attributes(f1)
-    s2_objects = Remap.get_per_classname_object_attributes(f2)
+    s1_objects = Remap.get_per_classname_object_attributes("%s/endpoints.json" % folder1)
+    s2_objects = Remap.get_per_classname_object_attributes("%s/endpoints.json" % folder2)
 
     # build list of attributes (same for all objects and only compared if
     # present).  addr, createTs, flags, ifId, modTs, pcTag, status
@@ -955,8 +1490,9 @@ def endpoint_compare(compare, folder1, folder2, remap1, remap2):
         else:
             logger.debug("failed to match reg(%s) regex for %s", reg,o["dn"])
         
-    # here we overwrite endpoints.json file with only interesting (local) endpoints.  We need to 
-    # merge epmIpEp and epmMacEp objects into single file
+    # here we write a private copy of endpoints.json file with only interesting (local) endpoints
+    # as the extracted snapshot may be shared with other compare operations.  We need to merge 
+    # epmIpEp and epmMacEp objects into single file
     all_s1_objects = []
     all_s2_objects = []
     # check epmMacEp, epmIpEp
@@ -965,12 +1501,18 @@ def endpoint_compare(compare, folder1, folder2, remap1, remap2):
         # write to file for per_node_class_compare to read
         all_s1_objects+= get_local_objects(s1_objects.get(c, []))
         all_s2_objects+= get_local_objects(s2_objects.get(c, []))
+    tmp = get_app_config().get("TMP_DIR", "/tmp/")
+    f1 = "%s/compare.%s.node-%s.endpoints.0.json" % (tmp, compare._id, remap1.node_id)
+    f2 = "%s/compare.%s.node-%s.endpoints.1.json" % (tmp, compare._id, remap1.node_id)
     try:
         with open(f1, "w") as f: json.dump(all_s1_objects, f)
         with open(f2, "w") as f: json.dump(all_s2_objects, f)
         per_node_class_compare(compare, mo, f1, f2, remap1, remap2)
     except Exception as e: 
         logger.error("failed to perform endpoints comparions on %s: %s", c, e)
+    finally:
+        for f in [f1, f2]:
+            if os.path.exists(f): os.remove(f)
     
 def acl_compare(compare, folder1, folder2, remap1, remap2):
     """ perform acl comparision between snapshots """
@@ -0,0 +1,268 @@
+"""
+    Content-addressed cache of extracted snapshots shared between compare
+    operations.  Entries are keyed by snapshot md5 checksum and have the
+    following layout:
+        <root>/.lock                lock file for cache metadata operations
+        <root>/.size                total size in bytes of all entries
+        <root>/<md5>/data/          extracted snapshot contents
+        <root>/<md5>/refs/<pid>.<n> reference held by process using the entry
+        <root>/<md5>/last_used      mtime is last time entry was acquired
+        <root>/<md5>/size           size in bytes of extracted contents
+
+    Members are extracted atomically (temporary file and rename) so multiple
+    processes can safely extract into the same entry.  Entries without a live
+    reference are evicted in least-recently-used order once the total size of
+    the cache exceeds max_size.  The size of each entry is recorded when it is
+    extracted and the total is maintained in the cache root so eviction never
+    needs to walk the extracted contents.
+"""
+
+from . import archive
+
+import errno
+import fcntl
+import itertools
+import logging
+import os
+import shutil
+import time
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+def pid_alive(pid):
+    """ return True if process with provided pid is running """
+    try: os.kill(pid, 0)
+    except OSError as e: return e.errno == errno.EPERM
+    return True
+
+def read_size(path):
+    """ return integer size stored in file at path or None if not present """
+    try:
+        with open(path, "r") as f: return int(f.read().strip())
+    except (IOError, ValueError) as e: return None
+
+def write_size(path, size):
+    """ write integer size to file at path """
+    with open(path, "w") as f: f.write("%s" % size)
+
+def get_directory_size(path):
+    """ return total size in bytes of all files within directory """
+    size = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for f in filenames:
+            try: size+= os.path.getsize(os.path.join(dirpath, f))
+            except OSError as e: pass
+    return size
+
+class CacheLock(object):
+    """ exclusive flock on cache lock file """
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, "a")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+class ExtractCache(object):
+    """ shared extraction cache for snapshots """
+
+    # unique reference counter within current process
+    counter = itertools.count()
+
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        if not os.path.isdir(self.root):
+            try: os.makedirs(self.root)
+            except OSError as e:
+                if not os.path.isdir(self.root): raise e
+
+    def lock(self):
+        return CacheLock(os.path.join(self.root, ".lock"))
+
+    def acquire(self, path):
+        """ add reference to the cache entry for snapshot at provided path.
+            Files are not extracted until extract is called with the returned
+            handle.  release must be called when the handle is no longer used.
+            return handle dict or None on error
+        """
+        info = archive.get_checksum(path)
+        if info is None: return None
+        entry = os.path.join(self.root, info["md5checksum"])
+        ref = os.path.join(entry, "refs", "%s.%s" % (os.getpid(),
+                next(ExtractCache.counter)))
+        with self.lock():
+            if not os.path.isdir(os.path.dirname(ref)):
+                os.makedirs(os.path.dirname(ref))
+            open(ref, "w").close()
+            with open(os.path.join(entry, "last_used"), "w") as f:
+                f.write("%s" % time.time())
+        logger.debug("acquired cache entry %s for %s", entry, path)
+        return {
+            "snapshot": path,
+            "md5checksum": info["md5checksum"],
+            "indexed": info["indexed"],
+            "path": os.path.join(entry, "data"),
+            "ref": ref,
+        }
+
+    def extract(self, handle, select=None):
+        """ extract any members of the snapshot not already in the cache
+            entry.  select is an optional function that receives a member
+            name and returns True if the member is required (only applied to
+            indexed snapshots).  return boolean success
+        """
+        ts = time.time()
+        path = handle["path"]
+        size = None
+        try:
+            if handle["indexed"]:
+                count = 0
+                with archive.SnapshotReader(handle["snapshot"]) as reader:
+                    if reader.md5 != handle["md5checksum"]:
+                        logger.warn("snapshot %s changed after acquire",
+                            handle["snapshot"])
+                        return False
+                    for name in reader.names():
+                        if select is not None and not select(name): continue
+                        if os.path.exists(os.path.join(path, name)): continue
+                        if not reader.extract(name, path): return False
+                        count+= 1
+                    if count > 0:
+                        # entry size from index for all members present
+                        size = 0
+                        for name in reader.names():
+                            if os.path.exists(os.path.join(path, name)):
+                                size+= reader.members[name]["size"]
+                logger.debug("extracted %s members to %s in %f", count, path,
+                    time.time() - ts)
+            elif not os.path.isdir(path):
+                # legacy snapshots are fully extracted into tmp directory
+                # and then renamed to data directory
+                tmp = "%s.tmp.%s" % (path, os.getpid())
+                if os.path.exists(tmp): shutil.rmtree(tmp)
+                os.makedirs(tmp)
+                try:
+                    if archive.extract_snapshot(handle["snapshot"], tmp) is None:
+                        return False
+                    size = get_directory_size(tmp)
+                    try: os.rename(tmp, path)
+                    except OSError as e:
+                        if not os.path.isdir(path): raise e
+                finally:
+                    if os.path.exists(tmp): shutil.rmtree(tmp)
+                logger.debug("extracted %s to %s in %f", handle["snapshot"],
+                    path, time.time() - ts)
+        except Exception as e:
+            logger.warn("failed to extract %s to cache: %s", handle["snapshot"],e)
+            return False
+        if size is not None:
+            self.set_entry_size(os.path.dirname(path), size)
+        self.evict()
+        return True
+
+    def release(self, handle):
+        """ remove reference for provided handle """
+        with self.lock():
+            if os.path.exists(handle["ref"]): os.remove(handle["ref"])
+        logger.debug("released cache entry %s", handle["md5checksum"])
+        self.evict()
+
+    def get_total_size(self):
+        """ return total size of all entries from cache metadata.  If the
+            total has not been recorded (i.e., cache created by an older
+            version) it is rebuilt from the size of each entry.  Must be
+            called with lock held.
+        """
+        total = read_size(os.path.join(self.root, ".size"))
+        if total is not None: return total
+        total = 0
+        for name in os.listdir(self.root):
+            entry = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(entry): continue
+            total+= self.get_entry_size(entry)
+        write_size(os.path.join(self.root, ".size"), total)
+        return total
+
+    def get_entry_size(self, entry):
+        """ return size of cache entry from its metadata, entries without
+            recorded size are measured once and the result recorded.  Must be
+            called with lock held.
+        """
+        size = read_size(os.path.join(entry, "size"))
+        if size is None:
+            size = get_directory_size(os.path.join(entry, "data"))
+            write_size(os.path.join(entry, "size"), size)
+        return size
+
+    def set_entry_size(self, entry, size):
+        """ record size of cache entry and update total size of the cache """
+        with self.lock():
+            total = self.get_total_size()
+            previous = read_size(os.path.join(entry, "size"))
+            if previous is None: previous = 0
+            write_size(os.path.join(entry, "size"), size)
+            write_size(os.path.join(self.root, ".size"), total+size-previous)
+
+    def live_references(self, entry):
+        """ return number of live references for cache entry, removing any
+            references held by processes that are no longer running.  Must be
+            called with lock held.
+        """
+        count = 0
+        refs = os.path.join(entry, "refs")
+        if not os.path.isdir(refs): return 0
+        for ref in os.listdir(refs):
+            try: pid = int(ref.split(".")[0])
+            except ValueError as e: pid = 0
+            if pid_alive(pid): count+= 1
+            else:
+                logger.debug("removing stale cache reference %s/%s", refs, ref)
+                os.remove(os.path.join(refs, ref))
+        return count
+
+    def evict(self):
+        """ remove least recently used entries without live references until
+            cache size is within max_size.  Only the last_used time of each
+            entry is read, references and sizes are only checked for entries
+            considered for eviction.
+        """
+        evicted = []
+        with self.lock():
+            total = self.get_total_size()
+            if total <= self.max_size: return
+            candidates = []
+            for name in os.listdir(self.root):
+                entry = os.path.join(self.root, name)
+                if not os.path.isdir(entry): continue
+                if name.startswith(".evict."):
+                    # cleanup from previously interrupted eviction
+                    evicted.append(entry)
+                    continue
+                last_used = os.path.join(entry, "last_used")
+                if os.path.exists(last_used):
+                    last_used = os.path.getmtime(last_used)
+                else: last_used = 0
+                candidates.append((last_used, name))
+            for (last_used, name) in sorted(candidates):
+                if total <= self.max_size: break
+                entry = os.path.join(self.root, name)
+                if self.live_references(entry) > 0: continue
+                size = self.get_entry_size(entry)
+                logger.debug("evicting cache entry %s (%s bytes)", name, size)
+                tmp = os.path.join(self.root, ".evict.%s.%s" % (name,
+                            os.getpid()))
+                os.rename(entry, tmp)
+                evicted.append(tmp)
+                total-= size
+            write_size(os.path.join(self.root, ".size"), max(0, total))
+        # remove evicted entries outside of lock
+        for entry in evicted:
+            shutil.rmtree(entry, ignore_errors=True)
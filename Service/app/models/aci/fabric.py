@@ -3,7 +3,7 @@ import logging, json, requests, re, time, os, traceback
 from flask import jsonify, g, abort, current_app
 from ..rest import (Rest, Role, api_register, api_route, api_callback)
 from . import utils as aci_utils
-from ..utils import (get_app, get_app_config, get_user_data)
+from ..utils import (get_app_config, get_user_data)
 
 # module level logging
 logger = logging.getLogger(__name__)
@@ -97,6 +97,13 @@ class Fabric(Rest):
             "max": 8192,
             "default": 1024,
         },
+        "snapshot_concurrency": {
+            "type": int,
+            "description": "maximum number of concurrent APIC class queries during snapshot collection",
+            "min": 1,
+            "max": 32,
+            "default": 4,
+        },
 
         # reference attributes only
         "status": {
@@ -369,10 +376,10 @@ def rest_fabric_action(fabric, action, reason):
         logger.error("failed to determine local password")
         return False
 
-    app = get_app()
+    config = get_app_config()
     headers = {"content-type":"application/json"}
     s = requests.Session()
-    base_url = app.config.get("PROXY_URL", "http://localhost")
+    base_url = config.get("PROXY_URL", "http://localhost")
     if "http" not in base_url: base_url = "http://%s" % base_url
 
     # login as local user and then perform post
@@ -0,0 +1,496 @@
+"""
+    Queue of snapshot and compare jobs executed by a long-running job runner.
+
+    REST callbacks submit jobs to the queue and the runner (started with
+        python -m app.models.aci.worker --runner
+    ) claims queued jobs atomically and executes each job in a child process
+    forked from the runner so that imports are already warm.  The runner
+    enforces a global limit and a per-fabric limit on running jobs.  Only a
+    single runner is expected per deployment.
+
+    Snapshot and compare objects are set to running with a compare-and-set on
+    their status (see Lease) and a heartbeat is refreshed while the job is
+    executing.  The runner resets jobs and objects whose heartbeat expired so
+    crashed workers are recovered without manual cleanup.
+"""
+
+from ..rest import Rest
+from ..rest import api_register
+from ..utils import get_app_config
+from ..utils import get_db
+from . import utils as aci_utils
+
+from bson.objectid import ObjectId, InvalidId
+from pymongo import ASCENDING
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from contextlib import contextmanager
+
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+@api_register(path="/aci/jobs")
+class Jobs(Rest):
+    """ ACI snapshot and compare jobs executed by the job runner """
+    logger = logging.getLogger(__name__)
+
+    META_ACCESS = {
+        "expose_id": True,
+        "create": False,
+        "update": False,
+        "delete": False,
+    }
+
+    # supported job types
+    JOB_TYPES = ["snapshot", "compare"]
+
+    META = {
+        "job_type": {
+            "type": str,
+            "values": JOB_TYPES,
+            "description": "type of job to execute",
+        },
+        "target": {
+            "type": str,
+            "description": "_id of snapshot or compare object",
+        },
+        "fabric": {
+            "type": str,
+            "description": "fabric name used for per-fabric concurrency limit",
+        },
+        "status": {
+            "type": str,
+            "default": "queued",
+            "values": ["queued", "running", "complete", "error"],
+        },
+        "runner": {
+            "type": str,
+            "description": "hostname:pid of runner that claimed the job",
+        },
+        "pid": {
+            "type": int,
+            "description": "pid of process executing the job",
+        },
+        "queued_time": {
+            "type": float,
+            "description": "unix timestamp when job was queued",
+        },
+        "start_time": {
+            "type": float,
+            "description": "unix timestamp when job was claimed",
+        },
+        "end_time": {
+            "type": float,
+            "description": "unix timestamp when job finished",
+        },
+        "heartbeat": {
+            "type": float,
+            "description": "unix timestamp of last heartbeat from the runner",
+        },
+        "attempts": {
+            "type": int,
+            "description": "number of times the job has been claimed",
+        },
+    }
+
+    @classmethod
+    def collection(cls):
+        cls.init()
+        return get_db()[cls._classname]
+
+    @classmethod
+    def enqueue(cls, job_type, target, fabric=""):
+        """ add job to the queue if the same job is not already queued.
+            return boolean success
+        """
+        cls.init()
+        job = {}
+        for attr in cls._attributes: job[attr] = cls.get_attribute_default(attr)
+        job.update({
+            "job_type": job_type,
+            "target": target,
+            "fabric": fabric,
+            "status": "queued",
+            "queued_time": time.time(),
+        })
+        try:
+            cls.collection().update_one(
+                {"job_type": job_type, "target": target, "status": "queued"},
+                {"$setOnInsert": job}, upsert=True
+            )
+            logger.debug("queued %s job for %s", job_type, target)
+            return True
+        except Exception as e:
+            logger.warn("failed to queue %s job for %s: %s", job_type, target, e)
+        return False
+
+    @classmethod
+    def claim(cls, runner, exclude_fabrics=[]):
+        """ atomically claim the oldest queued job for a fabric not within
+            exclude_fabrics.  return claimed job dict or None
+        """
+        filters = {"status": "queued"}
+        if len(exclude_fabrics) > 0: filters["fabric"] = {"$nin": exclude_fabrics}
+        return cls.collection().find_one_and_update(filters,
+            {
+                "$set": {
+                    "status": "running",
+                    "runner": runner,
+                    "start_time": time.time(),
+                    "heartbeat": time.time(),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("queued_time", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    @classmethod
+    def heartbeat(cls, job_ids):
+        """ refresh heartbeat of running jobs """
+        if len(job_ids) == 0: return
+        cls.collection().update_many(
+            {"_id": {"$in": job_ids}, "status": "running"},
+            {"$set": {"heartbeat": time.time()}}
+        )
+
+    @classmethod
+    def expire(cls, timeout, max_attempts):
+        """ requeue running jobs whose heartbeat is older than timeout seconds
+            or set them to error if the job has already been attempted
+            max_attempts times
+        """
+        running = {
+            "status": "running",
+            "heartbeat": {"$not": {"$gte": time.time() - timeout}},
+        }
+        requeue = dict(running)
+        requeue["attempts"] = {"$lt": max_attempts}
+        r = cls.collection().update_many(requeue, {"$set": {
+            "status": "queued",
+            "runner": "",
+            "pid": 0,
+        }})
+        if r.modified_count > 0:
+            logger.warn("requeued %s jobs with expired heartbeat", r.modified_count)
+        r = cls.collection().update_many(running, {"$set": {
+            "status": "error",
+            "end_time": time.time(),
+        }})
+        if r.modified_count > 0:
+            logger.warn("%s jobs with expired heartbeat exceeded max attempts",
+                r.modified_count)
+
+    @classmethod
+    def finish(cls, job_id, success=True):
+        """ set final status of job """
+        cls.collection().update_one({"_id": job_id}, {"$set": {
+            "status": "complete" if success else "error",
+            "end_time": time.time(),
+        }})
+
+    @classmethod
+    def purge(cls, max_age):
+        """ remove finished jobs older than max_age seconds """
+        cls.collection().delete_many({
+            "status": {"$in": ["complete", "error"]},
+            "end_time": {"$lt": time.time() - max_age},
+        })
+
+class Lease(object):
+    """ exclusive ownership of a snapshot or compare object while its job is
+        executing.  The lease is acquired with a single compare-and-set on the
+        object status and kept alive by a heartbeat thread.  An object that is
+        running or aborting with an expired heartbeat can be claimed again.
+        If the lease is taken over or the object is reset by the runner then
+        lost is set and the job is expected to stop.  The heartbeat thread
+        must be suspended while forking a process pool, see suspend.
+    """
+
+    # object status values that are held by a lease
+    LEASED = ["running", "abort"]
+
+    def __init__(self, cls, _id):
+        config = get_app_config()
+        self.cls = cls
+        self._id = _id
+        self.interval = config.get("JOB_HEARTBEAT_INTERVAL", 10.0)
+        self.timeout = config.get("JOB_LEASE_TIMEOUT", 120.0)
+        self.owner = "%s:%s:%s" % (socket.gethostname(), os.getpid(), ObjectId())
+        self.lost = False
+        self.stopped = None
+        self.thread = None
+
+    @classmethod
+    def collection(cls, rest_cls):
+        rest_cls.init()
+        return get_db()[rest_cls._classname]
+
+    @classmethod
+    def expire(cls, rest_cls, timeout):
+        """ set objects with an expired lease to error status """
+        r = cls.collection(rest_cls).update_many({
+            "status": {"$in": cls.LEASED},
+            "heartbeat": {"$not": {"$gte": time.time() - timeout}},
+        }, {"$set": {
+            "status": "error",
+            "error": "worker heartbeat expired",
+            "lease_owner": "",
+        }})
+        if r.modified_count > 0:
+            logger.warn("reset %s %s objects with expired heartbeat",
+                r.modified_count, rest_cls._classname)
+
+    def acquire(self, claimable, update={}):
+        """ set object status to running if the current status is within
+            claimable or the previous lease has expired.  update is a dict of
+            additional attributes set along with the status.  On success the
+            heartbeat thread is started.  return boolean success
+        """
+        now = time.time()
+        try:
+            filters = {"_id": ObjectId(self._id), "$or": [
+                {"status": {"$in": claimable}},
+                {
+                    "status": {"$in": Lease.LEASED},
+                    "heartbeat": {"$not": {"$gte": now - self.timeout}},
+                },
+            ]}
+            update = dict(update)
+            update.update({
+                "status": "running",
+                "lease_owner": self.owner,
+                "heartbeat": now,
+            })
+            r = Lease.collection(self.cls).find_one_and_update(filters,
+                    {"$set": update})
+        except (InvalidId, PyMongoError) as e:
+            logger.warn("failed to acquire lease on %s %s: %s",
+                self.cls._classname, self._id, e)
+            return False
+        if r is None:
+            logger.debug("%s %s not found or already running",
+                self.cls._classname, self._id)
+            return False
+        self.start()
+        return True
+
+    def start(self):
+        """ start heartbeat thread """
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.heartbeat, args=(self.stopped,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def heartbeat(self, stopped):
+        """ refresh heartbeat until stopped or the lease is lost """
+        while not stopped.wait(self.interval):
+            try:
+                r = Lease.collection(self.cls).update_one(
+                    {"_id": ObjectId(self._id), "lease_owner": self.owner},
+                    {"$set": {"heartbeat": time.time()}}
+                )
+                if r.matched_count == 0:
+                    logger.warn("lease on %s %s lost", self.cls._classname,
+                        self._id)
+                    self.lost = True
+                    return
+            except PyMongoError as e:
+                logger.warn("failed to update heartbeat for %s %s: %s",
+                    self.cls._classname, self._id, e)
+
+    def release(self):
+        """ stop heartbeat thread """
+        if self.stopped is not None: self.stopped.set()
+        if self.thread is not None: self.thread.join()
+        self.thread = None
+
+    @contextmanager
+    def suspend(self):
+        """ stop the heartbeat thread while the block executes and restart it
+            afterwards.  A fork while the heartbeat thread holds the logging
+            or a pymongo lock can deadlock the child, so process pools must
+            be created with the heartbeat suspended
+        """
+        running = self.thread is not None
+        if running: self.release()
+        try:
+            yield
+        finally:
+            if running and not self.lost: self.start()
+
+def submit(job_type, target, fabric=""):
+    """ submit job to the job runner queue or, if the job runner is disabled,
+        execute the job in a new background worker process.
+        return boolean success
+    """
+    if get_app_config().get("JOB_RUNNER", True):
+        return Jobs.enqueue(job_type, target, fabric=fabric)
+    return aci_utils.execute_worker("--%s %s" % (job_type, target))
+
+class JobTerminated(Exception):
+    """ raised within a job process when the job runner terminates the job """
+    pass
+
+def execute_job(job):
+    """ execute job within current process """
+    if job["job_type"] == "snapshot":
+        from .snapshots import execute_snapshot
+        execute_snapshot(job["target"])
+    elif job["job_type"] == "compare":
+        from .compare import execute_compare
+        execute_compare(job["target"])
+    else:
+        raise Exception("unknown job type %s" % job["job_type"])
+
+class JobRunner(object):
+    """ claim and execute queued jobs within the configured limits """
+
+    def __init__(self):
+        config = get_app_config()
+        self.max_running = config.get("JOB_MAX_RUNNING", 4)
+        self.max_running_per_fabric = config.get("JOB_MAX_RUNNING_PER_FABRIC", 2)
+        self.interval = config.get("JOB_RUNNER_POLL_INTERVAL", 1.0)
+        self.retention = config.get("JOB_RETENTION", 86400)
+        self.heartbeat_interval = config.get("JOB_HEARTBEAT_INTERVAL", 10.0)
+        self.lease_timeout = config.get("JOB_LEASE_TIMEOUT", 120.0)
+        self.max_attempts = config.get("JOB_MAX_ATTEMPTS", 2)
+        self.stop_timeout = config.get("JOB_STOP_TIMEOUT", 30.0)
+        self.runner = "%s:%s" % (socket.gethostname(), os.getpid())
+        self.children = {}      # running jobs indexed by child pid
+        self.stopped = False
+        self.last_purge = 0
+        self.last_heartbeat = 0
+        # import job modules once so each forked job starts warm
+        from . import snapshots, compare
+
+    def stop(self, *args):
+        logger.debug("job runner stop requested")
+        self.stopped = True
+
+    def run(self):
+        """ run until stop is requested """
+        logger.info("job runner %s started (max_running: %s, per_fabric: %s)",
+            self.runner, self.max_running, self.max_running_per_fabric)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopped:
+            try:
+                self.reap()
+                if time.time() - self.last_heartbeat >= self.heartbeat_interval:
+                    self.heartbeat()
+                    self.last_heartbeat = time.time()
+                self.schedule()
+                if time.time() - self.last_purge > 60:
+                    Jobs.purge(self.retention)
+                    self.last_purge = time.time()
+            except Exception as e:
+                logger.debug(traceback.format_exc())
+                logger.warn("job runner error: %s", e)
+            time.sleep(self.interval)
+        logger.info("job runner %s stopping with %s running jobs", self.runner,
+            len(self.children))
+        self.shutdown()
+        logger.info("job runner %s stopped", self.runner)
+        return True
+
+    def shutdown(self):
+        """ terminate running jobs and wait up to stop_timeout seconds for them
+            to exit.  Jobs still running after the timeout are killed.  All
+            jobs are finished with error status so they are never requeued
+            while a child process may still be executing the job
+        """
+        for pid in self.children:
+            try: os.kill(pid, signal.SIGTERM)
+            except OSError as e: pass
+        ts = time.time()
+        while len(self.children) > 0 and time.time() - ts < self.stop_timeout:
+            self.reap()
+            if len(self.children) > 0: time.sleep(0.1)
+        for pid in list(self.children):
+            job = self.children.pop(pid)
+            logger.warn("killing %s job %s (pid %s) after %ss", job["job_type"],
+                job["target"], pid, self.stop_timeout)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError as e: pass
+            Jobs.finish(job["_id"], success=False)
+
+    def reap(self):
+        """ update status of jobs whose child process has exited """
+        for pid in list(self.children):
+            try: (wpid, status) = os.waitpid(pid, os.WNOHANG)
+            except OSError as e: (wpid, status) = (pid, -1)
+            if wpid == 0: continue
+            job = self.children.pop(pid)
+            success = status >= 0 and os.WIFEXITED(status) and \
+                        os.WEXITSTATUS(status) == 0
+            logger.debug("%s job %s (pid %s) finished, success: %s",
+                job["job_type"], job["target"], pid, success)
+            Jobs.finish(job["_id"], success=success)
+
+    def heartbeat(self):
+        """ refresh heartbeat of local jobs and reset jobs and objects whose
+            heartbeat expired
+        """
+        from .snapshots import Snapshots
+        from .compare import Compare
+        Jobs.heartbeat([job["_id"] for job in self.children.values()])
+        Jobs.expire(self.lease_timeout, self.max_attempts)
+        for cls in [Snapshots, Compare]:
+            Lease.expire(cls, self.lease_timeout)
+
+    def schedule(self):
+        """ claim and start queued jobs while within limits """
+        while len(self.children) < self.max_running:
+            running = {}
+            for job in self.children.values():
+                running[job["fabric"]] = running.get(job["fabric"], 0) + 1
+            exclude = [f for f in running if running[f] >= self.max_running_per_fabric]
+            job = Jobs.claim(self.runner, exclude_fabrics=exclude)
+            if job is None: return
+            self.start(job)
+
+    def start(self, job):
+        """ execute job in child process forked from the runner """
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            job_pid = os.getpid()
+            terminated = []
+            def terminate(*args):
+                # processes forked by the job (i.e., compare pool workers)
+                # inherit the handler and exit immediately
+                if os.getpid() != job_pid: os._exit(1)
+                terminated.append(True)
+                raise JobTerminated("job terminated by job runner")
+            try:
+                signal.signal(signal.SIGTERM, terminate)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                # mongo clients are not fork-safe, create new connection
+                get_db(uniq=True, overwrite_global=True)
+                Jobs.collection().update_one({"_id": job["_id"]},
+                    {"$set": {"pid": os.getpid()}})
+                execute_job(job)
+                # job may handle JobTerminated (i.e., set object to error)
+                if len(terminated) == 0: code = 0
+            except Exception as e:
+                logger.error("%s job %s failed: %s\n%s", job["job_type"],
+                    job["target"], e, traceback.format_exc())
+            finally:
+                os._exit(code)
+        logger.debug("started %s job %s (pid %s)", job["job_type"], job["target"], pid)
+        self.children[pid] = job
+
+def run_job_runner():
+    """ start job runner in current process """
+    return JobRunner().run()
@@ -23,6 +23,9 @@ class Remap(object):
         "ipv6If",
         "tunnelIf",
     ]
+    # precomputed remap tables are stored per node as <node>/_remap.json
+    REMAP_ARTIFACT = "_remap"
+    REMAP_TABLES = ["vlans", "aggs", "encrtds", "loopbacks", "tunnels"]
     _vlan = [
         "\[vlan[0-9]+\]",
         "^vlan[0-9]+,?$",
@@ -44,11 +47,25 @@ class Remap(object):
         "loopback": re.compile("(?P<v>lo[0-9]+)"),
         "tunnel": re.compile("(?P<v>tunnel[0-9]+)"),
     }
+    # literal tokens present in any value matched by corresponding remap regex
+    # (excluding digit-only vlan which is handled separately)
+    REMAP_TOKENS = {
+        "vlan": ["vlan"],
+        "encrtd": ["eth", "po"],
+        "agg": ["po"],
+        "loopback": ["lo"],
+        "tunnel": ["tunnel"],
+    }
+    STRIP_REGEX = re.compile("[\[\]\,]")
+    # maximum number of memoized values per compiled remapper
+    REMAP_MEMO_SIZE = 65536
 
     def __init__(self, node_id, folder=None):
         """ receive node_id and folder containing extracted snapshot objects 
             to build remap.  If folder is not provided then instaniate empty
-            remaps (i.e., remapping is disabled)
+            remaps (i.e., remapping is disabled).  If the folder contains 
+            precomputed remap tables (see save) then they are loaded instead of
+            building the remap from the snapshot objects.
         """
         self.node_id = node_id
         self.folder = folder
@@ -58,13 +75,15 @@ class Remap(object):
         self.loopbacks = {}
         self.tunnels = {}
         self.remaps = {}   
+        self._remappers = {}
         self.disabled = True
         if folder is not None:
-            self._remap_vlan()
-            self._remap_agg()
-            self._remap_encrtd()
-            self._remap_loopback()
-            self._remap_tunnel()
+            if not self._load():
+                self._remap_vlan()
+                self._remap_agg()
+                self._remap_encrtd()
+                self._remap_loopback()
+                self._remap_tunnel()
             self.remaps = {
                 "vlan": [ Remap.REMAP_REGEX["vlan"], self.vlans ],
                 "encrtd": [ Remap.REMAP_REGEX["encrtd"], self.encrtds],
@@ -74,26 +93,96 @@ class Remap(object):
             }
             self.disabled = False
 
+    def _load(self):
+        """ load precomputed remap tables from folder if present.
+            return boolean success
+        """
+        fname = "%s/%s.json" % (self.folder, Remap.REMAP_ARTIFACT)
+        try:
+            with open(fname, "r") as f:
+                js = json.load(f)
+                for t in Remap.REMAP_TABLES:
+                    if t in js and type(js[t]) is dict: setattr(self, t, js[t])
+            logger.debug("loaded remap tables for node %s from %s" % (
+                self.node_id, fname))
+            return True
+        except IOError as e: pass
+        except Exception as e:
+            logger.warn("failed to load remap tables from %s: %s" % (fname, e))
+        return False
+
+    def save(self):
+        """ save remap tables to folder so they can be loaded by future remap
+            objects without rebuilding the tables.
+            return boolean success
+        """
+        fname = "%s/%s.json" % (self.folder, Remap.REMAP_ARTIFACT)
+        try:
+            with open(fname, "w") as f:
+                json.dump(dict((t, getattr(self, t)) for t in Remap.REMAP_TABLES), f)
+            return True
+        except Exception as e:
+            logger.warn("failed to save remap tables to %s: %s" % (fname, e))
+        return False
+
     def remap_attribute(self, value, mo_remaps=[]):
         """ remap provided value according remap selectors 
 
         """
         if len(mo_remaps)==0: return value
-        dmsg = "remap %s to " % value
-        allset = "all" in mo_remaps
-        #logger.debug("remap(%s) %s" , mo_remaps, value)
-        for r in self.REMAP_ORDERED:
-            if allset or r in mo_remaps:
-                t = self.remaps[r]
-                r1 = t[0].search(value)
-                if r1 is not None:
-                    match = re.sub("[\[\]\,]","",r1.group("v"))
-                    if match in t[1]:
-                        #logger.debug("matching(%s) %s",match,t[1][match])
-                        value = t[0].sub(t[1][match], value)
-                
-        #logger.debug("%s %s" ,dmsg, value)
-        return value
+        return self.get_remapper(mo_remaps)(value)
+
+    def get_remapper(self, mo_remaps=[]):
+        """ return function that remaps a single value according to remap 
+            selectors.  The remapper is compiled once per selector set and
+            skips remap types with empty tables, rejects values that cannot
+            match any remaining type with a single pre-check regex, and
+            memoizes results for the lifetime of this remap object.
+            The returned function has a boolean attribute 'digits' that is
+            True if digit-only values may be changed by the remapper.
+        """
+        key = tuple(sorted(set(mo_remaps)))
+        if key in self._remappers: return self._remappers[key]
+
+        allset = "all" in key
+        steps = []
+        tokens = []
+        digits = False
+        for r in Remap.REMAP_ORDERED:
+            if not (allset or r in key) or r not in self.remaps: continue
+            (regex, table) = self.remaps[r]
+            # a match can only be remapped if its key is in the table
+            if len(table) == 0: continue
+            steps.append((regex, table))
+            tokens+= Remap.REMAP_TOKENS[r]
+            if r == "vlan" and any(k.isdigit() for k in table): digits = True
+
+        if len(steps) == 0:
+            remapper = lambda value: value
+            remapper.digits = False
+        else:
+            check = "|".join(sorted(set(tokens)))
+            if digits: check = "%s|^[0-9]+$" % check
+            check = re.compile(check)
+            memo = {}
+            def remapper(value):
+                try: return memo[value]
+                except KeyError: pass
+                ret = value
+                if check.search(value) is not None:
+                    for (regex, table) in steps:
+                        r1 = regex.search(ret)
+                        if r1 is not None:
+                            match = Remap.STRIP_REGEX.sub("", r1.group("v"))
+                            if match in table:
+                                ret = regex.sub(table[match], ret)
+                if len(memo) >= Remap.REMAP_MEMO_SIZE: memo.clear()
+                memo[value] = ret
+                return ret
+            # digit-only values can be remapped (see get_range_set)
+            remapper.digits = digits
+        self._remappers[key] = remapper
+        return remapper
 
     @staticmethod
     def get_object_attributes(fname, classname=None):
@@ -269,3 +358,38 @@ def expand_range(value):
     except Exception as e: 
         logger.warn("failed to expand range (%s): %s" % (value, e))
         return ["%s" % value]
+
+def get_range_set(value):
+    """ receive a value in form a-d,x-y,z and return tuple (intervals, values)
+        where intervals is a sorted list of merged (start, end) tuples for all
+        numeric ranges and values is a set of the remaining non-empty values.
+        This is equivalent to expand_range without expanding each range.  
+        Numbers with leading zeros or whitespace are not normalized by 
+        expand_range and are therefore kept as values.
+        return None if unable to parse value
+    """
+    try:
+        intervals = []
+        values = set()
+        for v in value.split(","):
+            r1 = re.search(RANGE_REGEX, v)
+            if r1 is not None:
+                start = int(r1.group("s"))
+                end = int(r1.group("e"))
+                if start > end: (start, end) = (end, start)
+                intervals.append((start, end))
+            elif v.isdigit() and "%d" % int(v) == v:
+                intervals.append((int(v), int(v)))
+            elif len(v)>0:
+                values.add(v)
+        intervals.sort()
+        merged = []
+        for (start, end) in intervals:
+            if len(merged)>0 and start <= merged[-1][1]+1:
+                if end > merged[-1][1]: merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return (merged, values)
+    except Exception as e:
+        logger.debug("failed to parse range (%s): %s" % (value, e))
+        return None
@@ -5,6 +5,8 @@ from ..rest import api_register
 from ..rest import api_route
 from ..utils import format_timestamp
 from ..utils import get_user_data
+from . import archive
+from . import jobs
 from . import utils as aci_utils
 from .definitions import Definitions
 from .managed_objects import ManagedObjects
@@ -16,6 +18,8 @@ from flask import current_app
 from flask import jsonify
 from flask import request
 from flask import send_from_directory
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from natsort import natsorted as sorted
 
 import base64
@@ -25,6 +29,7 @@ import logging
 import os
 import re
 import shutil
+import threading
 import time
 import traceback
 import uuid
@@ -33,7 +38,7 @@ import uuid
 logger = logging.getLogger(__name__)
 
 def upload_snapshot():
-    """ upload a snapshot tgz file """
+    """ upload a snapshot snap, tgz, or tar file """
     from ..utils import get_app_config
     if request.files is None:
         abort(400, "No files uploaded")
@@ -44,9 +49,11 @@ def upload_snapshot():
         try:
             for filename in request.files:
                 f = request.files[filename] 
-                # validate file is .tgz file and allowed name
-                if not re.search("(?i)^[a-z0-9\-_\.:]+?\.tgz$", f.filename):
+                # validate file is .snap, .tgz, or .tar file and allowed name
+                r = re.search("(?i)^[a-z0-9\-_\.:]+?\.(?P<ext>snap|tgz|tar)$", f.filename)
+                if r is None:
                     abort(400, "Invalid filename for snapshot: %s" % f.filename)
+                ext = r.group("ext").lower()
                 logger.debug("upload request for file: %s", f.filename)
                 temp_filename = os.path.join(tmp_dir , f.filename)
                 # create the directory
@@ -54,16 +61,12 @@ def upload_snapshot():
                 os.chdir(tmp_dir)
                 # unzip and stuff..
                 f.save(temp_filename)
-                if aci_utils.run_command('tar --force-local -zxf ' + temp_filename) is None:
-                    abort(500,"Failed to unzip snapshot")
-                if aci_utils.run_command('tar --force-local -zxf bundle.tgz') is None:
-                    abort(500,"Failed to unzip snapshot")
+                # extract bundle and verify md5 in a single pass
+                checksum = archive.extract_snapshot(temp_filename, tmp_dir)
+                if checksum is None:
+                    abort(400, "Invalid snapshot file or md5 checksum")
                 # try to extract required data, abort if not in correct format which triggers exception
                 try:
-                    checksum = json.loads(open( os.path.join(tmp_dir,'md5checksum.json')).read()).get('md5checksum')
-                    bundle_checksum = aci_utils.get_file_md5('bundle.tgz') 
-                    if bundle_checksum != checksum:
-                        abort(400,"snapshot file md5 is invalid")
                     fnew = open(os.path.join(tmp_dir,'snapshot.json'), 'r')
                     fileJson = json.loads(fnew.read())
                 except BadRequest as e: raise e
@@ -94,8 +97,9 @@ def upload_snapshot():
                     snap.status = 'complete'
                     snap.error = False
                     snap.source = 'upload'
+                    snap.codec = checksum["codec"]
                     snap.filename = get_unique_filename(dst,
-                        "snapshot.%s.%s.tgz"%(snap.fabric,format_timestamp(snap.start_time,msec=True)))
+                        "snapshot.%s.%s.%s"%(snap.fabric,format_timestamp(snap.start_time,msec=True),ext))
                     snap.filename = os.path.join(dst,snap.filename)
                     # create the directory if not present
                     if not os.path.isdir(dst): os.makedirs(dst)
@@ -160,6 +164,7 @@ class Snapshots(Rest):
             "type":list,
             "subtype":str,
             "write":False,
+            "bulk_read":False,
         },
         "filename": {
             "type":str,
@@ -177,6 +182,7 @@ class Snapshots(Rest):
         "wait_time": {
             "type": float,
             "write": False,
+            "description": "elapsed time collecting objects from the fabric",
         },
         "total_time": {
             "type": float,
@@ -198,12 +204,51 @@ class Snapshots(Rest):
             "default":"",
             "write":False,
         },
+        "lease_owner":{
+            "type":str,
+            "default":"",
+            "write":False,
+            "description":"worker holding the lease on a running snapshot",
+        },
+        "heartbeat":{
+            "type":float,
+            "default":0.0,
+            "write":False,
+            "description":"unix timestamp of last heartbeat from running snapshot",
+        },
         "source":{
             "type":str,
             "values":["upload","runtime"],
             "default": "runtime",
             "write": False,
         },
+        "codec": {
+            "type": str,
+            "default": "gzip",
+            "write": False,
+            "description": "compression codec of snapshot bundle",
+        },
+        "class_stats": {
+            "type": list,
+            "subtype": dict,
+            "write": False,
+            "bulk_read": False,
+            "description": "per-class collection statistics in definition order",
+            "meta": {
+                "classname": {
+                    "type": str,
+                    "description": "collected managed object classname",
+                },
+                "latency": {
+                    "type": float,
+                    "description": "time in seconds spent waiting on APIC for this class",
+                },
+                "objects": {
+                    "type": int,
+                    "description": "number of objects collected for this class",
+                },
+            },
+        },
     }
 
     @classmethod
@@ -235,7 +280,7 @@ class Snapshots(Rest):
         # set start time to 'now' before executing background worker
         s.start_time = time.time()
         s.save()
-        if not aci_utils.execute_worker("--snapshot %s" % s._id):
+        if not jobs.submit("snapshot", s._id, fabric=s.fabric):
             abort(500, "failed to start background snapshot process")
 
     @classmethod
@@ -256,7 +301,7 @@ class Snapshots(Rest):
 
     @api_route(path="download", methods=["GET"])
     def download_snapshot(self):
-        """ download a backup snapshot tgz file """
+        """ download a backup snapshot file """
         if self.filename is not None:
             if os.path.isfile(self.filename) is False:
                 abort(400, "Snapshot file (%s) not found" % self.filename)
@@ -284,27 +329,110 @@ def get_unique_filename(directory, filename):
         ])
     return fname
 
+class JsonArrayWriter(object):
+    """ stream objects into json array files.  Objects can be written to any
+        number of files in any order without holding them in memory.  A handle
+        is kept open per file up to max_open handles, after which the least
+        recently used handle is closed and later reopened in append mode. The
+        arrays are terminated on close.
+    """
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self.handles = OrderedDict()    # path -> open file handle (lru order)
+        self.counts = {}                # path -> number of objects written
+
+    def write(self, path, obj):
+        """ append object to json array at provided path """
+        f = self.handles.pop(path, None)
+        if f is None:
+            if len(self.handles) >= self.max_open:
+                self.handles.popitem(last=False)[1].close()
+            if path in self.counts:
+                f = open(path, "a")
+            else:
+                # multiple collection threads may create the same directory
+                if not os.path.exists(os.path.dirname(path)):
+                    try: os.makedirs(os.path.dirname(path))
+                    except OSError as e:
+                        if not os.path.isdir(os.path.dirname(path)): raise e
+                logger.debug("saving to %s" % (path))
+                f = open(path, "w")
+                f.write("[")
+                self.counts[path] = 0
+        self.handles[path] = f
+        if self.counts[path] > 0: f.write(",")
+        json.dump(obj, f)
+        self.counts[path]+= 1
+
+    def close(self):
+        """ terminate all json arrays and close all handles """
+        for path in self.counts:
+            f = self.handles.pop(path, None)
+            if f is None: f = open(path, "a")
+            f.write("]")
+            f.close()
+        self.counts = {}
+
+    def abort(self):
+        """ close all handles and remove any partially written files """
+        for path in self.handles: self.handles[path].close()
+        self.handles = OrderedDict()
+        for path in self.counts:
+            try: os.remove(path)
+            except OSError as e: 
+                logger.debug("failed to remove %s: %s" % (path, e))
+        self.counts = {}
+
 def execute_snapshot(snapshot_id):
     """ perform snapshot operation for provided fabric name and definition name.
         The snapshot will be stored in config["DATA_DIR"]. The progress of the
-        collection and final result are saved to the database.
+        collection and final result are saved to the database.  The snapshot
+        is set to running with a lease on the snapshot object so the same
+        snapshot is never collected by two workers.
 
-        format of snapshot:
-            snapshot.<fabric-name>.<date>.tgz
-            /md5checksum                checksum of bundle.tgz
-            /bundle.tgz
+        format of snapshot (indexed container, see archive module):
+            snapshot.<fabric-name>.<date>.snap
                 /snapshot.json          snapshot object attributes
                 /definition.json
                 /node-X                 note, node-0 is for global objects
                     /<classname.json>   per-object class collection
 
     """
-    from ..utils import (get_app_config, format_timestamp, pretty_print)
     logger.debug("execute snapshot for: %s" % snapshot_id)
 
+    # init progress, error, status to block second process from running
+    lease = jobs.Lease(Snapshots, snapshot_id)
+    if not lease.acquire(["init", "error"], update={
+            "nodes": [],
+            "fabric_domain": "",
+            "progress": 0.0,
+            "filename": "",
+            "filesize": 0,
+            "start_time": time.time(),
+            "total_time": 0,
+            "wait_time": 0,
+            "error": "",
+            "class_stats": [],
+        }):
+        logger.warn("snapshot %s not found or already running" % snapshot_id)
+        return
+    try:
+        run_snapshot(snapshot_id, lease)
+    finally:
+        lease.release()
+
+def run_snapshot(snapshot_id, lease):
+    """ perform snapshot collection for snapshot object with lease held """
+    from ..utils import (get_app_config, format_timestamp, pretty_print)
+
     config = get_app_config()
     src = config.get("TMP_DIR", "/tmp/")
     dst = config.get("DATA_DIR", "/tmp/")
+    # apic query options for each collected class
+    query_opts = {
+        "page_concurrency": config.get("APIC_PAGE_CONCURRENCY", 1),
+        "stream": config.get("APIC_STREAM_PARSE", False),
+    }
 
     reg = "topology/pod-[0-9]+/node-(?P<node>[0-9]+)(/|$)"
     reg = re.compile(reg)
@@ -313,14 +441,15 @@ def execute_snapshot(snapshot_id):
     # user of final result
     ts = time.time()    
     apic = None
+    stop = threading.Event()    # signal collection threads to stop
     s = Snapshots.load(_id=snapshot_id)
     if not s.exists():
         logger.warn("snapshot %s not found" % snapshot_id)
         return
     
-    filename = "snapshot.%s.%s.tgz"% (s.fabric, format_timestamp(ts,msec=True))
+    filename = "snapshot.%s.%s.snap"% (s.fabric, format_timestamp(ts,msec=True))
     filename = get_unique_filename(dst, filename)
-    src = "%s/%s"%(src, re.sub("\.tgz$","", filename))
+    src = "%s/%s"%(src, re.sub("\.snap$","", filename))
 
     # update snapshot state with error message and error status
     def fail(msg="", cleanup=True):
@@ -328,7 +457,9 @@ def execute_snapshot(snapshot_id):
         s.status = "error"
         s.total_time = abs(time.time() - ts)
         logger.debug("snapshot %s failed: %s" % (s._id, s.error))
-        if not s.save(): logger.warn("failed to save snapshot %s state"%s._id)
+        # snapshot state is owned by another worker if the lease was lost
+        if lease.lost: logger.debug("lease lost, skipping snapshot state update")
+        elif not s.save(): logger.warn("failed to save snapshot %s state"%s._id)
         if cleanup: tmp_cleanup()
         return
 
@@ -354,10 +485,10 @@ def execute_snapshot(snapshot_id):
 
     # user can force snapshot execution to stop by deleting the object
     # abort_snapshot is checked at a regular interval.  If snapshot was deleted
-    # then perform cleanup and return True, else return False
+    # or the lease was lost then perform cleanup and raise exception
     def abort_snapshot():
         _s = Snapshots.load(_id=s._id)
-        if not _s.exists(): 
+        if not _s.exists() or lease.lost: 
             logger.debug("snapshot %s has been deleted, aborting" % s._id)
             tmp_cleanup()
             raise Exception("snapshot operation %s aborted" % s._id)
@@ -366,95 +497,65 @@ def execute_snapshot(snapshot_id):
     def json_write(path, data):
         if not re.search("\.json$", path): path = "%s.json" % path
         if not os.path.exists(os.path.dirname(path)): 
-            os.makedirs(os.path.dirname(path))
+            # multiple collection threads may create the same node directory
+            try: os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if not os.path.isdir(os.path.dirname(path)): raise e
         logger.debug("saving to %s" % (path))
         with open("%s" % path, "w") as f: json.dump(data, f)
 
-    # init progress, error, status
-    s.nodes = []
-    s.fabric_domain = ""
-    s.progess = 0.0
-    s.filename = ""
-    s.filesize = 0
-    s.start_time = ts
-    s.total_time = 0
-    s.wait_time = 0
-    s.error = ""
-    s.status = "running"
-    s.save()
-
-    try:
-        # setup working directory to store collection outputs
-        if os.path.exists(src):
-            return fail("tmp directory already exists: %s"%src, cleanup=False)
-        os.makedirs(src)
-
-        # get definition managed_objects to collect
-        d = Definitions.load(definition=s.definition)
-        if not d.exists():
-            return fail("unable to read definition: %s" % s.definition)
-        managed_objects = d.get_managed_objects()
-
-        # ensure all required objects are within definition.  If not add them
-        for r in Remap.REQUIRED_MANAGED_OBJECTS:
-            if r not in managed_objects:
-                logger.debug("adding required mo to definition: %s"%r)
-                mo = ManagedObjects(classname=r)
-                mo.analyzer = "exclude"
-                managed_objects[mo.classname] = mo.to_json()
-
-        # create apic session
-        apic = aci_utils.get_apic_session(s.fabric)
-        if apic is None: return fail("unable to connect to %s apic" % s.fabric)
-    
-        ret = aci_utils.get_class(apic,"infraCont")
-        if ret is not None and len(ret)>0 and "infraCont" in ret[0] and \
-            "attributes" in ret[0]["infraCont"] and \
-            "fbDmNm" in ret[0]["infraCont"]["attributes"]:
-            s.fabric_domain = ret[0]["infraCont"]["attributes"]["fbDmNm"]
-
-        complete_count = 0
-        for classname in managed_objects:
-            complete_count+=1
-            o = managed_objects[classname]
-            if len(o["classname"])==0:
-                logger.warn("%s ignoring empty classname %s" % (
-                    s.definition, o["classname"]))
-                continue
-            _t = time.time()
-            response_classes = []
-            logger.debug("getting data for class %s" % o["classname"])
-            if o["pseudo"]: 
-                # for pseudo mo, collect each of the classnames defined in the
-                # corresponding customer analyzer.  If no customer analyzer then
-                # no objects will be collected...
-                if o["analyzer"] in ManagedObjects.ANALYZERS and \
-                    "classnames" in ManagedObjects.ANALYZERS[o["analyzer"]]:
-                    ret = []
-                    for ac in ManagedObjects.ANALYZERS[o["analyzer"]]["classnames"]:
-                        order = "%s.%s" % (ac, "dn")   # static to dn for now
-                        sret = aci_utils.get_class(apic, ac, orderBy=order)
-                        if sret is not None: 
-                            ret+= sret
-                            response_classes.append(ac)
-            elif len(o["uri"])>0: 
-                ret = aci_utils.get(apic, o["uri"])
-                response_classes.append(o["classname"])
-            else: 
-                order = "%s.%s" % (o["classname"], o["key"])
-                ret = aci_utils.get_class(apic, o["classname"], orderBy=order)
-                response_classes.append(o["classname"])
-            s.wait_time += abs(time.time() - _t)
-            # if failed to get object, might not exists on current version of
-            # code.  just continue
-            if ret is None: 
-                progress(complete_count, len(managed_objects)+1)
-                continue
-            
-            # need to parse each received object and group based on node-id
-            cc_match = None # cache expected response_classes value (usually the
-                            # same for all objects expect for pseudo case)
-            nodes = {}
+    # collect a single managed object, group by node-id, and write results to
+    # file.  This is executed within collection threads and must not modify
+    # the snapshot object, return tuple (classname, latency, node list, count)
+    # or None if collection was skipped or failed.
+    def collect(classname):
+        if stop.is_set(): return None
+        o = managed_objects[classname]
+        if len(o["classname"])==0:
+            logger.warn("%s ignoring empty classname %s" % (
+                s.definition, o["classname"]))
+            return None
+        _t = time.time()
+        ret = None
+        response_classes = []
+        logger.debug("getting data for class %s" % o["classname"])
+        if o["pseudo"]: 
+            # for pseudo mo, collect each of the classnames defined in the
+            # corresponding customer analyzer.  If no customer analyzer then
+            # no objects will be collected...
+            def pseudo_objects(classnames):
+                for ac in classnames:
+                    order = "%s.%s" % (ac, "dn")   # static to dn for now
+                    sret = aci_utils.get_class(apic, ac, orderBy=order,
+                            **query_opts)
+                    if sret is not None: 
+                        response_classes.append(ac)
+                        for c in sret: yield c
+            if o["analyzer"] in ManagedObjects.ANALYZERS and \
+                "classnames" in ManagedObjects.ANALYZERS[o["analyzer"]]:
+                ret = pseudo_objects(
+                    ManagedObjects.ANALYZERS[o["analyzer"]]["classnames"])
+        elif len(o["uri"])>0: 
+            ret = aci_utils.get(apic, o["uri"], **query_opts)
+            response_classes.append(o["classname"])
+        else: 
+            order = "%s.%s" % (o["classname"], o["key"])
+            ret = aci_utils.get_class(apic, o["classname"], orderBy=order,
+                    **query_opts)
+            response_classes.append(o["classname"])
+        # if failed to get object, might not exists on current version of
+        # code.  just continue
+        if ret is None: return (o["classname"], abs(time.time()-_t), [], 0)
+        
+        # need to parse each received object and write it to corresponding
+        # node file.  Objects may be received as they are parsed from the apic
+        # reply so latency includes the time to consume all objects
+        cc_match = None # cache expected response_classes value (usually the
+                        # same for all objects expect for pseudo case)
+        nodes = set()
+        count = 0
+        writer = JsonArrayWriter()
+        try:
             for c in ret:
                 node = "0"
                 if type(c) is dict and len(c)>=1:
@@ -469,10 +570,10 @@ def execute_snapshot(snapshot_id):
                                 cc = c[cc_match]
                                 break
                             else:
-                                # check if 'children' is present and first level
-                                # child has corresponding object. before child 
-                                # check, try to extract node-id (i.e., stats 
-                                # object node-id from original parent object)
+                                # check if 'children' is present and first 
+                                # level child has corresponding object. before
+                                # child check, try to extract node-id (i.e., 
+                                # stats object node-id from original parent)
                                 tc = c[c.keys()[0]]
                                 if "attributes" in tc and "dn" in tc["attributes"]:
                                     r = reg.search(tc["attributes"]["dn"])
@@ -491,42 +592,125 @@ def execute_snapshot(snapshot_id):
                         if "dn" in cc["attributes"]: 
                             r = reg.search(cc["attributes"]["dn"])
                             if r is not None: node = r.group("node")
-                        if node not in nodes: nodes[node] = []
-                        if node not in s.nodes: s.nodes.append(node)
-                        nodes[node].append(c)
+                        nodes.add(node)
+                        writer.write("%s/node-%s/%s.json" % (src, node,
+                            o["classname"]), c)
+                        count+= 1
+                        if stop.is_set(): break
                         continue
                 logger.debug("skipping unsupported object: %s" % c) 
+        except Exception as e:
+            # partial reply is treated the same as failed query
+            logger.warn("failed to collect %s: %s" % (o["classname"], e))
+            writer.abort()
+            return (o["classname"], abs(time.time()-_t), [], 0)
+        latency = abs(time.time() - _t)
+
+        # discard partial results if snapshot was aborted
+        if stop.is_set():
+            writer.abort()
+            return None
+        writer.close()
+        return (o["classname"], latency, list(nodes), count)
+
+    try:
+        # setup working directory to store collection outputs
+        if os.path.exists(src):
+            return fail("tmp directory already exists: %s"%src, cleanup=False)
+        os.makedirs(src)
 
-            # for each node, write results to file
-            for n in nodes:
-                json_write("%s/node-%s/%s" % (src,n, o["classname"]), nodes[n])
+        # get definition managed_objects to collect
+        d = Definitions.load(definition=s.definition)
+        if not d.exists():
+            return fail("unable to read definition: %s" % s.definition)
+        managed_objects = d.get_managed_objects()
 
-            # check for abort and then update progress 
-            progress(complete_count, len(managed_objects)+1)
+        # ensure all required objects are within definition.  If not add them
+        for r in Remap.REQUIRED_MANAGED_OBJECTS:
+            if r not in managed_objects:
+                logger.debug("adding required mo to definition: %s"%r)
+                mo = ManagedObjects(classname=r)
+                mo.analyzer = "exclude"
+                managed_objects[mo.classname] = mo.to_json()
+
+        # create apic session
+        f = Fabric.load(fabric=s.fabric)
+        if not f.exists(): return fail("fabric %s not found" % s.fabric)
+        apic = aci_utils.get_apic_session(f)
+        if apic is None: return fail("unable to connect to %s apic" % s.fabric)
+    
+        ret = aci_utils.get_class(apic,"infraCont")
+        if ret is not None and len(ret)>0 and "infraCont" in ret[0] and \
+            "attributes" in ret[0]["infraCont"] and \
+            "fbDmNm" in ret[0]["infraCont"]["attributes"]:
+            s.fabric_domain = ret[0]["infraCont"]["attributes"]["fbDmNm"]
+
+        # fan class queries out over a bounded pool of threads sharing the apic
+        # session. Snapshot object is only updated from this thread as each
+        # class completes.  Class queries overlap so wait_time is the elapsed
+        # time of the collection, per-class latency is kept in class_stats
+        classnames = [c for c in managed_objects]
+        concurrency = max(1, min(f.snapshot_concurrency, len(classnames)))
+        logger.debug("collecting %s classes with concurrency %s" % (
+            len(classnames), concurrency))
+        stats = {}
+        pool = None
+        collect_ts = time.time()
+        try:
+            if concurrency > 1:
+                pool = ThreadPool(processes=concurrency)
+                results = pool.imap_unordered(collect, classnames)
+            else:
+                results = (collect(c) for c in classnames)
+            complete_count = 0
+            for result in results:
+                complete_count+=1
+                s.wait_time = abs(time.time() - collect_ts)
+                if result is not None:
+                    (classname, latency, nodes, count) = result
+                    stats[classname] = {
+                        "classname": classname,
+                        "latency": round(latency, 3),
+                        "objects": count
+                    }
+                    for n in nodes:
+                        if n not in s.nodes: s.nodes.append(n)
+                # check for abort and then update progress 
+                progress(complete_count, len(managed_objects)+1)
+        finally:
+            # signal any remaining threads to stop and wait for in-flight
+            # requests to complete
+            stop.set()
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        # per-class stats are reported in definition order
+        s.class_stats = [stats[c] for c in classnames if c in stats]
 
         # sort nodes before saving
         s.nodes = sorted(s.nodes)
 
+        # precompute remap tables for each node so compare operations can load
+        # them instead of rebuilding from the collected objects
+        for n in s.nodes:
+            if not Remap(n, "%s/node-%s" % (src, n)).save():
+                logger.warn("failed to save remap tables for node %s" % n)
+
+        # use configured codec if available, else fallback to default codec
+        s.codec = config.get("SNAPSHOT_CODEC", archive.DEFAULT_CODEC)
+        if archive.get_codec(s.codec) is None: s.codec = archive.DEFAULT_CODEC
+
         json_write("%s/snapshot" % src, s.to_json())
         json_write("%s/definition" % src, {
             "definition": s.definition,
             "managed_objects": managed_objects
         })
 
-        # bundle all files 
-        ret = aci_utils.run_command("cd %s ; tar -zcvf bundle.tgz ./*" % src)
-        if ret is None: return fail("failed to create snapshot bundle")
-
-        # get md5 for bundle
-        md5 = aci_utils.get_file_md5("%s/bundle.tgz" % src)
-        if md5 is None: return fail("failed to calculate bundle md5")
-        json_write("%s/md5checksum" % src, {"md5checksum": md5})
-
-        # create final bundle with bundle.tgz and md5checksum.json
-        cmd = "cd %s ; tar --force-local -zcvf %s " % (src,filename)
-        cmd+= "./bundle.tgz ./md5checksum.json" 
-        if aci_utils.run_command(cmd) is None:
-            return fail("failed to create snapshot bundle")
+        # bundle all files and create final snapshot with md5checksum
+        md5 = archive.create_snapshot(src, "%s/%s" % (src, filename), 
+                codec=s.codec, level=config.get("SNAPSHOT_CODEC_LEVEL", 0))
+        if md5 is None: return fail("failed to create snapshot bundle")
 
         # to prevent race condition of 'delete' operation during compression,
         # perform one last abort check before moving complete file to dst
@@ -536,8 +720,9 @@ def execute_snapshot(snapshot_id):
         if not os.path.isdir(dst): os.makedirs(dst)
 
         # move final bundle to dst directory and cleanup tmp directory
-        if aci_utils.run_command("mv %s/%s %s/" % (src,filename, dst)):
-            return fail("failed to save snapshot bundle")
+        try: shutil.move("%s/%s" % (src, filename), "%s/%s" % (dst, filename))
+        except Exception as e:
+            return fail("failed to save snapshot bundle: %s" % e)
         tmp_cleanup()
 
         # after everything is complete, update progress to 100% and complete
@@ -553,5 +738,47 @@ def execute_snapshot(snapshot_id):
         logger.debug(traceback.format_exc())
         fail("unexpected error occurred: %s" % e)
 
-
-
+def convert_snapshots():
+    """ convert all legacy (tgz or tar) snapshots to indexed snapshots.  The
+        snapshot object is updated with the new filename and the legacy file
+        is removed after successful conversion.
+        return boolean success
+    """
+    from ..utils import get_app_config
+    config = get_app_config()
+    tmp = config.get("TMP_DIR", "/tmp/")
+    codec = config.get("SNAPSHOT_CODEC", archive.DEFAULT_CODEC)
+    if archive.get_codec(codec) is None: codec = archive.DEFAULT_CODEC
+    success = True
+    for o in Snapshots.read(_disable_page=True, status="complete")["objects"]:
+        s = Snapshots.load(_id=o["_id"])
+        if not s.exists() or len(s.filename)==0: continue
+        if not os.path.exists(s.filename):
+            logger.warn("snapshot %s file %s not found" % (s._id, s.filename))
+            continue
+        if archive.is_indexed(s.filename): continue
+        d = os.path.dirname(s.filename)
+        filename = get_unique_filename(d, "%s.snap" % re.sub("\.(tgz|tar)$", 
+                    "", os.path.basename(s.filename)))
+        filename = os.path.join(d, filename)
+        logger.debug("converting snapshot %s: %s -> %s" % (s._id, s.filename,
+            filename))
+        md5 = archive.convert_snapshot(s.filename, filename, "%s/convert.%s.%s"%(
+                tmp, s._id, int(time.time())), codec=codec,
+                level=config.get("SNAPSHOT_CODEC_LEVEL", 0))
+        if md5 is None:
+            logger.warn("failed to convert snapshot %s" % s._id)
+            if os.path.exists(filename): os.remove(filename)
+            success = False
+            continue
+        legacy = s.filename
+        s.filename = filename
+        s.filesize = os.path.getsize(filename)
+        s.codec = codec
+        if not s.save():
+            logger.warn("failed to save snapshot %s" % s._id)
+            os.remove(filename)
+            success = False
+            continue
+        os.remove(legacy)
+    return success
@@ -803,12 +803,14 @@ class Session(object):
         logging.debug('Response: %s %s', resp, resp.text)
         return resp
 
-    def get(self, url, timeout=None):
+    def get(self, url, timeout=None, stream=False):
         """
         Perform a REST GET call to the APIC.
 
         :param url: String containing the URL that will be used to\
         send the object data to the APIC.
+        :param stream: Boolean. If True, the response body is not read\
+        so the caller can consume it incrementally with iter_content.
         :returns: Response class instance from the requests library.\
         response.ok is True if request is sent successfully.\
         response.json() will return the JSON data sent back by the APIC.
@@ -817,7 +819,8 @@ class Session(object):
         logging.debug(get_url)
 
         cookies = self._prep_x509_header('GET', url)
-        resp = self.session.get(get_url, timeout=timeout, verify=self.verify_ssl, proxies=self._proxies, cookies=cookies)
+        resp = self.session.get(get_url, timeout=timeout, verify=self.verify_ssl, proxies=self._proxies, cookies=cookies,
+                                stream=stream)
         if resp.status_code == 403:
             if self.cert_auth and not (self.appcenter_user and self._subscription_enabled):
                 logging.error('Certificate authentication failed. Please check all settings are correct.')
@@ -829,7 +832,8 @@ class Session(object):
                 self.resubscribe()
                 logging.error('Trying get again...')
                 logging.debug(get_url)
-                resp = self.session.get(get_url, timeout=timeout, verify=self.verify_ssl, proxies=self._proxies)
+                resp = self.session.get(get_url, timeout=timeout, verify=self.verify_ssl, proxies=self._proxies,
+                                        stream=stream)
         elif resp.status_code == 400 and 'Unable to process the query, result dataset is too big' in resp.text:
             # Response is too big so we will need to get the response in pages
             # Get the first chunk of entries
@@ -864,7 +868,8 @@ class Session(object):
             while retries > 0:
                 logging.debug('Retrying query')
                 cookies = self._prep_x509_header('GET', url)
-                resp = self.session.get(get_url, timeout=timeout, verify=self.verify_ssl, proxies=self._proxies, cookies=cookies)
+                resp = self.session.get(get_url, timeout=timeout, verify=self.verify_ssl, proxies=self._proxies, cookies=cookies,
+                                        stream=stream)
                 if resp.status_code != 200:
                     logging.debug('Retry was not successful.')
                     retries -= 1
@@ -875,7 +880,8 @@ class Session(object):
                 logging.error('Raising ConnectionError')
                 raise ConnectionError
         logging.debug(resp)
-        logging.debug(resp.text)
+        if not stream:
+            logging.debug(resp.text)
         return resp
 
     def register_login_callback(self, callback_fn):
@@ -4,10 +4,11 @@
 """
 
 import logging, logging.handlers, json, re, time, dateutil.parser, datetime
-import subprocess, os, signal, sys, traceback, requests
+import subprocess, os, signal, sys, traceback, requests, math, codecs
+from multiprocessing.pool import ThreadPool
 from pymongo import UpdateOne, InsertOne
 from pymongo.errors import BulkWriteError
-from ..utils import pretty_print, get_app
+from ..utils import pretty_print, get_app_config
 
 # module level logging
 logger = logging.getLogger(__name__)
@@ -73,20 +74,41 @@ def build_query_filters(**kwargs):
                 
 def get(session, url, **kwargs):
     # handle session request and perform basic data validation.  Return
-    # None on error
-
+    # None on error.  If stream is set, then a generator of objects is
+    # returned instead of a list (see get_objects)
+    if kwargs.get("stream", False): return get_objects(session, url, **kwargs)
+    pages = get_pages(session, url, **kwargs)
+    if pages is None: return None
+    results = []
+    try:
+        for page in pages: results+= page
+    except Exception as e:
+        logger.warn("failed to get all pages for %s: %s", url, e)
+        return None
+    return results
+
+def get_pages(session, url, **kwargs):
+    """ page through results for provided url and return a generator that
+        yields the imdata list of each page in order.  The first page is
+        always requested before returning so totalCount can be used to 
+        determine the remaining pages.  If page_concurrency is greater than
+        1, the remaining pages are requested concurrently in windows of
+        page_concurrency pages and yielded in order.
+
+        return None if the first page fails.  An exception is raised by the
+        generator if any subsequent page fails.
+    """
     # default page size handler and timeouts
     page_size = kwargs.get("page_size", 75000)
     timeout = kwargs.get("timeout", SESSION_MAX_TIMEOUT)
     limit = kwargs.get("limit", None)       # max number of returned objects
-    page = 0
+    page_concurrency = max(1, kwargs.get("page_concurrency", 1))
 
     url_delim = "?"
     if "?" in url: url_delim="&"
-    
-    results = []
-    # walk through pages until return count is less than page_size 
-    while 1:
+
+    def get_page(page):
+        # return json reply for single page or None on error
         turl = "%s%spage-size=%s&page=%s" % (url, url_delim, page_size, page)
         logger.debug("host:%s, timeout:%s, get:%s", session.ipaddr, 
             timeout,turl)
@@ -106,20 +128,262 @@ def get(session, url, **kwargs):
             if "imdata" not in js or "totalCount" not in js:
                 logger.warn("failed to parse js reply: %s", pretty_print(js))
                 return None
-            results+=js["imdata"]
-            logger.debug("results count: %s/%s",len(results),js["totalCount"])
-            if len(js["imdata"])<page_size or \
-                len(results)>=int(js["totalCount"]):
-                logger.debug("all pages received")
-                return results
-            elif (limit is not None and len(js["imdata"]) >= limit):
-                logger.debug("limit(%s) hit or exceeded", limit)
-                return results[0:limit]
-            page+= 1
+            return js
         except ValueError as e:
             logger.warn("failed to decode resp: %s", resp.text)
             return None
-    return None
+
+    js = get_page(0)
+    if js is None: return None
+
+    def pages(js):
+        count = len(js["imdata"])
+        total = int(js["totalCount"])
+        logger.debug("results count: %s/%s", count, total)
+        if limit is not None and count >= limit:
+            logger.debug("limit(%s) hit or exceeded", limit)
+            yield js["imdata"][0:limit]
+            return
+        yield js["imdata"]
+        if len(js["imdata"])<page_size or count>=total:
+            logger.debug("all pages received")
+            return
+        # remaining pages known from totalCount of first reply
+        remaining = range(1, int(math.ceil(total/(1.0*page_size))))
+        pool = None
+        if page_concurrency > 1 and len(remaining) > 1:
+            pool = ThreadPool(processes=min(page_concurrency, len(remaining)))
+        try:
+            while len(remaining) > 0:
+                window = remaining[0:page_concurrency]
+                remaining = remaining[page_concurrency:]
+                if pool is not None: replies = pool.map(get_page, window)
+                else: replies = [get_page(window[0])]
+                for i, js in enumerate(replies):
+                    if js is None:
+                        raise Exception("failed to get page %s" % window[i])
+                    count+= len(js["imdata"])
+                    logger.debug("results count: %s/%s", count, total)
+                    if limit is not None and count >= limit:
+                        logger.debug("limit(%s) hit or exceeded", limit)
+                        yield js["imdata"][0:len(js["imdata"])-(count-limit)]
+                        return
+                    yield js["imdata"]
+                    if len(js["imdata"])<page_size:
+                        logger.debug("all pages received")
+                        return
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    return pages(js)
+
+class ImdataStream(object):
+    """ incremental parser for APIC json replies of the form
+            {"totalCount": "N", "imdata": [{...}, {...}, ...]}
+        Iterating over the stream yields each object within imdata as soon as
+        it has been received.  Other top-level values (i.e., totalCount) are
+        available in attributes as soon as they are parsed and always after
+        iteration completes.  Memory usage is 
+        proportional to a single object and the size of one chunk.
+
+        ValueError is raised on invalid or truncated reply
+    """
+    WS = re.compile("[ \t\n\r]*")
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.attributes = {}
+        self.count = 0
+        self.buf = u""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # read next chunk into buffer, return False when no more data
+        if self.eof: return False
+        for chunk in self.chunks:
+            data = self.utf8.decode(chunk)
+            if len(data) == 0: continue
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+            return True
+        self.eof = True
+        return False
+
+    def _peek(self):
+        # skip whitespace and return next character or None at end of data
+        while True:
+            self.pos = ImdataStream.WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            if not self._fill(): return None
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c is None or c not in chars:
+            raise ValueError("expected '%s' at offset %s, found: %s" % (
+                chars, self.pos, c))
+        self.pos+= 1
+        return c
+
+    def _value(self):
+        # decode next complete json value from buffer, reading more data as
+        # needed.  A value ending at the end of the buffer (i.e., a number)
+        # is only accepted at end of data
+        self._peek()
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError as e:
+                if self.eof: raise e
+            if not self._fill() and self.pos >= len(self.buf):
+                raise ValueError("unexpected end of data")
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}": return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "imdata":
+                self._expect("[")
+                if self._peek() == "]": self.pos+= 1
+                else:
+                    while True:
+                        obj = self._value()
+                        self.count+= 1
+                        yield obj
+                        if self._expect(",]") == "]": break
+            else:
+                self.attributes[key] = self._value()
+            if self._expect(",}") == "}": return
+
+def get_objects(session, url, **kwargs):
+    """ streaming equivalent of get that returns a generator yielding one
+        object at a time as it is parsed from the APIC reply.  Each page is
+        parsed as it is received.  If page_concurrency is greater than 1, up
+        to page_concurrency subsequent pages are requested in the background
+        once totalCount is known and buffered until the current page has been
+        consumed (memory usage grows with page_concurrency as each prefetched
+        page is held as a raw reply).  Otherwise, the next page is only
+        requested after the current page has been consumed.
+
+        return None if the first page fails.  An exception is raised by the
+        generator if any subsequent page fails or a reply cannot be parsed.
+    """
+    page_size = kwargs.get("page_size", 75000)
+    timeout = kwargs.get("timeout", SESSION_MAX_TIMEOUT)
+    limit = kwargs.get("limit", None)       # max number of returned objects
+    chunk_size = kwargs.get("chunk_size", 65536)
+    page_concurrency = max(1, kwargs.get("page_concurrency", 1))
+
+    url_delim = "?"
+    if "?" in url: url_delim="&"
+
+    def get_page(page):
+        # return streaming response for single page or None on error
+        turl = "%s%spage-size=%s&page=%s" % (url, url_delim, page_size, page)
+        logger.debug("host:%s, timeout:%s, get (stream):%s", session.ipaddr,
+            timeout, turl)
+        try:
+            resp = session.get(turl, timeout=timeout, stream=True)
+        except Exception as e:
+            logger.warn("exception occurred in get request: %s",
+                traceback.format_exc())
+            return None
+        if resp is None or not resp.ok:
+            logger.warn("failed to get data: %s", url)
+            if resp is not None: resp.close()
+            return None
+        return resp
+
+    def read_page(page):
+        # return full raw reply for single page or None on error
+        resp = get_page(page)
+        if resp is None: return None
+        try:
+            return "".join(resp.iter_content(chunk_size=chunk_size))
+        except Exception as e:
+            logger.warn("failed to read page %s: %s", page, e)
+            return None
+        finally:
+            resp.close()
+
+    resp = get_page(0)
+    if resp is None: return None
+
+    def objects(resp):
+        page = 0
+        count = 0
+        # prefetch state: pool, AsyncResult indexed by page, and last page
+        prefetch = {"pool": None, "pending": {}, "last": None}
+
+        def start_prefetch(stream):
+            # start prefetch once totalCount of the first reply is known
+            if page_concurrency <= 1 or prefetch["last"] is not None: return
+            if "totalCount" not in stream.attributes: return
+            total = int(stream.attributes["totalCount"])
+            prefetch["last"] = int(math.ceil(total/(1.0*page_size))) - 1
+            if prefetch["last"] <= 0: return
+            prefetch["pool"] = ThreadPool(processes=min(page_concurrency,
+                                    prefetch["last"]))
+            request_pages(0)
+
+        def request_pages(current):
+            # keep up to page_concurrency pages after current page requested
+            pending = prefetch["pending"]
+            n = max(pending.keys() + [current]) + 1
+            while len(pending) < page_concurrency and n <= prefetch["last"]:
+                pending[n] = prefetch["pool"].apply_async(read_page, (n,))
+                n+= 1
+
+        try:
+            while True:
+                tstart = time.time()
+                if resp is not None:
+                    stream = ImdataStream(resp.iter_content(chunk_size=chunk_size))
+                else:
+                    stream = ImdataStream([body])
+                try:
+                    for obj in stream:
+                        if page == 0: start_prefetch(stream)
+                        count+= 1
+                        yield obj
+                        if limit is not None and count >= limit:
+                            logger.debug("limit(%s) hit or exceeded", limit)
+                            return
+                finally:
+                    if resp is not None: resp.close()
+                if "totalCount" not in stream.attributes:
+                    raise Exception("totalCount not found in reply for %s" % url)
+                total = int(stream.attributes["totalCount"])
+                logger.debug("page %s received in %f, results count: %s/%s", page,
+                    (time.time() - tstart), count, total)
+                if stream.count < page_size or count >= total:
+                    logger.debug("all pages received")
+                    return
+                if page == 0: start_prefetch(stream)
+                page+= 1
+                if page in prefetch["pending"]:
+                    resp = None
+                    body = prefetch["pending"].pop(page).get()
+                    if body is None: raise Exception("failed to get page %s" % page)
+                    request_pages(page)
+                else:
+                    resp = get_page(page)
+                    if resp is None: raise Exception("failed to get page %s" % page)
+        finally:
+            if prefetch["pool"] is not None:
+                prefetch["pool"].close()
+                prefetch["pool"].join()
+
+    return objects(resp)
 
 def get_dn(session, dn, **kwargs):
     # get a single dn.  Note, with advanced queries this may be list as well
@@ -218,15 +482,15 @@ def get_apic_session(fabric, subscription_enabled=False):
         return
 
     # build list of apics for session attempt
-    app = get_app()
+    config = get_app_config()
     hostnames = [aci.apic_hostname]
-    if not app.config["ACI_APP_MODE"]:
+    if not config["ACI_APP_MODE"]:
         for h in aci.controllers:
             if h not in hostnames: hostnames.append(h)
 
     # determine if we should connect with cert or credentials
     apic_cert_mode = False
-    if len(aci.apic_cert)>0 and app.config["ACI_APP_MODE"]:
+    if len(aci.apic_cert)>0 and config["ACI_APP_MODE"]:
         logger.debug("session mode set to apic_cert_mode")
         apic_cert_mode = True
         if not os.path.exists(aci.apic_cert):
@@ -353,9 +617,9 @@ def execute_worker(arg_str, background=True):
     """
 
     # set log directory for stdout and stderr
-    app = get_app()
-    stdout = "%s/worker.stdout.log" % app.config.get("LOG_DIR", "/home/app/log")
-    stderr = "%s/worker.stderr.log" % app.config.get("LOG_DIR", "/home/app/log")
+    config = get_app_config()
+    stdout = "%s/worker.stdout.log" % config.get("LOG_DIR", "/home/app/log")
+    stderr = "%s/worker.stderr.log" % config.get("LOG_DIR", "/home/app/log")
     
 
     # get absolute path for top of app
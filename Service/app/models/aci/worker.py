@@ -5,7 +5,7 @@
     @author agossett@cisco.com
 """
 
-from .. utils import get_app, get_db, setup_logger
+from .. utils import get_db, setup_logger
 import logging, sys, traceback
 
 # setup logging for everything in 'app'
@@ -35,6 +35,16 @@ def execute_compare(compare_id):
     from .compare import execute_compare
     execute_compare(compare_id)
 
+def run_job_runner():
+    """ run job runner until stopped """
+    from .jobs import run_job_runner
+    return run_job_runner()
+
+def convert_snapshots():
+    """ convert legacy snapshots to indexed snapshots """
+    from .snapshots import convert_snapshots
+    return convert_snapshots()
+
 def get_args():
     """ get arguments for worker """
     import argparse
@@ -50,6 +60,11 @@ def get_args():
         default=None, help="execute snapshot for provided snapshot id")
     parser.add_argument("--compare", action="store", dest="compare",
         default=None, help="perform comparison for provided compare id")
+    parser.add_argument("--runner", action="store_true", dest="runner",
+        help="run job runner to execute queued snapshot and compare jobs")
+    parser.add_argument("--convert_snapshots", action="store_true", 
+        dest="convert_snapshots", 
+        help="convert legacy snapshots in DATA_DIR to indexed snapshots")
     args = parser.parse_args()
     return args
 
@@ -71,18 +86,24 @@ if __name__ == "__main__":
         logger.debug("worker request: compare (%s)"%args.compare)
         method = execute_compare
         method_args = [args.compare]
+    elif args.runner:
+        logger.debug("worker request: runner")
+        method = run_job_runner
+    elif args.convert_snapshots:
+        logger.debug("worker request: convert_snapshots")
+        method = convert_snapshots
     else:
         logger.warn("no action provided.  use -h for help")
         sys.exit(1)
 
-    # execute method with required arguments and exit with appropriate exit code
-    from ..utils import get_app
-    app = get_app()
-    with app.app_context():
-        try:
-            if not method(*method_args): sys.exit(1)
-            sys.exit(0)
-        except Exception as e:
-            sys.stderr.write("%s\n"% traceback.format_exc())
+    # execute method with required arguments and exit with appropriate exit code.
+    # Only the aci models are registered, the full app is not required
+    from ... import register_worker_models
+    try:
+        register_worker_models()
+        if not method(*method_args): sys.exit(1)
+        sys.exit(0)
+    except Exception as e:
+        sys.stderr.write("%s\n"% traceback.format_exc())
     sys.exit(1)
 
@@ -5,6 +5,8 @@ from .decorators import api_register
 from .decorators import api_route
 from .decorators import register
 from .decorators import registered_classes
+from .identity import IdentityMap
+from .identity import get_identity_stats
 from .rest import Rest
 from .role import Role
 from .role_api import RoleApi
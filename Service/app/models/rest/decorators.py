@@ -273,7 +273,8 @@ def api_callback(callback, cls=None):
 
 def register(api, uni=True):
     """ register routes for each class with provided api blueprint and build per-object swagger 
-        definition
+        definition.  If api is None then only the class dependencies, keys, and callbacks are
+        initialized without any routes or swagger definition (used by standalone workers)
     """
     # first handle object dependencies sitting in RestDependency root
     global root
@@ -297,7 +298,8 @@ def register(api, uni=True):
         # after class has been init, check for method route_info and callback_info
         for name, method in c.__dict__.iteritems():
             # route_info for normal bound methods on object
-            if hasattr(method, "route_info"): 
+            if api is None: pass
+            elif hasattr(method, "route_info"): 
                 c._access["routes"].append(method.route_info)
             # route_info for classmethod and staticmethods
             elif hasattr(method, "__func__") and hasattr(method.__func__, "route_info"):
@@ -365,7 +367,7 @@ def register(api, uni=True):
         c._swagger = {}
 
         # add create path
-        if c._access["create"]:
+        if c._access["create"] and api is not None:
             endpoint = "%s_create" % c.__name__.lower()
             api.add_url_rule(path, endpoint , c.api_create, methods=["POST"])
             #c.logger.debug("registered create path: POST %s", path)
@@ -390,6 +392,7 @@ def register(api, uni=True):
         c._key_path = key_path
         c._key_swag_path = key_swag_path
         c._dn_path = re.sub("{.+?}","{}", c._key_swag_path)
+        if api is None: continue
 
         #c.logger.debug("%s, dn: %s, attributes: %s", c._classname, c._dn_path, c._dn_attributes)
 
@@ -0,0 +1,234 @@
+"""
+    Tokenizer and recursive-descent parser for the Rest.filter syntax.  A filter
+    string is parsed in a single pass into the corresponding mongo filter:
+
+        filter      := operator
+        operator    := name "(" operand ["," operand]* ")"
+        operand     := operator | string | number | boolean
+        string      := double quoted string, quotes escaped with backslash
+        number      := -?[0-9.]+
+        boolean     := true | false
+
+    Parsed filters are cached per Rest class and filter string in an LRU cache
+    so repeated filters (such as UI polling) are parsed only once.
+"""
+
+from collections import OrderedDict
+
+import copy
+import re
+import threading
+
+# maximum number of parsed filters kept in the LRU cache
+FILTER_CACHE_SIZE = 1024
+
+# logical operators with two or more operator operands
+LOGICAL_OPERATORS = ["and", "or"]
+
+# comparison operators with attribute and value operands mapped to mongo operator.
+# eq is a direct match and therefore does not use a mongo operator
+COMPARE_OPERATORS = {
+    "eq": None,
+    "neq": "$ne",
+    "gt": "$gt",
+    "ge": "$gte",
+    "lt": "$lt",
+    "le": "$lte",
+    "regex": "$regex",
+}
+
+# token types
+T_NAME = "name"
+T_STR = "str"
+T_NUM = "num"
+T_OPEN = "("
+T_CLOSE = ")"
+T_COMMA = ","
+
+TOKEN_REG = re.compile("""
+    (?P<space>\s+)|
+    (?P<str>"(?:[^"\\\\]|\\\\.)*")|
+    (?P<num>-?[0-9\.]+)|
+    (?P<name>[a-z]+)|
+    (?P<punct>[(),])
+""", re.IGNORECASE | re.VERBOSE | re.DOTALL)
+
+INDEX_REG = re.compile("^[0-9]+$")
+
+class FilterError(ValueError):
+    """ invalid filter string """
+    pass
+
+def tokenize(fs):
+    """ return list of (type, value) tokens for filter string """
+    tokens = []
+    pos = 0
+    end = len(fs)
+    while pos < end:
+        r1 = TOKEN_REG.match(fs, pos)
+        if r1 is None:
+            raise FilterError("invalid character '%s' at position %s" % (fs[pos], pos))
+        pos = r1.end()
+        kind = r1.lastgroup
+        if kind == "space":
+            continue
+        elif kind == "punct":
+            tokens.append((r1.group(kind), None))
+        elif kind == "str":
+            # string value is returned without surrounding quotes and as-is otherwise
+            tokens.append((T_STR, r1.group(kind)[1:-1]))
+        elif kind == "num":
+            try: tokens.append((T_NUM, float(r1.group(kind))))
+            except ValueError:
+                raise FilterError("invalid number %s" % r1.group(kind))
+        else:
+            tokens.append((T_NAME, r1.group(kind).lower()))
+    return tokens
+
+def get_filter_paths(attributes):
+    """ return dict of all attribute paths (excluding list indexes) for provided Rest attributes
+        mapped to the attribute type
+    """
+    paths = {}
+    def add_paths(meta, prefix):
+        for a in meta:
+            if not isinstance(meta[a], dict): continue
+            path = "%s%s" % (prefix, a)
+            paths[path] = meta[a].get("type", str)
+            sub = meta[a].get("meta", {})
+            if isinstance(sub, dict): add_paths(sub, "%s." % path)
+    add_paths(attributes, "")
+    return paths
+
+class FilterParser(object):
+    """ parse tokens of a single filter string into a mongo filter. Attributes are validated
+        against the paths returned by get_filter_paths.
+    """
+
+    def __init__(self, fs, paths):
+        self.tokens = tokenize(fs)
+        self.paths = paths
+        self.pos = 0
+
+    def parse(self):
+        if len(self.tokens) == 0: return {}
+        ret = self.parse_operator()
+        if self.pos < len(self.tokens):
+            raise FilterError("unexpected operand after end of filter")
+        return ret
+
+    def consume(self, expected=None):
+        """ return next token, raise error if it is not of expected type """
+        if self.pos >= len(self.tokens):
+            raise FilterError("unbalanced parenthesis")
+        token = self.tokens[self.pos]
+        if expected is not None and token[0] != expected:
+            raise FilterError("invalid operand or unbalanced parenthesis")
+        self.pos+= 1
+        return token
+
+    def peek(self):
+        if self.pos < len(self.tokens): return self.tokens[self.pos][0]
+        return None
+
+    def parse_operator(self):
+        operator = self.consume(T_NAME)[1]
+        if operator not in LOGICAL_OPERATORS and operator not in COMPARE_OPERATORS:
+            raise FilterError("unknown operator %s" % operator)
+        self.consume(T_OPEN)
+        operands = [self.parse_operand()]
+        while self.peek() == T_COMMA:
+            self.pos+= 1
+            operands.append(self.parse_operand())
+        self.consume(T_CLOSE)
+
+        if operator in LOGICAL_OPERATORS:
+            if len(operands) < 2:
+                raise FilterError("two or more operands required for '%s'" % operator)
+            for o in operands:
+                if not isinstance(o, dict):
+                    raise FilterError("'%s' operands must be operators" % operator)
+            return {"$%s" % operator: operands}
+
+        # all other operators must have two operands where first operand is a string representing
+        # the attribute name and the second is the value (which can be string, float, or bool)
+        if len(operands) != 2:
+            raise FilterError("received %s operands" % len(operands))
+        attribute, value = operands
+        if not isinstance(attribute, basestring) or isinstance(value, dict):
+            raise FilterError("invalid operand")
+        self.validate_attribute(attribute)
+        if operator == "regex":
+            try: re.compile(value)
+            except (re.error, TypeError) as e: raise FilterError("%s" % e)
+        if COMPARE_OPERATORS[operator] is None: return {attribute: value}
+        return {attribute: {COMPARE_OPERATORS[operator]: value}}
+
+    def parse_operand(self):
+        kind = self.peek()
+        if kind == T_STR or kind == T_NUM:
+            return self.consume()[1]
+        elif kind == T_NAME:
+            # boolean or nested operator
+            value = self.tokens[self.pos][1]
+            if value in ("true", "false") and \
+                (self.pos+1 >= len(self.tokens) or self.tokens[self.pos+1][0] != T_OPEN):
+                self.pos+= 1
+                return value == "true"
+            return self.parse_operator()
+        raise FilterError("invalid operand or unbalanced parenthesis")
+
+    def validate_attribute(self, attribute):
+        """ check that attribute exists or represents a sub object in list/dict. A list index
+            is allowed once after each list attribute
+        """
+        if attribute in self.paths: return
+        path = ""
+        metatype = dict
+        for attr in attribute.split("."):
+            sub = attr if len(path) == 0 else "%s.%s" % (path, attr)
+            if sub in self.paths:
+                path = sub
+                metatype = self.paths[sub]
+            elif metatype is list and INDEX_REG.search(attr):
+                metatype = None # only allow list match once
+            else:
+                raise FilterError("unknown attribute %s" % attribute)
+
+class FilterCache(object):
+    """ thread-safe LRU cache of parsed filters indexed by Rest class and filter string """
+
+    def __init__(self, max_size=FILTER_CACHE_SIZE):
+        self.filters = OrderedDict()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            ret = self.filters.pop(key, None)
+            if ret is not None: self.filters[key] = ret
+        return ret
+
+    def add(self, key, value):
+        with self.lock:
+            self.filters.pop(key, None)
+            self.filters[key] = value
+            while len(self.filters) > self.max_size:
+                self.filters.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.filters.clear()
+
+filter_cache = FilterCache()
+
+def compile_filter(cls, fs):
+    """ return mongo filter for provided Rest class and filter string.  The returned filter is
+        a copy and can be modified by the caller.  Raise FilterError on invalid filter
+    """
+    key = (cls, fs)
+    ret = filter_cache.get(key)
+    if ret is None:
+        ret = FilterParser(fs, cls._filter_paths).parse()
+        filter_cache.add(key, ret)
+    return copy.deepcopy(ret)
@@ -0,0 +1,99 @@
+"""
+    Identity map for Rest.load.  When an identity map is active for the current
+    thread, loading an object by its keys (or _id) returns the instance already
+    loaded within the same scope instead of performing another db read.  All
+    entries for a class are invalidated on any create, update, or delete of
+    that class (which includes save and remove).
+
+    The identity map is opt-in and scoped to a request or job:
+
+        with IdentityMap():
+            f1 = Fabric.load(fabric="fab1")
+            f2 = Fabric.load(fabric="fab1")     # f1 is f2
+
+    Objects that are polled for changes made by other processes must not be
+    loaded within an active scope.
+"""
+
+import logging
+import threading
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+# active identity map per thread
+_local = threading.local()
+
+# hit/miss counters across all identity maps within this process
+_stats = {"hits": 0, "misses": 0}
+
+def get_identity_map():
+    """ return identity map active for current thread or None """
+    return getattr(_local, "identity_map", None)
+
+def get_identity_stats():
+    """ return dict of hits and misses across all identity maps in process """
+    return dict(_stats)
+
+def invalidate_identity(cls):
+    """ remove all entries for provided Rest class from active identity map """
+    imap = get_identity_map()
+    if imap is not None: imap.invalidate(cls._classname)
+
+class IdentityMap(object):
+    """ per-scope cache of loaded Rest objects indexed by classname and keys """
+
+    def __init__(self):
+        self.objects = {}   # indexed by classname, then by key tuple
+        self.hits = 0
+        self.misses = 0
+        self.previous = None
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, *args):
+        self.deactivate()
+
+    def activate(self):
+        """ set as active identity map for current thread """
+        self.previous = get_identity_map()
+        _local.identity_map = self
+        return self
+
+    def deactivate(self):
+        """ restore previously active identity map for current thread """
+        if get_identity_map() is self: _local.identity_map = self.previous
+        self.previous = None
+        logger.debug("identity map closed, hits: %s, misses: %s", self.hits, self.misses)
+
+    def get_key(self, cls, kwargs):
+        """ return key tuple for load kwargs or None if kwargs contains any
+            non-key attribute and therefore the load cannot be cached
+        """
+        if len(kwargs) == 0: return None
+        for k in kwargs:
+            if k in cls._keys: continue
+            if k == "_id" and cls._access["expose_id"]: continue
+            return None
+        return tuple(sorted([(k, "%s" % kwargs[k]) for k in kwargs]))
+
+    def get(self, cls, key):
+        """ return loaded object or None """
+        obj = self.objects.get(cls._classname, {}).get(key, None)
+        if obj is None:
+            self.misses+= 1
+            _stats["misses"]+= 1
+        else:
+            self.hits+= 1
+            _stats["hits"]+= 1
+        return obj
+
+    def add(self, cls, key, obj):
+        """ add loaded object """
+        if cls._classname not in self.objects: self.objects[cls._classname] = {}
+        self.objects[cls._classname][key] = obj
+
+    def invalidate(self, classname):
+        """ remove all objects for provided classname """
+        self.objects.pop(classname, None)
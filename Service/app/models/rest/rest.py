@@ -1,11 +1,14 @@
 
 from ..utils import (hash_password, aes_encrypt, aes_decrypt, MSG_403,
-                    get_user_data, get_user_params, get_db)
+                    get_user_data, get_user_params, get_user_headers, get_db)
 from .decorators import CallbackInfo, RouteInfo
 from .dependency import RestDependency
+from .filters import FilterError, compile_filter, get_filter_paths
+from .identity import get_identity_map, invalidate_identity
 from .role import Role
 from bson.objectid import ObjectId, InvalidId
-from flask import abort, g, jsonify
+from flask import abort, g, json, jsonify
+from flask import Response, stream_with_context
 from pymongo.errors import (DuplicateKeyError, PyMongoError, BulkWriteError)
 from pymongo import (ASCENDING, DESCENDING, InsertOne, UpdateOne, UpdateMany)
 from werkzeug.exceptions import (NotFound, BadRequest, Forbidden, InternalServerError)
@@ -181,6 +184,10 @@ class Rest(object):
                             api_route decorators and would like to benefit from attribute validation
                             on non-meta attributes along with swagger documents for the attribute.
                             default False.
+                "bulk_read": bool, include attribute in bulk api reads when 'include' is not
+                            provided.  Set to False for large attributes that are only required
+                            when reading a single object.  The attribute is still returned in bulk
+                            reads when explicitly requested via 'include'. default True.
                 
                 (optional controls on create/update)
                 "regex":    str, regex validator
@@ -231,6 +238,7 @@ class Rest(object):
     META_ACCESS = {}
     DEFAULT_PAGE_SIZE = 10000
     MAX_PAGE_SIZE = 75000
+    STREAM_BATCH_SIZE = 1000    # objects per after_read callback for streamed reads
     MAX_RESULT_SIZE = 50000000
     ACCESS_DEF = {
         "expose_id": False,
@@ -271,6 +279,7 @@ class Rest(object):
         "encrypt": False,
         "hash": False,
         "reference": False,
+        "bulk_read": True,
         "regex": None,
         "min": None,
         "max": None,
@@ -295,14 +304,10 @@ class Rest(object):
                         #   /base/uname-%s/group-%s
     _dn_attributes = [] # when dn is enabled on object, this is fmt attribute names used for dn:
                         #   ['username', 'group'] for substituting /base/uname-%s/group-%s
-
-    operator_reg= "^[ ]*(?P<op>[a-z]+)[ ]*\((?P<data>.+)\)[ ]*$" 
-    operand_reg = '^(?P<delim>[ ]*,?[ ]*)('
-    operand_reg+= '(?P<str>".*?(?<!\\\\)")|'
-    operand_reg+= '(?P<float>-?[0-9\.]+)|'
-    operand_reg+= '(?P<bool>true|false)|'
-    operand_reg+= '(?P<op>[a-z]+\()'
-    operand_reg+= ')'
+    _read_plan = {}     # readable attribute names mapped to True if value requires decrypt
+    _read_plan_all = {} # same as _read_plan but includes attributes with read disabled
+    _bulk_exclude = {}  # projection excluding attributes with bulk_read disabled
+    _filter_paths = {}  # attribute paths mapped to type used to validate filter attributes
 
     def __init__(self, **kwargs):
         """ per-object initialization. Allows for any attribute to be provided
@@ -517,7 +522,7 @@ class Rest(object):
         return result
 
     @classmethod
-    def bulk_save(cls, rest_objects, skip_validation=True):
+    def bulk_save(cls, rest_objects, skip_validation=True, ordered=True):
         """ perform save on list of rest objects. Note, all rest_objects must be instance of the 
             same class as bulk_write occurrs on a single collection.
 
@@ -525,9 +530,13 @@ class Rest(object):
             this is disabled by default on bulk_save but can be enabled if source data is untrusted
             or if dataset is incomplete and requires validation to prepopulate with proper defaults.
 
+            ordered flag is forwarded to bulk_write.  When disabled, the server may apply writes in
+            any order and continues with remaining writes after an individual write error.
+
             Return bool success
         """
         cls.init()
+        invalidate_identity(cls)
         cls.logger.debug("%s bulk save request", cls._classname)
         collection = get_db()[cls._classname]
 
@@ -537,7 +546,7 @@ class Rest(object):
             if save_obj is not None: bulk.append(save_obj)
         try:
             if len(bulk)>0:
-                result = collection.bulk_write(bulk)
+                result = collection.bulk_write(bulk, ordered=ordered)
                 cls.logger.debug("bulk write results (objects:%s), inserts: %s, updates: %s", 
                         len(bulk), result.inserted_count, result.modified_count)
             return True
@@ -565,9 +574,20 @@ class Rest(object):
 
             kwargs are attributes for the object.  This can be keys for loading a single object 
             along with other non-key attributes that will override value if already in db.
+
+            If an identity map is active (see identity module) and kwargs contains only keys, then
+            the instance previously loaded within the same scope is returned.
         """
         results = []
         db_objs = []
+        imap = get_identity_map()
+        ikey = None
+        if imap is not None and not _bulk:
+            cls.init()
+            ikey = imap.get_key(cls, kwargs)
+            if ikey is not None:
+                obj = imap.get(cls, ikey)
+                if obj is not None: return obj
         try:
             kwargs["_read_all"] = True
             read_kwargs = {"_read_all":True}
@@ -602,7 +622,9 @@ class Rest(object):
             
         # load guarantee's uninitialized obj if not found and bulk is disabled
         if not _bulk:
-            if len(results)>0: return results[0]
+            if len(results)>0: 
+                if ikey is not None: imap.add(cls, ikey, results[0])
+                return results[0]
             return cls(**kwargs)
         else: return results
 
@@ -660,7 +682,7 @@ class Rest(object):
         def init_attribute(attr, sub=False):
             base = {}
             for d in cls.ATTRIBUTE_DEF:
-                if sub and d in ["key","read","write","encrypt", "hash"]: 
+                if sub and d in ["key","read","write","encrypt", "hash", "bulk_read"]: 
                     continue
                 if d in attr: base[d] = attr[d]
                 else: base[d] = copy.copy(cls.ATTRIBUTE_DEF[d])
@@ -720,6 +742,17 @@ class Rest(object):
                     cls._attributes[k] = copy.deepcopy(parent._attributes[k])
             cls._keys = parent._keys + cls._keys
 
+        # precompute read plan and bulk read projection so read does not need per-row meta lookups
+        cls._read_plan = {}
+        cls._read_plan_all = {}
+        cls._bulk_exclude = {}
+        for a in cls._attributes:
+            decrypt = cls._attributes[a]["type"] is str and cls._attributes[a]["encrypt"]
+            cls._read_plan_all[a] = decrypt
+            if cls._attributes[a]["read"]: cls._read_plan[a] = decrypt
+            if not cls._attributes[a]["bulk_read"]: cls._bulk_exclude[a] = 0
+        cls._filter_paths = get_filter_paths(cls._attributes)
+
         # revisit later if this needs to be disabled
         # (dn is disabled if class does not have any keys)
         #if len(cls._keys)==0: cls._access["dn"] = False
@@ -770,10 +803,30 @@ class Rest(object):
 
     @classmethod
     def api_read(cls, **kwargs):
-        """ api call - read rest object, aborts on error """
+        """ api call - read rest object, aborts on error.  If stream=1 param is set or the 
+            client accepts application/x-ndjson, then objects are streamed with one json object
+            per line instead of a single json response.  Count requests are never streamed.
+            If the stream fails after the response has started, a final {"error": ...} line is
+            sent so clients can detect the truncated response
+        """
         cls.rbac(role=cls._access["read_role"])
         _params = get_user_params()
         kwargs["_api"] = True
+        accept = get_user_headers().get("Accept", "")
+        if "count" not in _params and (_params.get("stream", "") in ["1", "true"] or \
+            "application/x-ndjson" in accept):
+            kwargs["_stream"] = True
+            ret = cls.read(_params=_params, **kwargs)
+            def generate():
+                try:
+                    for o in ret["objects"]:
+                        yield "%s\n" % json.dumps(o, separators=(",",":"))
+                except Exception as e:
+                    cls.logger.debug(traceback.format_exc())
+                    cls.logger.warn("%s stream read failed: %s", cls._classname, e)
+                    yield "%s\n" % json.dumps({"error": "stream read failed: %s" % e}, 
+                                                separators=(",",":"))
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
         return jsonify(cls.read(_params=_params, **kwargs))
 
     @classmethod
@@ -975,159 +1028,19 @@ class Rest(object):
                     ),
                     gt(count, 5)
                 )
-        """
 
-        def raise_error(fs, e=""):
-            if len(e)>0: e = ". %s" % e 
-            cls.logger.debug("invalid filter %s%s", fs,e)
-            abort(400, "invalid filter %s%s" % (fs, e))
-
-        def parse_operands(fs):
-            # receive operand string and return list of comma-separated operands
-            operands = []
-
-            # operands MUST be in one of the following structures
-            #   1) quoted string
-            #   2) float/integer value
-            #   3) true/false boolean
-            #   4) another (greedy) operator
-            #  example:
-            #   "string", -23.1153, false, eq(...)
-            # ".*?[^\\]?"       = match quoted string checking for escape quotes
-            # -?[0-9\.]+        = match float/integer
-            # (?i)(true|false)  = match boolean
-            # operand_reg pre-compiled within rest object
-
-            original_fs = fs
-            #cls.logger.debug("parse operands: [%s]", original_fs)
-            fs = fs.strip()
-            while len(fs) > 0:
-                #cls.logger.debug("parsing sub-operands: [%s]", fs)
-                r1 = re.search(Rest.operand_reg, fs, re.IGNORECASE)
-                if r1 is None: 
-                    # occurs with invalid operand only
-                    cls.logger.debug("sub-operand not matched")
-                    err = "invalid operand or unbalanced parenthesis"
-                    raise ValueError(err)
-                delim = r1.group("delim")
-                #cls.logger.debug("delim: [%s]", r1.group("delim"))
-                if r1.group("str") is not None: 
-                    #cls.logger.debug("str: [%s]", r1.group("str"))
-                    operands.append(r1.group("str"))
-                    delim+= r1.group("str")
-                elif r1.group("float") is not None:
-                    #cls.logger.debug("float: [%s]", r1.group("float"))
-                    operands.append(float(r1.group("float")))
-                    delim+= r1.group("float")
-                elif r1.group("bool") is not None:
-                    #cls.logger.debug("bool: [%s]", r1.group("bool"))
-                    if r1.group("bool").lower() == "true": operands.append(True)
-                    else: operands.append(False)
-                    delim+= r1.group("bool")
-                else:
-                    # match on operator need to walk each character to account
-                    # for embedded operators within it.
-                    #cls.logger.debug("op: [%s]", r1.group("op"))
-                    op = delim+r1.group("op")
-                    depth = 0
-                    for i, c in enumerate(fs[len(op):]):
-                        #cls.logger.debug("checking: [%s:%s]", i,c)
-                        if c==")":
-                            if i>0 and fs[i-1]=="\\": continue
-                            elif depth>0: depth-=1
-                            else:  
-                                operands.append("%s%s"%(r1.group("op"),
-                                    fs[len(op):len(op)+i+1]))
-                                delim+= operands[-1]
-                                #cls.logger.debug("op set:[%s]", operands[-1])
-                                break
-                        elif c=="(":
-                            if i>0 and fs[i-1]=="\\": continue
-                            depth+= 1
-                    if depth!=0:
-                        raise ValueError("unbalanced parathensis")
-                
-                # remove the delimiter and ensure that if there are any more 
-                # characters, they start with a comma ','
-                fs = re.sub("^%s" % re.escape(delim), "", fs)
-                if len(fs)>0 and not re.search("^[ ]*,", fs):
-                    cls.logger.debug("operands not separated by comma: %s", fs)
-                    err = "invalid operand or unbalanced parenthesis"
-                    raise ValueError(err)
-            return operands
+            parsed filters are cached per class and filter string, refer to
+            rest.filters
+        """
 
-            
-        def parse_operator(fs):
-            # receives a filter string (fs) and returns mongo filter json
-            if len(fs) == 0: return {}
-            #cls.logger.debug("parse operator: [%s]", fs)
-            r1 = re.search(Rest.operator_reg, fs, re.IGNORECASE)
-            if r1 is None: raise_error(fs)
-            operator = r1.group("op").lower()
-            try: operands = parse_operands(r1.group("data"))
-            except ValueError as e: raise_error(fs, "%s" % e)
-            if len(operands) == 0: raise_error(fs)
-
-            #cls.logger.debug("operator: %s, operands: %s", operator,operands)
-            if operator=="and" or operator=="or":
-                op_str = "$%s" % operator
-                if len(operands)<2:
-                    err = "two or more operands required for '%s'" % operator
-                    raise_error(fs, err)
-                ret = {op_str: []}
-                for o in operands:
-                    ret[op_str].append(parse_operator(o))
-                return ret
-            else:
-                # validate supported operator
-                if operator not in ["gt","lt","ge","le","eq","neq","regex"]:
-                    raise_error(fs, "unknown operator %s" % operator)
-                # all other operators must have two operands where first operand
-                # is a string representing the attribute name and the second is
-                # the value (which can be string, float, or bool)
-                if len(operands)!=2: 
-                    raise_error(fs, "received %s operands" % (len(operands)))
-                # for each operand, remove quotes if string
-                for i,o in enumerate(operands):
-                    if isinstance(o, str) or isinstance(o, unicode):
-                        o = re.sub("(^\")|(\"$)","", o)
-                    operands[i] = o
-                # check that operand[0] which represents an attribute exists
-                # if not, check if it represents a sub object in list/dict
-                if operands[0] not in cls._attributes:
-                    meta = cls._attributes
-                    metatype = dict
-                    for attr in operands[0].split("."):
-                        if attr in meta:
-                            metatype = meta[attr].get("type", str)
-                            meta = meta[attr].get("meta", {})
-                            if not isinstance(meta,dict): meta = {}
-                        elif metatype is list and re.search("^[0-9]+$",attr):
-                            metatype = None # only allow list match once
-                        else:
-                            raise_error(fs,"unknown attribute %s"%operands[0])
-                # build filter based on operator
-                if operator == "eq": return { operands[0]: operands[1]}
-                elif operator == "regex":
-                    # validate regex is valid 
-                    try: re.compile(operands[1])
-                    except re.error as e: raise_error(fs, "%s" % e)
-                op_str = {
-                    "eq": "$eq",
-                    "gt": "$gt",
-                    "ge": "$gte",
-                    "lt": "$lt",
-                    "le": "$lte",
-                    "neq": "$ne",
-                    "regex": "$regex",
-                }.get(operator, "eq")
-                return {operands[0]: { op_str: operands[1]}}
-            
         if params is None: params = get_user_params()
         user_filter = params.get("filter","").strip()
         if len(user_filter)>0:
             cls.logger.debug("parse user filter: %s", user_filter)
-            r = parse_operator(user_filter)
+            try: r = compile_filter(cls, user_filter)
+            except FilterError as e:
+                cls.logger.debug("invalid filter %s. %s", user_filter, e)
+                abort(400, "invalid filter %s. %s" % (user_filter, e))
             if len(r)>0: cls.logger.debug("parsed filter: %s", r)
             for k in r: f[k] = r[k]
         return f
@@ -1176,6 +1089,7 @@ class Rest(object):
                 _id:        string objectId of inserted object
         """
         cls.init()
+        invalidate_identity(cls)
         classname = cls._classname
         cls.logger.debug("%s create request", classname)
         collection = get_db()[classname]
@@ -1332,10 +1246,19 @@ class Rest(object):
                 _api   - call came from api request
                 _write_all (ignored)
                 _read_all - return all attributes even those that have read=False in meta 
+                _stream - return objects as a generator that reads from the db cursor as it is
+                          consumed instead of a list. The after_read callback is applied to
+                          batches of STREAM_BATCH_SIZE objects and count is set to None. Ignored
+                          for count, rsp-include, and single object reads
             
+            Bulk api reads without 'include' exclude attributes with bulk_read disabled.
+
             Return dict of with following attributes:
                 count:      total number of objects matching query
                 objects:    list of requested objects
+
+            The count requires a second query which is only performed when it cannot be
+            determined from the returned objects (i.e., a full page was returned)
         """
         cls.init()
         classname = cls._classname
@@ -1425,7 +1348,10 @@ class Rest(object):
         projections = {}
         for i in _params.get("include","").split(","):
             if len(i)>0 and i not in projections: projections[i] = 1
-        if len(projections)==0: projections = None
+        if len(projections)==0:
+            projections = None
+            if kwargs.get("_api", False) and not read_one and len(cls._bulk_exclude)>0:
+                projections = cls._bulk_exclude
         elif cls._access["dn"] and "dn" not in cls._attributes:
             # ensure all keys are set for 'dn' case when 'include' limits return results
             # AND 'dn' is not already a user defined attribute for the object
@@ -1463,27 +1389,81 @@ class Rest(object):
 
         # prepare return object
         ret = {
-            "count": cls.__mongo(cursor.count),
+            "count": 0,
             "objects": []
         }
+
+        # build returned object from db result
+        plan = cls._read_plan_all if _read_all else cls._read_plan
+        expose_id = cls._access["expose_id"]
+        dn = cls._access["dn"]
+        def build(r):
+            obj = {}
+            for v in r:
+                if v in plan:
+                    if plan[v]: obj[v] = aes_decrypt(r[v])
+                    else: obj[v] = r[v]
+            if expose_id and "_id" in r:
+                obj["_id"] = "%s" % r["_id"]
+            # add dn to object if configured and not already an attribute of the object
+            if dn and "dn" not in obj:
+                _vars = [obj.get(attr,"") for attr in cls._dn_attributes]
+                obj["dn"] = cls._dn_path.format(*_vars)
+            return obj
+
+        # after read callback
+        def after_read(data):
+            if not callable(cls._access["after_read"]): return data
+            try:
+                callback_kwargs["data"] = data
+                new_ret = cls._access["after_read"](**callback_kwargs)
+                assert new_ret is not None
+                return new_ret
+            except (BadRequest,NotFound,Forbidden,InternalServerError) as e:
+                cls.logger.debug("%s after read abort: %s", classname, e)
+                raise e
+            except AssertionError as e:
+                cls.logger.warn("%s after read callback failed: return None", classname)
+            except Exception as e:
+                cls.logger.debug(traceback.format_exc())
+                cls.logger.warn("%s after read callback failed: %s", classname, e)
+            return data
+
+        # stream objects from cursor, after read callback is applied per batch
+        if kwargs.get("_stream", False) and not read_one and "count" not in _params and \
+            rsp_include == "self":
+            def stream():
+                batch = []
+                for r in cursor:
+                    batch.append(build(r))
+                    if len(batch) >= cls.STREAM_BATCH_SIZE:
+                        for o in after_read({"count":len(batch), "objects":batch})["objects"]:
+                            yield o
+                        batch = []
+                if len(batch) > 0:
+                    for o in after_read({"count":len(batch), "objects":batch})["objects"]:
+                        yield o
+            ret["count"] = None
+            ret["objects"] = stream()
+            return ret
         
         # only if user did not explicitly request count, iterate through results
-        if "count" not in _params:
+        if "count" in _params:
+            ret["count"] = cls.__mongo(cursor.count)
+        else:
             for r in cursor:
-                obj = {}
-                for v in r:
-                    if v in cls._attributes and (_read_all or cls._attributes[v]["read"]):
-                        obj[v] = r[v]
-                        if cls._attributes[v]["type"] is str and cls._attributes[v]["encrypt"]:
-                            obj[v] = aes_decrypt(obj[v])
-                if cls._access["expose_id"] and "_id" in r:
-                    obj["_id"] = "%s"%ObjectId(r["_id"])
-                # add dn to object if configured and not already an attribute of the object
-                if cls._access["dn"] and "dn" not in obj:
-                    _vars = [obj.get(attr,"") for attr in cls._dn_attributes]
-                    obj["dn"] = cls._dn_path.format(*_vars)
                 #ret["objects"].append({cls._classname: obj})
-                ret["objects"].append(obj)
+                ret["objects"].append(build(r))
+
+            # count is known without additional query if all results are returned, a partial page
+            # is returned, or this is a read of a single object by unique key
+            count = len(ret["objects"])
+            if _disable_page or (read_one and (len(cls._keys)>0 or expose_id)):
+                ret["count"] = count
+            elif count < pagesize and (page == 0 or count > 0):
+                ret["count"] = page*pagesize + count
+            else:
+                ret["count"] = cls.__mongo(cursor.count)
 
             # for rsp_include children/subtree need to perform recursive call on child objects
             if rsp_include != "self":
@@ -1521,24 +1501,8 @@ class Rest(object):
                 ", ".join(okeys))
             abort(404, err)
 
-        # after read callback
-        if callable(cls._access["after_read"]):
-            try:
-                callback_kwargs["data"] = ret
-                new_ret = cls._access["after_read"](**callback_kwargs)
-                assert new_ret is not None
-                ret = new_ret
-            except (BadRequest,NotFound,Forbidden,InternalServerError) as e:
-                cls.logger.debug("%s after read abort: %s", classname, e)
-                raise e
-            except AssertionError as e:
-                cls.logger.warn("%s after read callback failed: return None", classname)
-            except Exception as e:
-                cls.logger.debug(traceback.format_exc())
-                cls.logger.warn("%s after read callback failed: %s", classname, e)
-
         # return read request
-        return ret
+        return after_read(ret)
 
     @classmethod
     def update(cls, _data={}, _params={}, _filters=None, _bulk_prep=False, _skip_validation=False,
@@ -1600,6 +1564,7 @@ class Rest(object):
                 count:      total number of objects updated
         """
         cls.init()
+        invalidate_identity(cls)
         classname = cls._classname
         cls.logger.debug("%s update request kwargs: %s", classname,kwargs)
         collection = get_db()[classname]
@@ -1751,6 +1716,7 @@ class Rest(object):
                 count:      total number of objects deleted
         """
         cls.init()
+        invalidate_identity(cls)
         classname = cls._classname
         cls.logger.debug("%s delete request filters:%s, kwargs: %s",classname,_filters,kwargs)
         collection = get_db()[classname]
@@ -1862,6 +1828,24 @@ class Rest(object):
         # return object successfully database operation
         return ret_obj
 
+    @classmethod
+    def aggregate(cls, pipeline):
+        """ execute aggregation pipeline against the collection for this class. This is intended
+            for internal summaries (counts, totals, etc...) computed by the database without 
+            reading full objects.  Note, attributes are not validated or decrypted and no 
+            callbacks are executed.
+
+            Return list of result documents or None on error
+        """
+        cls.init()
+        cls.logger.debug("%s aggregate request: %s", cls._classname, pipeline)
+        collection = get_db()[cls._classname]
+        try:
+            return list(cls.__mongo(collection.aggregate, pipeline, allowDiskUse=True))
+        except PyMongoError as e:
+            cls.logger.warn("%s aggregate failed: %s", cls._classname, e)
+        return None
+
     @classmethod
     def __mongo(cls, func, *args, **kwargs):
         """ perform mongo operation with retry """
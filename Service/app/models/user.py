@@ -7,15 +7,85 @@ from .utils import get_user_data, get_user_params, get_user_headers, get_user_co
 from .settings import Settings
 
 import base64
+import datetime
 import json
 import logging
 import os
+import threading
 import time
 import uuid
 
 # module level logger
 logger = logging.getLogger(__name__)
 
+def validate_date(classname, attribute_name, attribute_meta, value):
+    # validator for datetime attributes which are not supported by default validator
+    if value is None or isinstance(value, datetime.datetime): return value
+    abort(400, "%s.%s invalid value '%s'. Expected a date" % (classname, attribute_name, value))
+
+class SessionCache(object):
+    """ in-process cache of validated sessions indexed by session id. Each entry is valid for at
+        most the configured ttl and never beyond the session timeout. Since the cache is local to
+        the process, a session removed by another process remains valid here for at most ttl.
+    """
+    def __init__(self, max_size=10000):
+        self.sessions = {}
+        self.max_size = max_size
+        # incremented on each invalidate so a lookup that started before an invalidate does not
+        # add a stale session back to the cache
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """ return cached session or None """
+        entry = self.sessions.get(session_id, None)
+        if entry is None: return None
+        if time.time() > entry[0]:
+            self.sessions.pop(session_id, None)
+            return None
+        return entry[1]
+
+    def add(self, s, generation, ttl):
+        """ add validated session if no invalidate occurred since provided generation """
+        if ttl <= 0: return
+        expires = min(time.time() + ttl, s.timeout)
+        with self.lock:
+            if generation != self.generation: return
+            if len(self.sessions) >= self.max_size:
+                now = time.time()
+                for sid in [sid for sid in self.sessions if now > self.sessions[sid][0]]:
+                    self.sessions.pop(sid, None)
+                if len(self.sessions) >= self.max_size: self.sessions = {}
+            self.sessions[s.session] = (expires, s)
+
+    def invalidate(self, session=None, username=None):
+        """ remove cached session by session id, all sessions for username, or all sessions if
+            neither is provided
+        """
+        with self.lock:
+            self.generation+= 1
+            if session is not None:
+                self.sessions.pop(session, None)
+            elif username is not None:
+                for sid in [sid for sid in self.sessions if
+                            self.sessions[sid][1].username == username]:
+                    self.sessions.pop(sid, None)
+            else:
+                self.sessions = {}
+
+    def invalidate_filters(self, filters, attr):
+        """ invalidate sessions matching provided filters on attr (session or username). If the
+            filter value is not a single string then all sessions are invalidated
+        """
+        value = filters.get(attr, None) if isinstance(filters, dict) else None
+        if isinstance(value, basestring):
+            self.invalidate(**{attr: value})
+        else:
+            self.invalidate()
+
+# validated sessions for this process
+session_cache = SessionCache()
+
 @api_register(path="/users")
 class User(Rest):
 
@@ -93,6 +163,7 @@ class User(Rest):
         """ logout current user """
         session_id = g.user.session
         if session_id is not None:
+            session_cache.invalidate(session=session_id)
             s = Session.load(session=session_id)
             if s.exists():
                 #logger.debug("deleting session: %s", session_id)
@@ -240,6 +311,18 @@ class User(Rest):
             if username is not None: filters["username"]["$nin"].append(username)
         return filters
 
+    @classmethod
+    @api_callback("after_update")
+    def after_user_update(cls, filters, data):
+        # cached sessions must be revalidated after a role change
+        if "role" in data: session_cache.invalidate_filters(filters, "username")
+
+    @classmethod
+    @api_callback("after_delete")
+    def after_user_delete(cls, filters):
+        # sessions for deleted users are no longer valid
+        session_cache.invalidate_filters(filters, "username")
+
     @classmethod
     @api_callback("after_read")
     def after_user_read(cls, data, api=False):
@@ -296,6 +379,13 @@ class Session(Rest):
             "type": str,
             "description": "csfr token"
         },
+        "expire_at": {
+            "type": datetime.datetime,
+            "validator": validate_date,
+            "read": False,
+            "write": False,
+            "description": "utc date of session timeout used by ttl index to purge expired sessions",
+        },
     }
 
     # required for flask-login
@@ -309,12 +399,25 @@ class Session(Rest):
     def load_session(session_id):
         # load user object for corresponding session id.  If session id is invalid, has expired,
         # or token is not present within the request and token_required enabled, then return None
+        # validated sessions are cached for SESSION_CACHE_TTL seconds, the token check is still
+        # performed on each request
         now = time.time()
-        s = Session.load(session=session_id)
-        if not s.exists(): return None
-        if now > s.timeout:
-            logger.debug("session %s timeout (%s > %s)", s.session, now, s.timeout)
-            return None
+        s = session_cache.get(session_id)
+        if s is None:
+            generation = session_cache.generation
+            s = Session.load(session=session_id)
+            if not s.exists(): return None
+            if now > s.timeout:
+                logger.debug("session %s timeout (%s > %s)", s.session, now, s.timeout)
+                return None
+            # load user corresponding to valid session
+            u = User.load(username=s.username)
+            if not u.exists(): 
+                logger.debug("username %s for session %s no longer exists", s.username, 
+                        s.session)
+                return None
+            session_cache.add(s, generation, current_app.config.get("SESSION_CACHE_TTL", 0))
+
         # perform CSFR check if token_required 
         if s.token_required:
             # token can be set in headers, data, or params and must be called 'app_token'
@@ -329,12 +432,6 @@ class Session(Rest):
             if token != s.token:
                 logger.debug("invalid token %s provided for session %s", token, s.session)
                 return None
-
-        # load user corresponding to valid session
-        u = User.load(username=s.username)
-        if not u.exists(): 
-            logger.debug("username %s for session %s no longer exists", s.username, s.session)
-            return None
         return s
 
     @classmethod
@@ -346,6 +443,7 @@ class Session(Rest):
         s = Settings.load()
         data["created"] = now
         data["timeout"] = s.session_timeout + now
+        data["expire_at"] = datetime.datetime.utcfromtimestamp(data["timeout"])
         if data["token_required"]:
             data["token"] = base64.b64encode("%s" % uuid.uuid4())
         return data
@@ -353,10 +451,6 @@ class Session(Rest):
     @classmethod
     @api_callback("after_create")
     def after_session_create(cls, data):
-        # after each successful session creation, purge expired sessions
-        ret = Session.delete(_filters={"session":{"$lte":time.time()}})    
-        if "count" in ret and ret["count"]>0:
-            logger.debug("old sessions purged: %s", ret["count"])
         s = Session.load(username=data["username"], session=data["session"])
         if not s.exists():
             logger.debug("failed to save that session thing...")
@@ -364,3 +458,7 @@ class Session(Rest):
             logger.debug("created session: (%s, %s, token:%s, timeout: %s)", s.username, s.session,
                     s.token, s.timeout)
 
+    @classmethod
+    @api_callback("after_delete")
+    def after_session_delete(cls, filters):
+        session_cache.invalidate_filters(filters, "session")
@@ -0,0 +1,28 @@
+"""
+    microbenchmarks for compare and snapshot hot paths.  Each module can be
+    executed directly from the Service directory, for example:
+        python -m benchmarks.remap
+"""
+
+import time
+
+def bench(func, args=(), repeat=5, number=1):
+    """ execute func(*args) number times per run and return best run time in
+        seconds over repeat runs
+    """
+    best = None
+    for r in range(repeat):
+        ts = time.time()
+        for n in range(number): func(*args)
+        t = time.time() - ts
+        if best is None or t < best: best = t
+    return best
+
+def report(name, baseline, result, count=None):
+    """ print single benchmark result relative to baseline """
+    rate = ""
+    if count is not None and result > 0:
+        rate = " (%.0f ops/sec)" % (count/result)
+    speedup = baseline/result if result > 0 else float("inf")
+    print "%-40s baseline %.4fs, current %.4fs, speedup %.2fx%s" % (name,
+        baseline, result, speedup, rate)
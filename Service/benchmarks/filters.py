@@ -0,0 +1,145 @@
+"""
+    compare the Rest.filter parser against the original regex implementation
+    on deep and/or filters similar to those sent by the UI and API clients.
+    Results are reported for the parser alone and for the cached filter
+"""
+
+from . import bench, report
+from app.models.rest.filters import (FilterParser, compile_filter, filter_cache,
+                                    get_filter_paths)
+
+import re
+
+operator_reg= "^[ ]*(?P<op>[a-z]+)[ ]*\((?P<data>.+)\)[ ]*$"
+operand_reg = '^(?P<delim>[ ]*,?[ ]*)('
+operand_reg+= '(?P<str>".*?(?<!\\\\)")|'
+operand_reg+= '(?P<float>-?[0-9\.]+)|'
+operand_reg+= '(?P<bool>true|false)|'
+operand_reg+= '(?P<op>[a-z]+\()'
+operand_reg+= ')'
+
+# attributes similar to compare results objects
+ATTRIBUTES = {
+    "compare_id": {"type": str},
+    "classname": {"type": str},
+    "node_id": {"type": int},
+    "total": {"type": dict, "meta": {
+        "created": {"type": int},
+        "modified": {"type": int},
+        "deleted": {"type": int},
+        "equal": {"type": int},
+    }},
+    "modified": {"type": list, "subtype": dict, "meta": {
+        "dn": {"type": str},
+        "attribute": {"type": str},
+        "node_value": {"type": dict, "meta": {
+            "value": {"type": str},
+        }},
+    }},
+}
+
+class Target(object):
+    """ minimal Rest class attributes required by the parsers """
+    _attributes = ATTRIBUTES
+    _filter_paths = get_filter_paths(ATTRIBUTES)
+
+def legacy_parse_operands(fs):
+    """ original Rest.filter operand parsing (baseline) """
+    operands = []
+    fs = fs.strip()
+    while len(fs) > 0:
+        r1 = re.search(operand_reg, fs, re.IGNORECASE)
+        if r1 is None: raise ValueError("invalid operand or unbalanced parenthesis")
+        delim = r1.group("delim")
+        if r1.group("str") is not None:
+            operands.append(r1.group("str"))
+            delim+= r1.group("str")
+        elif r1.group("float") is not None:
+            operands.append(float(r1.group("float")))
+            delim+= r1.group("float")
+        elif r1.group("bool") is not None:
+            operands.append(r1.group("bool").lower() == "true")
+            delim+= r1.group("bool")
+        else:
+            op = delim+r1.group("op")
+            depth = 0
+            for i, c in enumerate(fs[len(op):]):
+                if c==")":
+                    if i>0 and fs[i-1]=="\\": continue
+                    elif depth>0: depth-=1
+                    else:
+                        operands.append("%s%s"%(r1.group("op"), fs[len(op):len(op)+i+1]))
+                        delim+= operands[-1]
+                        break
+                elif c=="(":
+                    if i>0 and fs[i-1]=="\\": continue
+                    depth+= 1
+            if depth!=0: raise ValueError("unbalanced parathensis")
+        fs = re.sub("^%s" % re.escape(delim), "", fs)
+        if len(fs)>0 and not re.search("^[ ]*,", fs):
+            raise ValueError("invalid operand or unbalanced parenthesis")
+    return operands
+
+def legacy_parse_operator(cls, fs):
+    """ original Rest.filter operator parsing (baseline) """
+    if len(fs) == 0: return {}
+    r1 = re.search(operator_reg, fs, re.IGNORECASE)
+    if r1 is None: raise ValueError(fs)
+    operator = r1.group("op").lower()
+    operands = legacy_parse_operands(r1.group("data"))
+    if len(operands) == 0: raise ValueError(fs)
+    if operator=="and" or operator=="or":
+        if len(operands)<2: raise ValueError(fs)
+        return {"$%s" % operator: [legacy_parse_operator(cls, o) for o in operands]}
+    if operator not in ["gt","lt","ge","le","eq","neq","regex"]: raise ValueError(fs)
+    if len(operands)!=2: raise ValueError(fs)
+    for i,o in enumerate(operands):
+        if isinstance(o, basestring): o = re.sub("(^\")|(\"$)","", o)
+        operands[i] = o
+    if operands[0] not in cls._attributes:
+        meta = cls._attributes
+        metatype = dict
+        for attr in operands[0].split("."):
+            if attr in meta:
+                metatype = meta[attr].get("type", str)
+                meta = meta[attr].get("meta", {})
+                if not isinstance(meta,dict): meta = {}
+            elif metatype is list and re.search("^[0-9]+$",attr):
+                metatype = None
+            else:
+                raise ValueError("unknown attribute %s" % operands[0])
+    if operator == "eq": return {operands[0]: operands[1]}
+    elif operator == "regex": re.compile(operands[1])
+    op_str = {"gt": "$gt", "ge": "$gte", "lt": "$lt", "le": "$lte", "neq": "$ne",
+                "regex": "$regex"}[operator]
+    return {operands[0]: {op_str: operands[1]}}
+
+def build_filter(depth=4, width=3):
+    """ return nested and/or filter string with provided depth and operands per level """
+    def build(level):
+        if level == 0:
+            return "or(eq(\"modified.dn\", \"uni/tn-t%s/ap-app/epg-e%s\"), " \
+                    "regex(\"modified.3.node_value.value\", \"^(?i)vlan-[0-9]+$\"), " \
+                    "ge(\"total.modified\", %s))" % (level, level, level)
+        op = "and" if level % 2 == 0 else "or"
+        operands = [build(level-1) for i in range(width-1)]
+        operands.append("neq(\"classname\", \"fvAEPg%s\")" % level)
+        return "%s(%s)" % (op, ", ".join(operands))
+    return build(depth)
+
+def run():
+    for depth in [1, 3, 5]:
+        fs = build_filter(depth=depth)
+        assert legacy_parse_operator(Target, fs) == FilterParser(fs, Target._filter_paths).parse()
+        name = "filter depth %s (%s chars)" % (depth, len(fs))
+        number = 200 if depth < 5 else 10
+        baseline = bench(legacy_parse_operator, (Target, fs), number=number)
+        report(name, baseline,
+            bench(lambda: FilterParser(fs, Target._filter_paths).parse(), number=number),
+            count=number)
+        filter_cache.clear()
+        report("%s cached" % name, baseline, bench(compile_filter, (Target, fs), number=number),
+            count=number)
+
+if __name__ == "__main__":
+    run()
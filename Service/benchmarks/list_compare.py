@@ -0,0 +1,54 @@
+"""
+    compare list and list-expand attribute comparison against the original
+    expand and nested membership implementation
+"""
+
+from . import bench, report
+from .remap import build_remap
+from app.models.aci.compare import list_compare
+from app.models.aci.remap import expand_range
+
+def legacy_list_compare(value1, value2, remapper1, remapper2, expand=False):
+    """ original per_node_class_compare list comparison (baseline) """
+    if expand:
+        v1 = expand_range(value1)
+        v2 = expand_range(value2)
+    else:
+        v1 = list(set(value1.split(",")))
+        v2 = list(set(value2.split(",")))
+    if "" in v1: v1.remove("")
+    if "" in v2: v2.remove("")
+    (v1_remap, v2_remap) = ([], [])
+    for v in v1: v1_remap.append(remapper1(v))
+    for v in v2: v2_remap.append(remapper2(v))
+    match = True
+    for v in v1_remap:
+        if v not in v2_remap:
+            match = False
+            break
+    if match:
+        for v in v2_remap:
+            if v not in v1_remap:
+                match = False
+                break
+    return (match, ",".join(v1_remap), ",".join(v2_remap))
+
+def run():
+    remap = build_remap()
+    remapper = remap.get_remapper(["vlan"])
+    cases = [
+        ("vlan pool", "1-4000", "1-2000,2001-4000", True),
+        ("vlan pool mismatch", "1-4000", "1-3999", True),
+        ("encap list", "100-200,300,305,310-400", "310-400,100-200,300,305",
+            True),
+        ("plain list", ",".join(["vlan%s" % i for i in range(1, 300)]),
+            ",".join(["vlan%s" % i for i in range(299, 0, -1)]), False),
+    ]
+    for (name, value1, value2, expand) in cases:
+        args = (value1, value2, remapper, remapper, expand)
+        assert legacy_list_compare(*args)[0] == list_compare(*args)[0]
+        report(name, bench(legacy_list_compare, args, number=20),
+            bench(list_compare, args, number=20))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,106 @@
+"""
+    compare Remap.remap_attribute against the original per-call regex
+    implementation on realistic attribute values from a leaf snapshot
+"""
+
+from . import bench, report
+from app.models.aci.remap import Remap
+
+import random
+import re
+
+def legacy_remap_attribute(remap, value, mo_remaps=[]):
+    """ original remap_attribute implementation (baseline) """
+    if len(mo_remaps)==0: return value
+    allset = "all" in mo_remaps
+    for r in Remap.REMAP_ORDERED:
+        if allset or r in mo_remaps:
+            t = remap.remaps[r]
+            r1 = t[0].search(value)
+            if r1 is not None:
+                match = re.sub("[\[\]\,]","",r1.group("v"))
+                if match in t[1]:
+                    value = t[0].sub(t[1][match], value)
+    return value
+
+def build_remap(node_id=101, scale=500):
+    """ return remap object with tables populated similar to leaf at scale """
+    remap = Remap(node_id)
+    for i in range(1, scale+1):
+        remap.vlans["vlan%s" % i] = "vxlan-%s" % (16777000 + i)
+        remap.encrtds["eth1/%s.%s" % (i%48+1, i)] = "eth1/%s.vlan-%s" % (
+            i%48+1, 1000+i)
+    for i in range(1, 64):
+        remap.aggs["po%s" % i] = "pc_policy_%s" % i
+        remap.loopbacks["lo%s" % i] = "vxlan-%s:unspecified" % (2490000+i)
+        remap.tunnels["tunnel%s" % i] = "overlay-1:10.0.0.%s:10.0.1.%s" % (i,i)
+    remap.remaps = {
+        "vlan": [ Remap.REMAP_REGEX["vlan"], remap.vlans ],
+        "encrtd": [ Remap.REMAP_REGEX["encrtd"], remap.encrtds],
+        "agg": [ Remap.REMAP_REGEX["agg"], remap.aggs ],
+        "loopback": [ Remap.REMAP_REGEX["loopback"], remap.loopbacks ],
+        "tunnel": [ Remap.REMAP_REGEX["tunnel"], remap.tunnels ],
+    }
+    remap.disabled = False
+    return remap
+
+def build_values(count=50000, seed=1):
+    """ return list of realistic attribute values.  Majority of attribute
+        values (admin/oper state, addresses, timestamps, counters) cannot be
+        remapped while keys and a subset of values contain remap tokens
+    """
+    rand = random.Random(seed)
+    templates = [
+        lambda: "up",
+        lambda: "down",
+        lambda: "enabled",
+        lambda: "unspecified",
+        lambda: "regular",
+        lambda: "",
+        lambda: "%s" % rand.randint(0, 100000),
+        lambda: "10.%s.%s.1/24" % (rand.randint(0,255), rand.randint(0,255)),
+        lambda: "2019-01-%02dT10:00:00.000+00:00" % rand.randint(1,28),
+        lambda: "00:50:56:%02X:%02X:01" % (rand.randint(0,255),rand.randint(0,255)),
+        lambda: "vlan-%s" % rand.randint(1, 4000),
+        lambda: "vlan%s" % rand.randint(1, 500),
+        lambda: "sys/ctx-[vxlan-2490369]/bd-[vxlan-16777209]/vlan-[vlan-%s]" % (
+            rand.randint(1, 4000)),
+        lambda: "topology/pod-1/node-101/sys/phys-[eth1/%s]" % rand.randint(1,48),
+        lambda: "sys/ipv4/inst/dom-overlay-1/if-[lo%s]" % rand.randint(0, 63),
+        lambda: "sys/tunnel-[tunnel%s]" % rand.randint(1, 63),
+        lambda: "po%s" % rand.randint(1, 63),
+        lambda: "eth1/%s.%s" % (rand.randint(1,48), rand.randint(1, 500)),
+        lambda: "sys/ctx-[vxlan-2490369]/db-ep/mac-00:50:56:01:02:03",
+    ]
+    # weight non-remappable values heavier to match typical snapshot mix
+    weights = [6,3,4,4,2,3,4,3,3,2,1,1,1,2,1,1,1,1,2]
+    choices = []
+    for i, w in enumerate(weights): choices+= [templates[i]]*w
+    return [rand.choice(choices)() for i in range(count)]
+
+def run():
+    remap = build_remap()
+    values = build_values()
+    for selectors in (["vlan"], ["agg", "encrtd"], ["all"]):
+        # verify identical results before timing
+        remapper = remap.get_remapper(selectors)
+        for v in values:
+            assert legacy_remap_attribute(remap, v, selectors) == remapper(v)
+
+        def baseline():
+            for v in values: legacy_remap_attribute(remap, v, selectors)
+        def cold():
+            # recompile remapper per run so memoization starts empty
+            remap._remappers = {}
+            f = remap.get_remapper(selectors)
+            for v in values: f(v)
+        def warm():
+            for v in values: remapper(v)
+        b = bench(baseline)
+        report("remap %s (cold)" % ",".join(selectors), b, bench(cold),
+            len(values))
+        report("remap %s (memoized)" % ",".join(selectors), b, bench(warm),
+            len(values))
+
+if __name__ == "__main__":
+    run()
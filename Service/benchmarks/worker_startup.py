@@ -0,0 +1,37 @@
+"""
+    compare worker startup time with the full flask app (create_app) against
+    the worker bootstrap that only registers the aci models.  Each run is
+    executed in a new interpreter so imports are not cached between runs
+"""
+
+from . import bench, report
+
+import os
+import subprocess
+import sys
+
+# full app with all models, api routes, blueprints, and swagger definitions
+FULL_APP = """
+from app.models.utils import get_app
+get_app()
+"""
+
+# worker bootstrap with config and aci models only
+WORKER = """
+from app import register_worker_models
+from app.models.utils import get_app_config
+get_app_config()
+register_worker_models()
+"""
+
+def start(code):
+    """ execute code in new python interpreter from the Service directory """
+    cwd = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    subprocess.check_call([sys.executable, "-c", code], cwd=cwd)
+
+def run():
+    report("worker startup", bench(start, (FULL_APP,), repeat=10),
+        bench(start, (WORKER,), repeat=10))
+
+if __name__ == "__main__":
+    run()
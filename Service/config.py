@@ -120,3 +120,66 @@ TMP_DIR = os.environ.get("TMP_DIR", "/tmp/")
 DATA_DIR = os.environ.get("DATA_DIR", "/home/app/data/snapshots")
 MAX_POOL_SIZE = int(os.environ.get("MAX_POOL_SIZE", cpu_count()))
 
+# maximum number of concurrent page requests for a single APIC query. This
+# applies whether or not APIC_STREAM_PARSE is enabled
+APIC_PAGE_CONCURRENCY = int(os.environ.get("APIC_PAGE_CONCURRENCY", 4))
+
+# parse APIC replies incrementally as they are received during snapshot 
+# collection. When disabled, full pages are fetched concurrently and then parsed.
+# When enabled, the current page is parsed as it is received while up to
+# APIC_PAGE_CONCURRENCY following pages are prefetched and held in memory
+APIC_STREAM_PARSE = bool(int(os.environ.get("APIC_STREAM_PARSE", 1)))
+
+# snapshot bundle compression codec (gzip, zstd, or lz4 if installed) and level
+# where level 0 uses the codec default
+SNAPSHOT_CODEC = os.environ.get("SNAPSHOT_CODEC", "gzip")
+SNAPSHOT_CODEC_LEVEL = int(os.environ.get("SNAPSHOT_CODEC_LEVEL", 0))
+
+# shared cache of extracted snapshots used by compare operations. Entries are
+# evicted in lru order once max size (in bytes) is exceeded. Set max size to 0
+# to disable the cache
+EXTRACT_CACHE_DIR = os.environ.get("EXTRACT_CACHE_DIR", "/home/app/data/cache")
+EXTRACT_CACHE_MAX_SIZE = int(os.environ.get("EXTRACT_CACHE_MAX_SIZE", 
+                                                        20*1024*1024*1024))
+
+# compare results are buffered per worker process and written in bulk once the
+# number of buffered results, the number of objects within buffered results, 
+# or the age (in seconds) of the oldest buffered result exceeds these limits
+COMPARE_RESULT_BATCH_SIZE = int(os.environ.get("COMPARE_RESULT_BATCH_SIZE", 500))
+COMPARE_RESULT_BATCH_OBJECTS = int(os.environ.get("COMPARE_RESULT_BATCH_OBJECTS",
+                                                        100000))
+COMPARE_RESULT_BATCH_TIME = float(os.environ.get("COMPARE_RESULT_BATCH_TIME", 10))
+
+# maximum number of created, deleted, modified, or equal entries stored within
+# a single compare result chunk
+COMPARE_RESULT_CHUNK_SIZE = int(os.environ.get("COMPARE_RESULT_CHUNK_SIZE", 1000))
+
+# interval in seconds to check for user abort of a running compare
+COMPARE_ABORT_POLL_INTERVAL = float(os.environ.get("COMPARE_ABORT_POLL_INTERVAL", 1.0))
+
+# snapshot and compare jobs are queued and executed by the job runner (worker
+# --runner) with a limit on total running jobs and running jobs per fabric. If
+# disabled, each job is executed in a new background worker process
+JOB_RUNNER = bool(int(os.environ.get("JOB_RUNNER", 1)))
+JOB_MAX_RUNNING = int(os.environ.get("JOB_MAX_RUNNING", 4))
+JOB_MAX_RUNNING_PER_FABRIC = int(os.environ.get("JOB_MAX_RUNNING_PER_FABRIC", 2))
+JOB_RUNNER_POLL_INTERVAL = float(os.environ.get("JOB_RUNNER_POLL_INTERVAL", 1.0))
+# time in seconds to keep finished jobs
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 86400))
+# running jobs and snapshot/compare objects refresh a heartbeat every interval.
+# Jobs and objects whose heartbeat is older than the lease timeout are reset by
+# the job runner and each job is retried up to max attempts
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", 10.0))
+JOB_LEASE_TIMEOUT = float(os.environ.get("JOB_LEASE_TIMEOUT", 120.0))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 2))
+# time in seconds the job runner waits for running jobs to exit after they are
+# terminated on shutdown before the jobs are killed
+JOB_STOP_TIMEOUT = float(os.environ.get("JOB_STOP_TIMEOUT", 30.0))
+
+# enable request scoped identity map for Rest.load so objects loaded multiple
+# times within the same request are read from the db only once
+REST_IDENTITY_MAP = bool(int(os.environ.get("REST_IDENTITY_MAP", 0)))
+
+# time in seconds a validated user session is cached within each process before
+# the session and user are read from the db again. Set to 0 to disable
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", 10.0))
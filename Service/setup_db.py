@@ -1,9 +1,10 @@
 
-import sys, os, subprocess, re, uuid, getpass, argparse, logging, traceback
+import sys, os, subprocess, re, uuid, getpass, argparse, logging, traceback, datetime
 
 from app.models.utils import get_app
 from app.models.rest import (registered_classes, Role, Universe)
 from app.models.user import User
+from app.models.user import Session as UserSession
 from app.models.settings import Settings
 from app.models.utils import (setup_logger, get_db)
 from werkzeug.exceptions import (NotFound, BadRequest)
@@ -149,6 +150,20 @@ def db_exists():
         return True
     return False
 
+def setup_session_ttl():
+    """ create ttl index used by mongo to purge expired user sessions and set expire_at on
+        sessions created before the index existed so they are also purged
+    """
+    UserSession.init()
+    collection = get_db()[UserSession._classname]
+    collection.create_index("expire_at", expireAfterSeconds=0)
+    count = 0
+    for s in collection.find({"expire_at": None}, {"timeout": 1}):
+        expire_at = datetime.datetime.utcfromtimestamp(s.get("timeout", 0) or 0)
+        collection.update_one({"_id": s["_id"]}, {"$set": {"expire_at": expire_at}})
+        count+= 1
+    if count > 0: logger.debug("set expire_at on %s existing sessions", count)
+
 def db_setup(args):
     """ delete any existing database and setup all tables for new database 
         returns boolean success
@@ -158,6 +173,7 @@ def db_setup(args):
     
     if not force and db_exists():
         logger.debug("db already exists")
+        setup_session_ttl()
         return True
 
     # get password from user if not set
@@ -193,6 +209,9 @@ def db_setup(args):
             logger.debug("creating indexes for %s: %s",c._classname,indexes)
             db[c._classname].create_index(indexes, unique=True)
 
+    # ttl index used to purge expired user sessions
+    setup_session_ttl()
+
     # if uni is enabled then required before any other object is created
     uni = Universe.load()
     uni.save()
@@ -208,6 +208,22 @@ function mongodb_accept_connections(){
     return 1
 }
 
+# start job runner in background to execute queued snapshot and compare jobs.
+# the runner is restarted if it exits
+function start_job_runner(){
+    set_status "starting job runner"
+    local cmd="cd $SCRIPT_DIR ; python -m app.models.aci.worker --runner"
+    cmd="$cmd >> $LOG_DIR/runner.log 2>> $LOG_DIR/runner.log"
+    log "command: $cmd"
+    (
+        while true ; do
+            su - -s /bin/bash www-data -c "$cmd"
+            log "job runner exited, restarting in 5 seconds"
+            sleep 5
+        done
+    ) &
+}
+
 # setup app required environment variables
 function create_app_config_file() {
     set_status "creating app config_file"
@@ -280,6 +296,7 @@ function main(){
     create_app_config_file
     start_all_services
     init_db
+    start_job_runner
 
     # perform frontend build if required
     local src="$APP_DIR/src/UIAssets.src"
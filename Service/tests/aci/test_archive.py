@@ -0,0 +1,176 @@
+"""
+test indexed snapshot archive creation, extraction, and legacy snapshot conversion
+"""
+from app.models.aci import archive
+import hashlib, json, logging, os, tarfile
+import pytest
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+# snapshot contents indexed by member name
+CONTENTS = {
+    "definition.json": json.dumps({"definition": "test"}),
+    "node-101/fvCEp.json": json.dumps([{"fvCEp":{"attributes":{"dn":"ep-%s" % i}}}
+                                        for i in xrange(0, 5000)]),
+    "node-101/fvBD.json": json.dumps([]),
+    "node-102/fvCEp.json": json.dumps([{"fvCEp":{"attributes":{"dn":"ep-1"}}}]),
+}
+
+@pytest.fixture(scope="function")
+def src(tmpdir):
+    # directory with snapshot contents
+    src = tmpdir.mkdir("src")
+    for name in CONTENTS:
+        src.join(name).write(CONTENTS[name], ensure=True)
+    return src
+
+def create_legacy_snapshot(src, path):
+    """ create legacy tar snapshot with gzip bundle and md5checksum.json of src directory
+        and return md5 of the bundle
+    """
+    bundle = "%s.bundle.tgz" % path
+    md5file = "%s.md5checksum.json" % path
+    with tarfile.open(bundle, "w:gz") as tar:
+        for name in sorted(CONTENTS):
+            tar.add("%s" % src.join(name), arcname="./%s" % name)
+    with open(bundle, "rb") as f:
+        md5 = hashlib.md5(f.read()).hexdigest()
+    with open(md5file, "w") as f:
+        json.dump({"md5checksum": md5}, f)
+    with tarfile.open(path, "w") as tar:
+        tar.add(bundle, arcname="./bundle.tgz")
+        tar.add(md5file, arcname="./md5checksum.json")
+    os.remove(bundle)
+    os.remove(md5file)
+    return md5
+
+def get_contents(dst):
+    """ return dict of file contents within dst directory indexed by relative path """
+    contents = {}
+    for (dirpath, dirnames, filenames) in os.walk("%s" % dst):
+        for fname in filenames:
+            fname = os.path.join(dirpath, fname)
+            with open(fname, "rb") as f:
+                contents[os.path.relpath(fname, "%s" % dst)] = f.read()
+    return contents
+
+def test_snapshot_writer_round_trip(tmpdir, src):
+    # members added with SnapshotWriter are indexed and extracted with identical content
+    path = "%s" % tmpdir.join("test.snap")
+    writer = archive.SnapshotWriter(path)
+    for name in sorted(CONTENTS):
+        writer.add(name, "%s" % src.join(name))
+    md5 = writer.close()
+    assert md5 is not None
+    assert archive.is_indexed(path)
+
+    with archive.SnapshotReader(path) as reader:
+        assert reader.md5 == md5
+        assert reader.names() == sorted(CONTENTS)
+        m = reader.members["node-101/fvCEp.json"]
+        assert m["node"] == "101"
+        assert m["classname"] == "fvCEp"
+        assert m["size"] == len(CONTENTS["node-101/fvCEp.json"])
+        assert m["length"] < m["size"]
+        assert "node" not in reader.members["definition.json"]
+
+    checksum = archive.get_checksum(path)
+    assert checksum == {"md5checksum": md5, "codec": archive.DEFAULT_CODEC, "indexed": True}
+    dst = tmpdir.mkdir("dst")
+    assert archive.extract_snapshot(path, "%s" % dst) == checksum
+    assert get_contents(dst) == CONTENTS
+
+    # create_snapshot on the same directory produces the same index
+    assert archive.create_snapshot("%s" % src, "%s" % tmpdir.join("test2.snap")) == md5
+
+def test_extract_snapshot_select(tmpdir, src):
+    # only members accepted by select are extracted
+    path = "%s" % tmpdir.join("test.snap")
+    md5 = archive.create_snapshot("%s" % src, path)
+    assert md5 is not None
+    dst = tmpdir.mkdir("dst")
+    def select(name):
+        r = archive.NODE_MEMBER_REGEX.search(name)
+        return r is None or r.group("classname") == "fvCEp"
+    assert archive.extract_snapshot(path, "%s" % dst, select=select)["md5checksum"] == md5
+    assert sorted(get_contents(dst).keys()) == ["definition.json", "node-101/fvCEp.json",
+                                                "node-102/fvCEp.json"]
+
+    # additional members can be extracted later into the same directory
+    select = lambda name: name == "node-101/fvBD.json"
+    assert archive.extract_snapshot(path, "%s" % dst, select=select) is not None
+    assert get_contents(dst) == CONTENTS
+
+def test_extract_legacy_snapshot(tmpdir, src):
+    # legacy tar snapshots are fully extracted and md5 of the bundle is verified
+    path = "%s" % tmpdir.join("legacy.tgz")
+    md5 = create_legacy_snapshot(src, path)
+    assert not archive.is_indexed(path)
+    checksum = archive.get_checksum(path)
+    assert checksum == {"md5checksum": md5, "codec": "gzip", "indexed": False}
+    dst = tmpdir.mkdir("dst")
+    assert archive.extract_snapshot("%s" % path, "%s" % dst) == checksum
+    assert get_contents(dst) == CONTENTS
+
+def test_convert_snapshot(tmpdir, src):
+    # legacy snapshot converted to indexed snapshot with the same content and stable md5
+    legacy = "%s" % tmpdir.join("legacy.tgz")
+    create_legacy_snapshot(src, legacy)
+    path = "%s" % tmpdir.join("converted.snap")
+    tmp = "%s" % tmpdir.join("tmp")
+    md5 = archive.convert_snapshot(legacy, path, tmp)
+    assert md5 is not None
+    assert not os.path.exists(tmp)
+    assert archive.is_indexed(path)
+    assert archive.get_checksum(path)["md5checksum"] == md5
+
+    dst = tmpdir.mkdir("dst")
+    assert archive.extract_snapshot(path, "%s" % dst)["md5checksum"] == md5
+    assert get_contents(dst) == CONTENTS
+
+    # converting again or creating directly from the original contents gives the same md5
+    path2 = "%s" % tmpdir.join("converted2.snap")
+    assert archive.convert_snapshot(legacy, path2, tmp) == md5
+    assert archive.create_snapshot("%s" % src, "%s" % tmpdir.join("direct.snap")) == md5
+
+    # conversion fails if tmp directory already exists
+    os.makedirs(tmp)
+    assert archive.convert_snapshot(legacy, "%s" % tmpdir.join("fail.snap"), tmp) is None
+
+def test_extract_corrupt_member(tmpdir, src):
+    # corrupt member data fails md5 check, extraction returns None and no partial member
+    path = "%s" % tmpdir.join("test.snap")
+    assert archive.create_snapshot("%s" % src, path) is not None
+    with archive.SnapshotReader(path) as reader:
+        m = reader.members["node-101/fvCEp.json"]
+    with open(path, "r+b") as f:
+        f.seek(m["offset"] + m["length"]/2)
+        data = f.read(1)
+        f.seek(m["offset"] + m["length"]/2)
+        f.write(chr((ord(data) + 1) % 256))
+
+    dst = tmpdir.mkdir("dst")
+    assert archive.extract_snapshot(path, "%s" % dst) is None
+    assert not os.path.exists("%s" % dst.join("node-101/fvCEp.json"))
+    # other members remain readable
+    dst = tmpdir.mkdir("dst2")
+    select = lambda name: name == "node-102/fvCEp.json"
+    assert archive.extract_snapshot(path, "%s" % dst, select=select) is not None
+    assert get_contents(dst) == {"node-102/fvCEp.json": CONTENTS["node-102/fvCEp.json"]}
+
+    # corrupt legacy bundle fails md5 check
+    legacy = "%s" % tmpdir.join("legacy.tgz")
+    create_legacy_snapshot(src, legacy)
+    with tarfile.open(legacy, "r") as tar:
+        info = tar.getmember("./md5checksum.json")
+    with open(legacy, "r+b") as f:
+        f.seek(info.offset_data)
+        f.write(json.dumps({"md5checksum": "0"*32}).ljust(info.size))
+    assert archive.extract_snapshot(legacy, "%s" % tmpdir.mkdir("dst3")) is None
+
+    # invalid file
+    invalid = tmpdir.join("invalid.snap")
+    invalid.write(archive.MAGIC + "invalid")
+    assert archive.get_checksum("%s" % invalid) is None
+    assert archive.extract_snapshot("%s" % invalid, "%s" % tmpdir.mkdir("dst4")) is None
@@ -0,0 +1,159 @@
+"""
+test chunked compare results read, paging through entries, and delete
+"""
+from app.models.utils import get_db
+from app.models.aci.compare import (CompareResults, CompareResultsChunks, ResultSink)
+import json, logging
+import pytest
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+results_url = "/api/aci/compare/results"
+entries_url = "/api/aci/compare/results/{}/entries"
+good_request = 200
+bad_request = 400
+
+@pytest.fixture(scope="function")
+def results_cleanup(request, app):
+    # drop all compare results and chunks after each test
+    def teardown():
+        db = get_db()
+        for c in [CompareResults, CompareResultsChunks]:
+            c.init()
+            db[c._classname].drop()
+    request.addfinalizer(teardown)
+
+def get_entries(classname, entry_type, count):
+    return [{"dn": "%s/%s-%s" % (classname, entry_type, i)} for i in xrange(0, count)]
+
+def chunk_count(**kwargs):
+    """ return number of CompareResultsChunks matching provided attributes """
+    return CompareResultsChunks.read(_filters=kwargs)["count"]
+
+def get_result(compare_id, node_id, classname):
+    """ return compare result as stored in the db """
+    CompareResults.init()
+    return get_db()[CompareResults._classname].find_one({"compare_id": compare_id,
+                "node_id": node_id, "classname": classname})
+
+def create_results(compare_id, chunk_size=3, chunked=True):
+    """ create compare results for two classes on two nodes with provided number of entries
+        and return dict of results indexed by (node_id, classname)
+    """
+    counts = {"created": 7, "deleted": 0, "modified": 3, "equal": 10}
+    sink = ResultSink(chunk_size=chunk_size)
+    results = {}
+    for node_id in [101, 102]:
+        for classname in ["fvCEp", "fvBD"]:
+            r = CompareResults(compare_id=compare_id, node_id=node_id, classname=classname)
+            for t in counts:
+                setattr(r, t, get_entries(classname, t, counts[t]))
+                r.total[t] = counts[t]
+            results[(node_id, classname)] = r.to_json()
+            if chunked: assert sink.add(r)
+            else: assert r.save()
+    assert sink.flush()
+    return results
+
+def test_compare_results_chunked_read(app, results_cleanup):
+    # chunked results are rehydrated with the full list of entries on read
+    expected = create_results("c1")
+    create_results("c2")
+    # 7 created is 3 chunks, 3 modified is 1 chunk, 10 equal is 4 chunks
+    assert chunk_count(compare_id="c1") == 4*8
+
+    ret = CompareResults.read(_filters={"compare_id": "c1"}, _disable_page=True,
+                _params={"include": "node_id,classname,created,deleted,modified,equal"})
+    assert ret["count"] == 4
+    for o in ret["objects"]:
+        e = expected[(o["node_id"], o["classname"])]
+        for t in CompareResults.ENTRY_TYPES: assert o[t] == e[t]
+
+    # keys and chunked flag excluded from the read
+    ret = CompareResults.read(_filters={"compare_id": "c1", "node_id": 102,
+                "classname": "fvBD"}, _params={"include": "created"})
+    assert ret["count"] == 1
+    assert ret["objects"][0]["created"] == expected[(102, "fvBD")]["created"]
+
+    # api read of single result
+    r = get_result("c1", 101, "fvCEp")
+    assert r["chunked"]
+    assert len(r["created"]) == 0
+    resp = app.client.get("%s/%s" % (results_url, r["_id"]))
+    assert resp.status_code == good_request
+    o = json.loads(resp.data)["objects"][0]
+    for t in CompareResults.ENTRY_TYPES:
+        assert o[t] == expected[(101, "fvCEp")][t]
+        assert o["total"][t] == len(expected[(101, "fvCEp")][t])
+
+    # bulk read without include does not read any chunks
+    resp = app.client.get("%s?filter=eq(\"compare_id\",\"c1\")" % results_url)
+    assert resp.status_code == good_request
+    js = json.loads(resp.data)
+    assert js["count"] == 4
+    for o in js["objects"]:
+        assert "created" not in o
+        assert o["total"]["created"] == 7
+
+def test_compare_results_read_entries(app, results_cleanup):
+    # entries route returns a page of entries for chunked and non-chunked results
+    expected = create_results("c1")
+    expected2 = create_results("c2", chunked=False)
+    for (compare_id, results) in [("c1", expected), ("c2", expected2)]:
+        r = get_result(compare_id, 101, "fvBD")
+        assert r is not None
+        assert r["chunked"] == (compare_id == "c1")
+        e = results[(101, "fvBD")]
+        for (page_size, page) in [(2, 0), (2, 1), (2, 3), (2, 4), (4, 1), (5, 1), (100, 0),
+                                  (3, 1)]:
+            resp = app.client.get("%s?type=equal&page=%s&page-size=%s" % (
+                entries_url.format(r["_id"]), page, page_size))
+            assert resp.status_code == good_request
+            js = json.loads(resp.data)
+            assert js["count"] == 10
+            assert js["page"] == page
+            assert js["page-size"] == page_size
+            assert js["objects"] == e["equal"][page*page_size:(page+1)*page_size]
+
+        # default page contains all created entries and empty deleted entries
+        resp = app.client.get("%s?type=created" % entries_url.format(r["_id"]))
+        assert resp.status_code == good_request
+        assert json.loads(resp.data)["objects"] == e["created"]
+        resp = app.client.get("%s?type=deleted" % entries_url.format(r["_id"]))
+        assert resp.status_code == good_request
+        js = json.loads(resp.data)
+        assert js["count"] == 0
+        assert js["objects"] == []
+
+        # invalid type and page values
+        for params in ["type=invalid", "", "type=created&page=-1",
+                        "type=created&page-size=0", "type=created&page=a"]:
+            resp = app.client.get("%s?%s" % (entries_url.format(r["_id"]), params))
+            assert resp.status_code == bad_request
+
+def test_compare_results_delete(app, results_cleanup):
+    # chunks are deleted along with the corresponding compare results
+    create_results("c1")
+    create_results("c2")
+    assert chunk_count(compare_id="c1") == 4*8
+    assert chunk_count(compare_id="c2") == 4*8
+
+    # delete single result by _id
+    CompareResults.delete(_id="%s" % get_result("c1", 101, "fvCEp")["_id"])
+    assert get_result("c1", 101, "fvCEp") is None
+    assert chunk_count(compare_id="c1") == 3*8
+    assert chunk_count(compare_id="c1", node_id=101, classname="fvCEp") == 0
+
+    # delete all results of a compare
+    CompareResults.delete(compare_id="c1")
+    assert CompareResults.read(_filters={"compare_id": "c1"})["count"] == 0
+    assert chunk_count(compare_id="c1") == 0
+    assert chunk_count(compare_id="c2") == 4*8
+
+    # delete with a filter on other attributes
+    CompareResults.delete(_filters={"compare_id": "c2", "classname": "fvBD",
+                "total.created": 7})
+    assert get_result("c2", 101, "fvBD") is None
+    assert chunk_count(compare_id="c2", classname="fvBD") == 0
+    assert chunk_count(compare_id="c2", classname="fvCEp") == 2*8
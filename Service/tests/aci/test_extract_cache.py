@@ -0,0 +1,169 @@
+"""
+test shared snapshot extraction cache references, size accounting, and eviction
+"""
+from app.models.aci import archive
+from app.models.aci.extract_cache import (ExtractCache, read_size, get_directory_size)
+import json, logging, os, subprocess
+import pytest
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+def create_snapshot(tmpdir, name, count=1000):
+    """ create indexed snapshot with fvCEp and fvBD objects on node-101 and return path """
+    src = tmpdir.mkdir("src-%s" % name)
+    src.join("definition.json").write(json.dumps({"definition": name}))
+    node = src.mkdir("node-101")
+    node.join("fvCEp.json").write(json.dumps(
+        [{"fvCEp":{"attributes":{"dn":"%s/ep-%s" % (name, i)}}} for i in xrange(0, count)]))
+    node.join("fvBD.json").write(json.dumps(
+        [{"fvBD":{"attributes":{"dn":"%s/bd-%s" % (name, i)}}} for i in xrange(0, count)]))
+    path = "%s" % tmpdir.join("%s.snap" % name)
+    assert archive.create_snapshot("%s" % src, path) is not None
+    return path
+
+def get_entries(cache):
+    """ return sorted list of cache entries """
+    return sorted([e for e in os.listdir(cache.root) if not e.startswith(".")])
+
+def get_total_size(cache):
+    """ return total size of cache from metadata, validating it matches cache contents """
+    total = read_size(os.path.join(cache.root, ".size"))
+    actual = 0
+    for e in get_entries(cache):
+        actual+= get_directory_size(os.path.join(cache.root, e, "data"))
+    assert total == actual
+    return total
+
+def set_last_used(cache, handle, ts):
+    entry = os.path.join(cache.root, handle["md5checksum"])
+    os.utime(os.path.join(entry, "last_used"), (ts, ts))
+
+def test_extract_cache_acquire_release(tmpdir):
+    # acquired entry is extracted on demand, size recorded, and retained after release
+    # while within max_size
+    path = create_snapshot(tmpdir, "s1")
+    cache = ExtractCache("%s" % tmpdir.join("cache"), 1024*1024*1024)
+    handle = cache.acquire(path)
+    assert handle is not None
+    assert handle["indexed"]
+    assert handle["md5checksum"] == archive.get_checksum(path)["md5checksum"]
+    assert os.path.exists(handle["ref"])
+
+    select = lambda name: not name.endswith("fvBD.json")
+    assert cache.extract(handle, select=select)
+    assert os.path.exists(os.path.join(handle["path"], "node-101/fvCEp.json"))
+    assert not os.path.exists(os.path.join(handle["path"], "node-101/fvBD.json"))
+    size = get_total_size(cache)
+    assert read_size(os.path.join(os.path.dirname(handle["path"]), "size")) == size
+
+    # second handle for same snapshot extracts only missing members and updates size
+    handle2 = cache.acquire(path)
+    assert handle2["path"] == handle["path"]
+    assert handle2["ref"] != handle["ref"]
+    assert cache.extract(handle2)
+    assert os.path.exists(os.path.join(handle["path"], "node-101/fvBD.json"))
+    assert get_total_size(cache) > size
+
+    cache.release(handle)
+    cache.release(handle2)
+    assert not os.path.exists(handle["ref"])
+    assert not os.path.exists(handle2["ref"])
+    assert get_entries(cache) == [handle["md5checksum"]]
+
+    # invalid snapshot
+    invalid = tmpdir.join("invalid.snap")
+    invalid.write("invalid")
+    assert cache.acquire("%s" % invalid) is None
+
+def test_extract_cache_evict_lru(tmpdir):
+    # least recently used entries without references are evicted once over max_size
+    paths = [create_snapshot(tmpdir, "s%s" % i) for i in xrange(0, 3)]
+    cache = ExtractCache("%s" % tmpdir.join("cache"), 1024*1024*1024)
+    handles = []
+    for i, path in enumerate(paths):
+        handle = cache.acquire(path)
+        assert cache.extract(handle)
+        set_last_used(cache, handle, 1000+i)
+        handles.append(handle)
+    for handle in handles: cache.release(handle)
+    assert len(get_entries(cache)) == 3
+    total = get_total_size(cache)
+
+    # reduce max_size so only two entries fit and the oldest is evicted
+    cache.max_size = total - 1
+    cache.evict()
+    assert get_entries(cache) == sorted([h["md5checksum"] for h in handles[1:]])
+    get_total_size(cache)
+
+    # re-acquire the oldest remaining entry so the newest is evicted next
+    handle = cache.acquire(paths[1])
+    cache.release(handle)
+    cache.max_size = get_total_size(cache) - 1
+    cache.evict()
+    assert get_entries(cache) == [handles[1]["md5checksum"]]
+
+    cache.max_size = 1
+    cache.evict()
+    assert get_entries(cache) == []
+    assert get_total_size(cache) == 0
+
+    # max_size of 0 evicts entries as soon as they are released
+    cache.max_size = 0
+    handle = cache.acquire(paths[0])
+    assert cache.extract(handle)
+    assert get_entries(cache) == [handle["md5checksum"]]
+    cache.release(handle)
+    assert get_entries(cache) == []
+    assert get_total_size(cache) == 0
+
+def test_extract_cache_evict_referenced(tmpdir):
+    # entries referenced by a running process are never evicted, stale references are
+    # removed and the entry evicted
+    paths = [create_snapshot(tmpdir, "s%s" % i) for i in xrange(0, 2)]
+    cache = ExtractCache("%s" % tmpdir.join("cache"), 0)
+    held = cache.acquire(paths[0])
+    assert cache.extract(held)
+    set_last_used(cache, held, 1000)
+
+    # reference held by another running process
+    p = subprocess.Popen(["sleep", "60"])
+    try:
+        other = cache.acquire(paths[1])
+        assert cache.extract(other)
+        set_last_used(cache, other, 1001)
+        refs = os.path.dirname(other["ref"])
+        os.rename(other["ref"], os.path.join(refs, "%s.0" % p.pid))
+        cache.evict()
+        assert get_entries(cache) == sorted([held["md5checksum"], other["md5checksum"]])
+        get_total_size(cache)
+
+        # reference for process that is no longer running is stale
+        p.kill()
+        p.wait()
+        cache.evict()
+        assert get_entries(cache) == [held["md5checksum"]]
+        assert os.path.exists(os.path.join(held["path"], "node-101/fvCEp.json"))
+        get_total_size(cache)
+    finally:
+        if p.poll() is None: p.kill()
+
+    cache.release(held)
+    assert get_entries(cache) == []
+
+def test_extract_cache_rebuild_size(tmpdir):
+    # total size is rebuilt from entries when cache metadata is missing
+    path = create_snapshot(tmpdir, "s1")
+    cache = ExtractCache("%s" % tmpdir.join("cache"), 1024*1024*1024)
+    handle = cache.acquire(path)
+    assert cache.extract(handle)
+    cache.release(handle)
+    total = get_total_size(cache)
+    os.remove(os.path.join(cache.root, ".size"))
+    os.remove(os.path.join(os.path.dirname(handle["path"]), "size"))
+
+    cache = ExtractCache(cache.root, 0)
+    cache.evict()
+    assert get_entries(cache) == []
+    assert read_size(os.path.join(cache.root, ".size")) == 0
+    assert total > 0
@@ -0,0 +1,382 @@
+"""
+test job queue, job runner, object leases, and compare execution with a lease held
+"""
+from app.models.utils import get_app_config, get_db
+from app.models.aci import archive
+from app.models.aci.compare import (Compare, CompareResults, execute_compare)
+from app.models.aci.definitions import Definitions
+from app.models.aci import jobs
+from app.models.aci.jobs import (Jobs, JobRunner, Lease)
+from app.models.aci.managed_objects import ManagedObjects
+from app.models.aci.snapshots import Snapshots
+from bson.objectid import ObjectId
+from multiprocessing import Pool
+import json, logging, os, signal, threading, time
+import pytest
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+@pytest.fixture(scope="function")
+def config(request):
+    # short heartbeat interval and no extraction cache, original config restored on teardown
+    config = get_app_config()
+    original = dict(config)
+    config["JOB_HEARTBEAT_INTERVAL"] = 0.01
+    config["EXTRACT_CACHE_MAX_SIZE"] = 0
+    def teardown():
+        config.clear()
+        config.update(original)
+    request.addfinalizer(teardown)
+    return config
+
+@pytest.fixture(scope="function")
+def jobs_cleanup(request, app):
+    # drop all jobs, snapshots, and compare objects after each test
+    def teardown():
+        db = get_db()
+        for c in [Jobs, Snapshots, Compare, CompareResults, Definitions, ManagedObjects]:
+            c.init()
+            db[c._classname].drop()
+    request.addfinalizer(teardown)
+
+def create_snapshot(tmpdir, name, objects, mos):
+    """ create indexed snapshot file with provided fvCEp objects on node-101 and return the
+        _id of the corresponding snapshot object
+    """
+    src = tmpdir.mkdir(name)
+    src.join("definition.json").write(json.dumps({
+        "definition": "test",
+        "managed_objects": mos,
+    }))
+    src.mkdir("node-101").join("fvCEp.json").write(json.dumps(
+        [{"fvCEp": {"attributes": o}} for o in objects]))
+    filename = "%s" % tmpdir.join("%s.snap" % name)
+    assert archive.create_snapshot("%s" % src, filename) is not None
+    Snapshots.init()
+    r = get_db()[Snapshots._classname].insert_one({
+        "definition": "test",
+        "description": name,
+        "filename": filename,
+        "nodes": [101],
+        "status": "complete",
+        "start_time": time.time(),
+    })
+    return "%s" % r.inserted_id
+
+def create_compare(tmpdir, status="init", **kwargs):
+    """ create two snapshots with one modified and one created object and return _id of
+        compare object in provided status
+    """
+    mo = ManagedObjects(classname="fvCEp")
+    assert mo.save()
+    d = Definitions(definition="test", managed_objects=["fvCEp"])
+    assert d.save()
+    mos = d.get_managed_objects()
+    s1 = create_snapshot(tmpdir, "s1", [{"dn":"ep1", "ip":"10.0.0.1"}], mos)
+    s2 = create_snapshot(tmpdir, "s2", [{"dn":"ep1", "ip":"10.0.0.2"},
+        {"dn":"ep2", "ip":"10.0.0.3"}], mos)
+    Compare.init()
+    c = {
+        "snapshot1": s1,
+        "snapshot2": s2,
+        "definition": "test",
+        "remap": False,
+        "serialize": False,
+        "status": status,
+        "start_time": time.time(),
+    }
+    c.update(kwargs)
+    r = get_db()[Compare._classname].insert_one(c)
+    return "%s" % r.inserted_id
+
+def pool_task(x):
+    logger.debug("pool task %s", x)
+    return x
+
+def test_lease_acquire_exclusive(app, config, jobs_cleanup, tmpdir):
+    # lease can only be acquired once while held and again once heartbeat has expired
+    compare_id = create_compare(tmpdir)
+    l1 = Lease(Compare, compare_id)
+    l2 = Lease(Compare, compare_id)
+    try:
+        assert l1.acquire(["init"])
+        assert not l2.acquire(["init"])
+        c = Compare.load(_id=compare_id)
+        assert c.status == "running"
+        assert c.lease_owner == l1.owner
+    finally:
+        l1.release()
+
+    # force expired heartbeat and ensure lease can be claimed by new owner
+    get_db()[Compare._classname].update_one({"_id": ObjectId(compare_id)},
+        {"$set": {"heartbeat": time.time() - 2*l2.timeout}})
+    try:
+        assert l2.acquire(["init"])
+        assert Compare.load(_id=compare_id).lease_owner == l2.owner
+    finally:
+        l2.release()
+
+def test_lease_suspend_pool(app, config, jobs_cleanup, tmpdir):
+    # process pool created with heartbeat suspended completes and heartbeat is restarted
+    compare_id = create_compare(tmpdir)
+    lease = Lease(Compare, compare_id)
+    assert lease.acquire(["init"])
+    try:
+        for i in xrange(0, 5):
+            with lease.suspend():
+                assert lease.thread is None
+                pool = Pool(processes=4)
+            assert lease.thread is not None and lease.thread.is_alive()
+            try:
+                assert pool.map_async(pool_task, range(0, 20)).get(timeout=30) == range(0, 20)
+            finally:
+                pool.terminate()
+        assert not lease.lost
+    finally:
+        lease.release()
+
+def test_execute_compare_with_lease(app, config, jobs_cleanup, tmpdir):
+    # compare executed with lease held and multiprocessing pool completes without hanging
+    compare_id = create_compare(tmpdir)
+    t = threading.Thread(target=execute_compare, args=(compare_id,))
+    t.daemon = True
+    t.start()
+    t.join(120)
+    assert not t.is_alive()
+
+    c = Compare.load(_id=compare_id)
+    assert c.status == "complete"
+    assert c.total["modified"] == 1
+    assert c.total["created"] == 1
+    # heartbeat thread is stopped once the lease is released
+    heartbeat = c.heartbeat
+    time.sleep(0.1)
+    assert Compare.load(_id=compare_id).heartbeat == heartbeat
+
+def get_job(job_type, target):
+    """ return most recent job for job_type and target as stored in the db """
+    for job in Jobs.collection().find({"job_type": job_type, "target": target}).sort(
+        "queued_time", -1).limit(1):
+        return job
+    return None
+
+def test_jobs_claim_exclusive(app, config, jobs_cleanup):
+    # queued job is only added once and only one of two concurrent claimants wins it
+    for i in xrange(0, 20):
+        target = "target-%s" % i
+        assert Jobs.enqueue("compare", target)
+        assert Jobs.enqueue("compare", target)
+        assert Jobs.collection().find({"target": target}).count() == 1
+
+        start = threading.Event()
+        claimed = []
+        def claim(runner):
+            start.wait()
+            claimed.append((runner, Jobs.claim(runner)))
+        threads = [threading.Thread(target=claim, args=("runner-%s" % r,)) for r in xrange(0,2)]
+        for t in threads: t.start()
+        start.set()
+        for t in threads: t.join(10)
+        winners = [(runner, job) for (runner, job) in claimed if job is not None]
+        assert len(claimed) == 2
+        assert len(winners) == 1
+        (runner, job) = winners[0]
+        assert job["target"] == target
+        assert job["status"] == "running"
+        assert job["runner"] == runner
+        assert job["attempts"] == 1
+        assert get_job("compare", target)["runner"] == runner
+        assert Jobs.claim("runner-2") is None
+
+def test_jobs_claim_order(app, config, jobs_cleanup):
+    # jobs are claimed oldest first skipping excluded fabrics
+    assert Jobs.enqueue("snapshot", "s1", fabric="f1")
+    assert Jobs.enqueue("snapshot", "s2", fabric="f1")
+    assert Jobs.enqueue("compare", "c1", fabric="f2")
+    assert Jobs.claim("runner", exclude_fabrics=["f1"])["target"] == "c1"
+    assert Jobs.claim("runner", exclude_fabrics=["f2"])["target"] == "s1"
+    assert Jobs.claim("runner", exclude_fabrics=["f1", "f2"]) is None
+    assert Jobs.claim("runner")["target"] == "s2"
+    assert Jobs.claim("runner") is None
+
+    # job can be queued again while the previous job for the same target is running
+    assert Jobs.enqueue("snapshot", "s1", fabric="f1")
+    assert Jobs.collection().find({"target": "s1"}).count() == 2
+
+def test_jobs_expire(app, config, jobs_cleanup):
+    # running job with expired heartbeat is requeued until max_attempts is reached
+    assert Jobs.enqueue("compare", "c1")
+    job = Jobs.claim("runner-1")
+    assert job is not None
+
+    # heartbeat within timeout is not expired
+    Jobs.heartbeat([job["_id"]])
+    Jobs.expire(60, 2)
+    assert get_job("compare", "c1")["status"] == "running"
+
+    def expire_heartbeat():
+        Jobs.collection().update_one({"_id": job["_id"]},
+            {"$set": {"heartbeat": time.time() - 120}})
+        Jobs.expire(60, 2)
+
+    expire_heartbeat()
+    j = get_job("compare", "c1")
+    assert j["status"] == "queued"
+    assert j["runner"] == ""
+
+    # expired job is claimed again by a new runner
+    job = Jobs.claim("runner-2")
+    assert job is not None
+    assert job["_id"] == j["_id"]
+    assert job["runner"] == "runner-2"
+    assert job["attempts"] == 2
+
+    # second expiration exceeds max_attempts
+    expire_heartbeat()
+    j = get_job("compare", "c1")
+    assert j["status"] == "error"
+    assert j["end_time"] > 0
+    assert Jobs.claim("runner-3") is None
+
+def test_jobs_finish(app, config, jobs_cleanup):
+    # finish records final status and end_time, purge removes old finished jobs
+    for target in ["c1", "c2", "c3"]:
+        assert Jobs.enqueue("compare", target)
+        assert Jobs.claim("runner") is not None
+    ts = time.time()
+    Jobs.finish(get_job("compare", "c1")["_id"], success=True)
+    Jobs.finish(get_job("compare", "c2")["_id"], success=False)
+    j = get_job("compare", "c1")
+    assert j["status"] == "complete"
+    assert j["end_time"] >= ts
+    j = get_job("compare", "c2")
+    assert j["status"] == "error"
+    assert j["end_time"] >= ts
+    assert get_job("compare", "c3")["status"] == "running"
+
+    # finished jobs older than max_age are purged, running jobs are kept
+    Jobs.collection().update_many({}, {"$set": {"heartbeat": 0, "end_time": ts - 3600}})
+    Jobs.purge(60)
+    assert get_job("compare", "c1") is None
+    assert get_job("compare", "c2") is None
+    assert get_job("compare", "c3")["status"] == "running"
+
+def test_job_runner_schedule(app, config, jobs_cleanup, monkeypatch):
+    # runner claims jobs within the global and per-fabric limits
+    config["JOB_MAX_RUNNING"] = 3
+    config["JOB_MAX_RUNNING_PER_FABRIC"] = 2
+    runner = JobRunner()
+    started = []
+    def start(job):
+        started.append(job["target"])
+        runner.children[len(started)] = job
+    monkeypatch.setattr(runner, "start", start)
+
+    for (target, fabric) in [("s1", "f1"), ("s2", "f1"), ("s3", "f1"), ("s4", "f2"),
+                             ("s5", "f2")]:
+        assert Jobs.enqueue("snapshot", target, fabric=fabric)
+    runner.schedule()
+    assert started == ["s1", "s2", "s4"]
+    runner.schedule()
+    assert started == ["s1", "s2", "s4"]
+
+    # completed job frees a slot for the next job of the fabric
+    job = runner.children.pop(1)
+    Jobs.finish(job["_id"], success=True)
+    runner.schedule()
+    assert started == ["s1", "s2", "s4", "s3"]
+    assert get_job("snapshot", "s5")["status"] == "queued"
+
+def test_job_runner_execute(app, config, jobs_cleanup):
+    # jobs executed in child processes are finished with the exit status of the job
+    runner = JobRunner()
+    assert Jobs.enqueue("compare", "invalid")
+    assert Jobs.enqueue("invalid", "invalid")
+    runner.schedule()
+    assert len(runner.children) == 2
+    ts = time.time()
+    while len(runner.children) > 0 and time.time() - ts < 60:
+        runner.reap()
+        time.sleep(0.1)
+    assert len(runner.children) == 0
+
+    # compare for object that does not exist completes without error
+    j = get_job("compare", "invalid")
+    assert j["status"] == "complete"
+    assert j["runner"] == runner.runner
+    assert j["pid"] > 0
+    # unknown job type fails
+    assert get_job("invalid", "invalid")["status"] == "error"
+
+def test_execute_compare_finished(app, config, jobs_cleanup, tmpdir):
+    # requeued or duplicate job does not re-run a compare that is no longer in init
+    compare_id = create_compare(tmpdir)
+    for status in ["complete", "error", "running"]:
+        get_db()[Compare._classname].update_one({"_id": ObjectId(compare_id)},
+            {"$set": {"status": status, "heartbeat": time.time()}})
+        execute_compare(compare_id)
+        c = Compare.load(_id=compare_id)
+        assert c.status == status
+        assert CompareResults.read(_filters={"compare_id": compare_id})["count"] == 0
+
+def sleep_job(job):
+    time.sleep(60)
+
+def ignore_term_job(job):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60)
+
+def pid_alive(pid):
+    try: os.kill(pid, 0)
+    except OSError as e: return False
+    return True
+
+def test_job_runner_stop(app, config, jobs_cleanup, monkeypatch):
+    # running jobs are terminated when the runner stops and finished with error status so
+    # they are not requeued by the next runner
+    config["JOB_STOP_TIMEOUT"] = 2
+    config["JOB_RUNNER_POLL_INTERVAL"] = 0.1
+    monkeypatch.setattr(jobs, "execute_job", sleep_job)
+    runner = JobRunner()
+    assert Jobs.enqueue("snapshot", "s1", fabric="f1")
+    assert Jobs.enqueue("snapshot", "s2", fabric="f2")
+
+    # stop requested while runner loop is executing
+    handlers = (signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT))
+    stopper = threading.Timer(1.0, runner.stop)
+    stopper.start()
+    try:
+        ts = time.time()
+        assert runner.run()
+        assert time.time() - ts < 30
+    finally:
+        stopper.cancel()
+        signal.signal(signal.SIGTERM, handlers[0])
+        signal.signal(signal.SIGINT, handlers[1])
+    assert len(runner.children) == 0
+    for target in ["s1", "s2"]:
+        j = get_job("snapshot", target)
+        assert j["status"] == "error"
+        assert j["pid"] > 0
+        assert not pid_alive(j["pid"])
+
+    # expired heartbeat does not requeue the finished jobs
+    Jobs.collection().update_many({}, {"$set": {"heartbeat": 0}})
+    Jobs.expire(1, 2)
+    assert Jobs.claim("runner") is None
+
+    # job that ignores SIGTERM is killed after the stop timeout
+    monkeypatch.setattr(jobs, "execute_job", ignore_term_job)
+    assert Jobs.enqueue("snapshot", "s3", fabric="f1")
+    runner = JobRunner()
+    runner.schedule()
+    assert len(runner.children) == 1
+    pid = runner.children.keys()[0]
+    time.sleep(0.5)
+    ts = time.time()
+    runner.shutdown()
+    assert time.time() - ts >= 2
+    assert len(runner.children) == 0
+    assert not pid_alive(pid)
+    assert get_job("snapshot", "s3")["status"] == "error"
@@ -0,0 +1,222 @@
+"""
+test compiled remappers and unexpanded range compare against the original remap and
+range expansion
+"""
+from app.models.aci.compare import (list_compare, range_set_compare)
+from app.models.aci.remap import (Remap, expand_range, get_range_set)
+import json, logging, random, re
+import pytest
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+# remap tables for two nodes where different ids map to the same values
+TABLES1 = {
+    "vlans": {"vlan10": "vxlan-1000", "vlan11": "vxlan-1001", "vlan12": "7"},
+    "aggs": {"po1": "pc-a", "po2": "pc-b"},
+    "encrtds": {"eth1/1.5": "eth1/1.vlan-5", "po1.6": "pc-a.vlan-6"},
+    "loopbacks": {"lo0": "overlay-1:ptep", "lo1": "vxlan-2000:unspecified"},
+    "tunnels": {"tunnel1": "overlay-1:10.0.0.1:10.0.0.2"},
+}
+TABLES2 = {
+    "vlans": {"vlan20": "vxlan-1000", "vlan21": "vxlan-1001", "vlan22": "7"},
+    "aggs": {"po3": "pc-a", "po4": "pc-b"},
+    "encrtds": {"eth1/2.5": "eth1/1.vlan-5", "po3.6": "pc-a.vlan-6"},
+    "loopbacks": {"lo3": "overlay-1:ptep"},
+    "tunnels": {"tunnel7": "overlay-1:10.0.0.1:10.0.0.2"},
+}
+
+# values covering each remap type, values matching no remap, and values matching a
+# remap regex that are not present in the remap table
+VALUES = [
+    "", "vlan10", "vlan11", "vlan12", "vlan99", "vlan-10", "[vlan10]", "vlan10,", ",vlan11",
+    "10", "po1", "po2", "po9", "po1.6", "eth1/1.5", "eth1/1.9", "lo0", "lo1", "lo5",
+    "tunnel1", "tunnel12", "sys/phys-[eth1/1]", "uni/tn-common", "vxlan-1000",
+    "vlan20", "po3", "eth1/2.5", "lo3", "tunnel7", "polo", "loop", "eth",
+]
+
+SELECTORS = [
+    [], ["all"], ["vlan"], ["agg"], ["encrtd"], ["loopback"], ["tunnel"],
+    ["vlan", "agg"], ["encrtd", "agg"], ["tunnel", "loopback", "vlan"],
+]
+
+def get_remap(tmpdir, node_id, tables):
+    """ return Remap object for node_id loaded from provided remap tables """
+    folder = tmpdir.mkdir("node-%s" % node_id)
+    folder.join("%s.json" % Remap.REMAP_ARTIFACT).write(json.dumps(tables))
+    return Remap(node_id, "%s" % folder)
+
+def expected_remap(remap, value, mo_remaps):
+    """ original remap_attribute implementation applying each selected remap in order """
+    if len(mo_remaps) == 0: return value
+    allset = "all" in mo_remaps
+    for r in Remap.REMAP_ORDERED:
+        if allset or r in mo_remaps:
+            t = remap.remaps[r]
+            r1 = t[0].search(value)
+            if r1 is not None:
+                match = re.sub("[\[\]\,]", "", r1.group("v"))
+                if match in t[1]:
+                    value = t[0].sub(t[1][match], value)
+    return value
+
+def expected_list_compare(value1, value2, remapper1, remapper2):
+    """ original list-expand compare with expanded ranges """
+    v1 = expand_range(value1)
+    v2 = expand_range(value2)
+    if "" in v1: v1.remove("")
+    if "" in v2: v2.remove("")
+    return set([remapper1(v) for v in v1]) == set([remapper2(v) for v in v2])
+
+def random_list(rand, values):
+    """ return random comma separated list of ranges, numbers, and values """
+    items = []
+    for i in xrange(0, rand.randint(0, 6)):
+        kind = rand.randint(0, 3)
+        if kind == 0:
+            start = rand.randint(0, 40)
+            end = start + rand.randint(-5, 10)
+            items.append("%s-%s" % (start, max(0, end)))
+        elif kind == 1:
+            items.append("%s" % rand.randint(0, 50))
+        elif kind == 2:
+            items.append(rand.choice(values))
+        else:
+            items.append("")
+    return ",".join(items)
+
+def test_get_remapper(tmpdir):
+    # compiled remapper returns the same value as the original remap for all selectors
+    for (node_id, tables) in [(101, TABLES1), (102, TABLES2)]:
+        remap = get_remap(tmpdir, node_id, tables)
+        for mo_remaps in SELECTORS:
+            remapper = remap.get_remapper(mo_remaps)
+            # remapper compiled once per selector set regardless of order
+            assert remap.get_remapper(list(reversed(mo_remaps))) is remapper
+            for value in VALUES:
+                expected = expected_remap(remap, value, mo_remaps)
+                assert remapper(value) == expected
+                # memoized value
+                assert remapper(value) == expected
+                assert remap.remap_attribute(value, mo_remaps) == expected
+            assert not remapper.digits
+
+    # disabled remap and empty remap tables return the original value
+    for remap in [Remap(101), get_remap(tmpdir, 103, {})]:
+        remapper = remap.get_remapper(["all"])
+        assert not remapper.digits
+        for value in VALUES: assert remapper(value) == value
+
+def test_get_remapper_digits(tmpdir):
+    # digits flag set only when digit-only vlan values can be remapped
+    remap = get_remap(tmpdir, 101, {"vlans": {"10": "vxlan-1000", "vlan11": "vxlan-1001"}})
+    for mo_remaps in [["vlan"], ["all"]]:
+        remapper = remap.get_remapper(mo_remaps)
+        assert remapper.digits
+        for value in VALUES + ["10", "11", "010"]:
+            assert remapper(value) == expected_remap(remap, value, mo_remaps)
+    assert remapper("10") == "vxlan-1000"
+    assert not remap.get_remapper(["agg"]).digits
+
+def test_get_range_set():
+    # range set contains merged intervals and remaining values
+    assert get_range_set("") == ([], set())
+    assert get_range_set("1-3,5,4,10-8,,vlan1") == ([(1, 5), (8, 10)], set(["vlan1"]))
+    assert get_range_set("5-5,6") == ([(5, 6)], set())
+    assert get_range_set("01,1, 2") == ([(1, 1)], set(["01", " 2"]))
+    assert get_range_set(" 3 - 4 ,7") == ([(3, 4), (7, 7)], set())
+    assert get_range_set(None) is None
+
+    # range set is equivalent to expanded range
+    rand = random.Random(1)
+    for i in xrange(0, 500):
+        value = random_list(rand, ["vlan1", "01", "a-b", "1-2-3"])
+        (intervals, values) = get_range_set(value)
+        expanded = set(expand_range(value))
+        expanded.discard("")
+        ranges = set()
+        for (start, end) in intervals:
+            ranges|= set(["%d" % v for v in xrange(start, end+1)])
+        assert ranges | values == expanded
+
+def test_list_compare(tmpdir):
+    # fast path range compare and list_compare match the expanded compare
+    remap1 = get_remap(tmpdir, 101, TABLES1)
+    remap2 = get_remap(tmpdir, 102, TABLES2)
+    rand = random.Random(1)
+    fast = 0
+    for mo_remaps in [[], ["all"], ["vlan"], ["agg"]]:
+        r1 = remap1.get_remapper(mo_remaps)
+        r2 = remap2.get_remapper(mo_remaps)
+        for i in xrange(0, 500):
+            value1 = random_list(rand, VALUES)
+            # similar value for second node with some values remapped to node 2
+            value2 = value1
+            for (a, b) in [("vlan10", "vlan20"), ("po1", "po3"), ("lo0", "lo3")]:
+                if rand.randint(0, 1): value2 = value2.replace(a, b)
+            if rand.randint(0, 3) == 0: value2 = random_list(rand, VALUES)
+            expected = expected_list_compare(value1, value2, r1, r2)
+            ret = range_set_compare(value1, value2, r1, r2)
+            if ret is not None:
+                fast+= 1
+                assert ret == expected
+            (match, map1, map2) = list_compare(value1, value2, r1, r2, expand=True)
+            assert match == expected
+            if match: assert map1 is None and map2 is None
+            else: assert map1 is not None and map2 is not None
+    # most values compared without expansion
+    assert fast > 1000
+
+def test_list_compare_fallback(tmpdir):
+    # values that cannot be compared as range sets fall back to expanded compare
+    remap1 = get_remap(tmpdir, 101, TABLES1)
+    remap2 = get_remap(tmpdir, 102, TABLES2)
+    r1 = remap1.get_remapper(["vlan"])
+    r2 = remap2.get_remapper(["vlan"])
+
+    # same ranges with remapped vlan values
+    assert range_set_compare("1-5,vlan10", "vlan20,1-3,4,5", r1, r2)
+    assert list_compare("1-5,vlan10", "vlan20,1-3,4,5", r1, r2, expand=True) == \
+        (True, None, None)
+
+    # mismatch returns remapped expanded values
+    assert range_set_compare("1-3", "1-2", r1, r2) is False
+    (match, map1, map2) = list_compare("1-3", "1-2", r1, r2, expand=True)
+    assert not match
+    assert sorted(map1.split(",")) == ["1", "2", "3"]
+    assert sorted(map2.split(",")) == ["1", "2"]
+
+    # vlan remapped to a number overlaps a range on the other node
+    assert r1("vlan12") == "7"
+    assert range_set_compare("1-6,vlan12", "1-7", r1, r2) is None
+    assert list_compare("1-6,vlan12", "1-7", r1, r2, expand=True) == (True, None, None)
+    assert list_compare("1-6,vlan12", "1-6,vlan22", r1, r2, expand=True) == (True, None, None)
+    assert not list_compare("1-6,vlan12", "1-6", r1, r2, expand=True)[0]
+
+    # non-expanded list compare ignores order and duplicates
+    assert list_compare("vlan10,po1,vlan10", "po1,vlan20", r1, r2) == (True, None, None)
+    assert not list_compare("1-3", "1,2,3", r1, r2)[0]
+
+def test_list_compare_digits(tmpdir):
+    # remapper that changes digit-only values disables the range set compare
+    remap1 = get_remap(tmpdir, 101, {"vlans": {"10": "vxlan-1000", "11": "vxlan-1001"}})
+    remap2 = get_remap(tmpdir, 102, {"vlans": {"20": "vxlan-1000", "21": "vxlan-1001"}})
+    r1 = remap1.get_remapper(["vlan"])
+    r2 = remap2.get_remapper(["vlan"])
+    assert r1.digits and r2.digits
+    assert range_set_compare("10-12", "12,20-21", r1, r2) is None
+    assert list_compare("10-12", "12,20-21", r1, r2, expand=True) == (True, None, None)
+    assert not list_compare("10-12", "12-13,20", r1, r2, expand=True)[0]
+
+    # only one remapper with digits still disables the range set compare
+    r2 = Remap(102).get_remapper(["vlan"])
+    assert range_set_compare("10-11", "10-11", r1, r2) is None
+    assert not list_compare("10-11", "10-11", r1, r2, expand=True)[0]
+
+    rand = random.Random(1)
+    r2 = remap2.get_remapper(["vlan"])
+    for i in xrange(0, 500):
+        value1 = random_list(rand, VALUES)
+        value2 = random_list(rand, VALUES)
+        assert list_compare(value1, value2, r1, r2, expand=True)[0] == \
+            expected_list_compare(value1, value2, r1, r2)
@@ -0,0 +1,195 @@
+"""
+test aci utils paging and streaming json parser with a simulated APIC session
+"""
+from app.models.aci import utils as aci_utils
+from app.models.aci.utils import ImdataStream
+import collections, json, logging, threading, time
+import pytest
+
+# module level logging
+logger = logging.getLogger(__name__)
+
+class FakeResponse(object):
+    """ requests response with json body """
+    def __init__(self, body, ok=True):
+        self.body = body
+        self.text = body
+        self.ok = ok
+        self.closed = False
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size=1):
+        for i in xrange(0, len(self.body), chunk_size):
+            yield self.body[i:i+chunk_size]
+
+    def close(self):
+        self.closed = True
+
+class FakeSession(object):
+    """ APIC session returning pages of total objects.  Each page is delayed so later pages
+        complete before earlier pages when requested concurrently. Pages within fail are
+        returned with an error reply
+    """
+    def __init__(self, total, page_size, delay=0.0, fail=[]):
+        self.ipaddr = "127.0.0.1"
+        self.objects = [{"fvCEp":{"attributes":{"dn":"ep-%s" % i}}} for i in xrange(0, total)]
+        self.page_size = page_size
+        self.delay = delay
+        self.fail = fail
+        self.requests = []
+        self.responses = []
+        self.lock = threading.Lock()
+
+    def get(self, url, timeout=None, stream=False):
+        page = int(url.split("page=")[-1])
+        with self.lock: self.requests.append(page)
+        pages = (len(self.objects) + self.page_size - 1) / self.page_size
+        time.sleep(self.delay * (pages - page))
+        if page in self.fail:
+            resp = FakeResponse(json.dumps(error_reply("page %s failed" % page)), ok=False)
+        else:
+            imdata = self.objects[page*self.page_size:(page+1)*self.page_size]
+            # totalCount precedes imdata as in APIC replies
+            resp = FakeResponse(json.dumps(collections.OrderedDict([
+                ("totalCount", "%s" % len(self.objects)), ("imdata", imdata)])))
+        with self.lock: self.responses.append(resp)
+        return resp
+
+def error_reply(text):
+    return {"totalCount":"1", "imdata":[{"error":{"attributes":{"code":"400", "text":text}}}]}
+
+def chunked(body, size):
+    return [body[i:i+size] for i in xrange(0, len(body), size)]
+
+def test_imdata_stream_chunk_boundaries():
+    # objects split across every possible chunk boundary are decoded correctly, including
+    # multi-byte utf-8 characters and numbers split across chunks
+    js = {
+        "totalCount": "3",
+        "imdata": [
+            {"fvCEp": {"attributes": {"dn": "uni/tn-\xc3\xa9t/ep-1".decode("utf-8"), "n": 12345}}},
+            {"fvCEp": {"attributes": {"dn": "ep-2", "list": [1, 2.5, True, None]}}},
+            {"fvCEp": {"attributes": {"dn": "ep-3", "escaped": "a\"b\\\\c}]"}}},
+        ],
+    }
+    body = json.dumps(js, ensure_ascii=False).encode("utf-8")
+    for size in [1, 2, 3, 7, 64, len(body)]:
+        stream = ImdataStream(chunked(body, size))
+        assert list(stream) == js["imdata"]
+        assert stream.count == 3
+        assert stream.attributes["totalCount"] == "3"
+
+    # whitespace and totalCount after imdata
+    body = ' { "imdata" : [ {"a": 1} , {"b": 2} ] ,\n "totalCount" : "2" } '
+    stream = ImdataStream(chunked(body, 2))
+    assert list(stream) == [{"a":1}, {"b":2}]
+    assert stream.attributes["totalCount"] == "2"
+
+def test_imdata_stream_empty():
+    # empty imdata and empty reply yield no objects
+    stream = ImdataStream(chunked('{"totalCount":"0","imdata":[]}', 3))
+    assert list(stream) == []
+    assert stream.count == 0
+    assert stream.attributes["totalCount"] == "0"
+
+    stream = ImdataStream(["{", "}"])
+    assert list(stream) == []
+    assert "totalCount" not in stream.attributes
+
+def test_imdata_stream_error():
+    # error imdata is returned as an object and invalid or truncated replies raise ValueError
+    body = json.dumps(error_reply("invalid class"))
+    stream = ImdataStream(chunked(body, 5))
+    objects = list(stream)
+    assert len(objects) == 1
+    assert objects[0]["error"]["attributes"]["text"] == "invalid class"
+
+    for body in ['{"totalCount":"1","imdata":[{"a":1}', '{"imdata":[{"a":1} {"b":2}]}',
+                 '["imdata"]', '']:
+        with pytest.raises(ValueError):
+            list(ImdataStream(chunked(body, 4)))
+
+def test_get_pages_in_order():
+    # pages requested concurrently are yielded in order
+    session = FakeSession(total=23, page_size=2, delay=0.01)
+    pages = aci_utils.get_pages(session, "/api/class/fvCEp.json", page_size=2,
+                                page_concurrency=4)
+    assert pages is not None
+    results = []
+    for page in pages: results.append(page)
+    assert len(results) == 12
+    assert sum(results, []) == session.objects
+    assert sorted(session.requests) == range(0, 12)
+
+    # same result with serial requests and through get
+    session = FakeSession(total=23, page_size=2)
+    assert aci_utils.get(session, "/api/class/fvCEp.json", page_size=2) == session.objects
+    assert session.requests == range(0, 12)
+
+    # limit stops within a page
+    session = FakeSession(total=23, page_size=2)
+    results = aci_utils.get(session, "/api/class/fvCEp.json", page_size=2, limit=5,
+                            page_concurrency=4)
+    assert results == session.objects[0:5]
+
+def test_get_pages_error():
+    # error reply on first page returns None and on later page raises from generator
+    session = FakeSession(total=10, page_size=2, fail=[0])
+    assert aci_utils.get_pages(session, "/api/class/fvCEp.json", page_size=2) is None
+    assert aci_utils.get(session, "/api/class/fvCEp.json", page_size=2) is None
+
+    session = FakeSession(total=10, page_size=2, fail=[3])
+    pages = aci_utils.get_pages(session, "/api/class/fvCEp.json", page_size=2,
+                                page_concurrency=2)
+    with pytest.raises(Exception):
+        for page in pages: pass
+    assert aci_utils.get(session, "/api/class/fvCEp.json", page_size=2,
+                        page_concurrency=2) is None
+
+def test_get_objects_stream():
+    # streamed get yields all objects across pages and closes each response
+    session = FakeSession(total=7, page_size=3)
+    objects = aci_utils.get(session, "/api/class/fvCEp.json", page_size=3, stream=True,
+                            chunk_size=5)
+    assert list(objects) == session.objects
+    assert session.requests == [0, 1, 2]
+    assert all([r.closed for r in session.responses])
+
+    # error reply on first page returns None and on later page raises from generator
+    session = FakeSession(total=7, page_size=3, fail=[0])
+    assert aci_utils.get(session, "/api/class/fvCEp.json", page_size=3, stream=True) is None
+    assert all([r.closed for r in session.responses])
+    session = FakeSession(total=7, page_size=3, fail=[1])
+    objects = aci_utils.get(session, "/api/class/fvCEp.json", page_size=3, stream=True)
+    with pytest.raises(Exception):
+        for o in objects: pass
+
+def test_get_objects_stream_prefetch():
+    # streamed get with page_concurrency prefetches a bounded number of pages while the
+    # current page is parsed and still yields objects in order
+    session = FakeSession(total=23, page_size=2, delay=0.005)
+    objects = aci_utils.get(session, "/api/class/fvCEp.json", page_size=2, stream=True,
+                            chunk_size=5, page_concurrency=4)
+    first = next(objects)
+    time.sleep(0.2)
+    assert sorted(session.requests) == [0, 1, 2, 3, 4]
+    assert [first] + list(objects) == session.objects
+    assert sorted(session.requests) == range(0, 12)
+    assert all([r.closed for r in session.responses])
+
+    # limit stops the generator and all prefetched responses are closed
+    session = FakeSession(total=23, page_size=2)
+    objects = aci_utils.get(session, "/api/class/fvCEp.json", page_size=2, stream=True,
+                            limit=5, page_concurrency=4)
+    assert list(objects) == session.objects[0:5]
+    assert all([r.closed for r in session.responses])
+
+    # error reply on a prefetched page raises from generator
+    session = FakeSession(total=23, page_size=2, fail=[2])
+    objects = aci_utils.get(session, "/api/class/fvCEp.json", page_size=2, stream=True,
+                            page_concurrency=4)
+    with pytest.raises(Exception):
+        for o in objects: pass
+    assert all([r.closed for r in session.responses])
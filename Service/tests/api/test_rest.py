@@ -2,7 +2,7 @@
 test generic rest object implementation
 """
 from werkzeug.exceptions import (NotFound, BadRequest)
-from app.models.rest import (Rest, api_register)
+from app.models.rest import (Rest, api_register, IdentityMap)
 import logging, json
 import pytest
 
@@ -97,6 +97,24 @@ class Rest_Secure(Rest):
     }
 
 
+# Test class with large attribute excluded from bulk reads
+@api_register(path="test/bulk")
+class Rest_Bulk(Rest):
+    META_ACCESS = {
+        "bulk_read": True,
+    }
+    META = {
+            "key": {"key": True, "type":str},
+            "small": {"type": str},
+            "large": {
+                "type": list,
+                "subtype": str,
+                "bulk_read": False,
+                "description": "large attribute only returned on direct read or include"
+            }
+    }
+
+
 def pretty_print(js):
     """ try to convert json to pretty-print format """
     try:
@@ -134,6 +152,7 @@ def rest_cleanup(request, app):
         db.test.rest.drop()
         db.test.secure.drop()
         db.dynamic.test.drop()
+        db.test.bulk.drop()
     request.addfinalizer(teardown)
     return
 
@@ -470,6 +489,9 @@ def test_rest_filter():
         "and(eq(\"int\",1), eq(\"str\",\"1\"), eq(\"bool\",True))": {"$and":[
                                         {"int":1},{"str":"1"},{"bool":True}]},
 
+        # parenthesis within strings
+        "and(eq(\"str\",\"a)\"), eq(\"int\",5))": {"$and":[{"str":"a)"},{"int":5}]},
+
         # logical operators that should fail
         "and(eq(\"int\",1))": None,         # require at least 2 ops for and/or
         "and(eq(\"int\",1)":None,           # missing close parentheses 
@@ -500,6 +522,18 @@ def test_rest_filter():
         if r is None: assert_bad_request(t.filter, {}, params={"filter":k})
         else: assert t.filter({}, params={"filter":k}) == r
 
+def test_rest_filter_cache():
+    # verify cached filters are returned as copies that can be modified by the caller
+    t = get_test_object({
+        "str": {"type":str },
+        "int": {"type": int },
+    })
+    fs = "and(eq(\"str\",\"1\"), or(eq(\"int\",5), eq(\"int\",7)))"
+    r1 = t.filter({}, params={"filter":fs})
+    r1["$and"].append({"int": 9})
+    r2 = t.filter({}, params={"filter":fs})
+    assert r2 == {"$and":[{"str":"1"}, {"$or":[{"int":5},{"int":7}]}]}
+
 def test_rest_api_create_invalid(app, rest_cleanup):
     # create with invalid values and ensure bad_request returned
     # refer to Rest_TestClass
@@ -1007,7 +1041,140 @@ def test_rest_update_no_change(app, rest_cleanup):
     assert t.save()
     assert t.save()    
 
+def test_rest_read_count_paging(app, rest_cleanup):
+    # count is the total number of matching objects independent of page and page-size
+    for x in xrange(0,5):
+        r = app.client.post(rest_url, data=json.dumps({
+            "key": "key%s" % x,
+            "int": x
+        }), content_type='application/json')
+        assert r.status_code == good_request
+
+    for (page, pagesize, expected) in [(0, 2, 2), (2, 2, 1), (3, 2, 0), (0, 10, 5), (1, 5, 0)]:
+        r = app.client.get("%s?page=%s&page-size=%s" % (rest_url, page, pagesize))
+        assert r.status_code == good_request
+        obj = json.loads(r.data)
+        assert obj["count"] == 5
+        assert len(obj["objects"]) == expected
 
+    # count only request
+    r = app.client.get("%s?count=1" % rest_url)
+    assert r.status_code == good_request
+    obj = json.loads(r.data)
+    assert obj["count"] == 5
+    assert len(obj["objects"]) == 0
 
+    # count with filter
+    r = app.client.get("%s?filter=%s&page-size=1" % (rest_url, "gt(\"int\",1)"))
+    assert r.status_code == good_request
+    obj = json.loads(r.data)
+    assert obj["count"] == 3
+    assert len(obj["objects"]) == 1
 
+def test_rest_read_bulk_exclude(app, rest_cleanup):
+    # attributes with bulk_read disabled are excluded from bulk api reads unless included
+    bulk_url = "/api/test/bulk"
+    for x in xrange(0,3):
+        r = app.client.post(bulk_url, data=json.dumps({
+            "key": "key%s" % x,
+            "small": "small%s" % x,
+            "large": ["l%s" % i for i in xrange(0, 10)]
+        }), content_type='application/json')
+        assert r.status_code == good_request
+
+    r = app.client.get(bulk_url)
+    assert r.status_code == good_request
+    obj = json.loads(r.data)
+    assert obj["count"] == 3
+    for o in obj["objects"]:
+        assert "small" in o
+        assert "large" not in o
+
+    r = app.client.get("%s?include=key,large" % bulk_url)
+    assert r.status_code == good_request
+    obj = json.loads(r.data)
+    assert obj["count"] == 3
+    for o in obj["objects"]:
+        assert len(o["large"]) == 10
+
+    # direct read of single object and load return all attributes
+    r = app.client.get("%s/key1" % bulk_url)
+    assert r.status_code == good_request
+    obj = json.loads(r.data)
+    assert obj["count"] == 1
+    assert len(obj["objects"][0]["large"]) == 10
+    t = Rest_Bulk.load(key="key2")
+    assert t.exists()
+    assert len(t.large) == 10
+
+def test_rest_read_stream(app, rest_cleanup):
+    # stream=1 or accept application/x-ndjson returns one json object per line
+    for x in xrange(0,5):
+        r = app.client.post(rest_url, data=json.dumps({
+            "key": "key%s" % x,
+            "int": x
+        }), content_type='application/json')
+        assert r.status_code == good_request
+
+    r = app.client.get("%s?stream=1&sort=int|asc" % rest_url)
+    assert r.status_code == good_request
+    assert r.mimetype == "application/x-ndjson"
+    objects = [json.loads(l) for l in r.data.strip().split("\n")]
+    assert len(objects) == 5
+    for x, o in enumerate(objects):
+        assert o["key"] == "key%s" % x
+        assert o["int"] == x
+
+    r = app.client.get("%s?page-size=2" % rest_url, headers={"Accept":"application/x-ndjson"})
+    assert r.status_code == good_request
+    assert r.mimetype == "application/x-ndjson"
+    assert len(r.data.strip().split("\n")) == 2
+
+    # direct read of single object is also streamed
+    r = app.client.get("%s?stream=1" % rest_url_key.format("key1"))
+    assert r.status_code == good_request
+    objects = [json.loads(l) for l in r.data.strip().split("\n")]
+    assert len(objects) == 1
+    assert objects[0]["key"] == "key1"
+
+    # count requests return the normal json response
+    r = app.client.get("%s?stream=1&count=1" % rest_url)
+    assert r.status_code == good_request
+    assert r.mimetype == "application/json"
+    assert json.loads(r.data)["count"] == 5
+
+def test_rest_identity_map(app, rest_cleanup):
+    # within an identity map scope, load by keys returns the same instance until the class is
+    # modified
+    t = Rest_Secure.load(key="key1")
+    assert t.save()
 
+    with IdentityMap() as imap:
+        t1 = Rest_Secure.load(key="key1")
+        t2 = Rest_Secure.load(key="key1")
+        assert t1.exists()
+        assert t1 is t2
+        assert imap.hits == 1
+        assert imap.misses == 1
+
+        # load with non-key attributes is never cached
+        t3 = Rest_Secure.load(key="key1", encrypt="value")
+        assert t3 is not t1
+
+        # save invalidates all objects for the class
+        t1.encrypt = "encrypt"
+        assert t1.save()
+        t4 = Rest_Secure.load(key="key1")
+        assert t4 is not t1
+        assert t4.encrypt == "encrypt"
+        assert imap.misses == 2
+
+        # remove invalidates all objects for the class
+        assert t4.remove()
+        t5 = Rest_Secure.load(key="key1")
+        assert not t5.exists()
+
+    # outside of scope each load performs a new read
+    t1 = Rest_Secure.load(key="key2")
+    t2 = Rest_Secure.load(key="key2")
+    assert t1 is not t2
@@ -170,6 +170,38 @@ def test_api_session_csfr_token(app, userprep):
     response = c.get("%s?app_token=bad_token" % class_url)
     assert response.status_code == 401
 
+def test_api_session_expire_at(app, userprep):
+    # ensure session is created with expire_at date matching session timeout for ttl index
+    s = Session.load(username="admin", _bulk=True)
+    assert len(s) > 0
+    for session in s:
+        assert isinstance(session.expire_at, datetime.datetime)
+        # db stores dates with millisecond precision
+        delta = session.expire_at - datetime.datetime.utcfromtimestamp(session.timeout)
+        assert abs(delta.total_seconds()) < 1
+
+def test_api_session_cache_user_delete(app, userprep):
+    # ensure cached session is no longer valid after user is deleted
+
+    create_test_user(username="test_user", password="password")
+    c = app.test_client()
+    response = c.post(login_url, data=json.dumps({
+        "username": "test_user",
+        "password": "password",
+    }), content_type="application/json")
+    assert response.status_code == 200
+
+    # second read is served from session cache
+    response = c.get(class_url)
+    assert response.status_code == 200
+    response = c.get(class_url)
+    assert response.status_code == 200
+
+    response = app.client.delete(keyed_url.format("test_user"))
+    assert response.status_code == 200
+
+    response = c.get(class_url)
+    assert response.status_code == 401
 
 def test_api_create_user_incomplete_data(app, userprep):
     # create a user with no data
@@ -39,6 +39,7 @@ export class Comparison {
   classnames: string[];
   definition: string;
   dynamic: boolean;
+  equal_mode: string;
   error: string;
   nodes: string[];
   progress: number;
@@ -70,6 +71,7 @@ export class Comparison {
     this.remap = true;
     this.serialize = false;
     this.severity = 'info';
+    this.equal_mode = 'full';
   }
 
 }